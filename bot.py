@@ -5,36 +5,167 @@
 # ├── logger.py            # Логирование
 # ├── db.py                # Хранение ролей в памяти
 # ├── bot.log              # Логи
+# ├── slow_traces.jsonl    # Трассировки медленных апдейтов и проверок
 # ├── roles.db             # БД
+# ├── results_cache.db     # Кэш результатов проверок
 # ├── requirements.txt     # Зависимости
 # ├── README.md            # Документация
 # ├── .env                 # Переменные окружения
 # ├── .gitignore           # Игнорируемые файлы
 # ├── services/api.py      # Взаимодействие с FastAPI-сервисом
+# ├── services/scheduler.py # Очередь проверок документов
+# ├── services/result_cache.py # Кэш результатов проверок
+# ├── services/rules_cache.py # Кэш правил и типов документов
+# ├── services/fsm_storage.py # Хранение состояний диалогов (FSM) в SQLite
+# ├── services/files.py    # Скачивание файлов из Telegram
+# ├── services/prevalidation.py # Быстрая локальная проверка файлов перед отправкой в API
+# ├── services/classifier.py # Разбор ошибок проверки по аспектам
+# ├── services/formatting.py # Форматирование результатов и разбивка длинных сообщений
+# ├── services/report.py   # Отчёт о проверке в виде HTML-файла
+# ├── services/delivery.py # Отправка сообщений с учётом лимитов Telegram
+# ├── services/ratelimit.py # Token bucket для ограничения частоты
+# ├── services/metrics.py  # Метрики в формате Prometheus
+# ├── services/tracing.py  # Трассировка обработки апдейтов и проверок
+# ├── supervisor.py        # Запуск нескольких процессов-воркеров за одним вебхуком
+# ├── middlewares/tracing.py # Трассировка на каждый апдейт
+# ├── middlewares/dedup.py # Отсев повторно доставленных апдейтов
+# ├── middlewares/role.py  # Определение роли пользователя для хендлеров
+# ├── middlewares/throttling.py # Ограничение частоты запросов
+# ├── middlewares/metrics.py # Число вызовов и время работы хендлеров
 # └── handlers/
 #     ├── start.py         # Команды start и set_reviewer
 #     ├── documents.py     # Команды для работы с документами
-#     └── rules.py         # Получение и изменение правил
+#     ├── rules.py         # Получение и изменение правил
+#     └── reports.py       # Статистика и выгрузка проверок для нормоконтролёров
+
+import asyncio
 
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from config import BOT_TOKEN
-from db import init_db
-from handlers import start, documents, rules
+from config import (BOT_TOKEN, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+                    WEBHOOK_SECRET, WEBHOOK_SET, WORKER_PROCESSES, METRICS_HOST, METRICS_PORT)
+from db import init_db, activity_flusher, flush_activity, close_db, history_compactor, fsm_sweeper
+from handlers import start, documents, rules, reports
 from logger import logger
+from middlewares import dedup, role, throttling, tracing, metrics as handler_metrics
+from services import api, metrics, rules_cache
+from services.fsm_storage import SQLiteStorage
+from services.result_cache import init_result_cache, close_result_cache
+from services.scheduler import scheduler
+import supervisor
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=SQLiteStorage())
 
-init_db()
+tracing.register(dp)
+dedup.register(dp)
+role.register(dp)
+throttling.register(dp)
+handler_metrics.register(dp)
 
 start.register(dp)
 documents.register(dp)
 rules.register(dp)
+reports.register(dp)
+
+
+background_tasks = set()
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def on_startup(worker_index: int = 0, workers: int = 1):
+    await init_db()
+    await init_result_cache()
+    await api.init_session()
+    # Прогрев в фоне: бот не ждёт API при старте
+    run_in_background(rules_cache.warm_up())
+    await scheduler.start(bot, documents.run_validation_job, gate=api.validation_retry_after)
+    await documents.resume_validation_jobs(bot, worker_index, workers)
+    await metrics.start_server(METRICS_HOST, METRICS_PORT and METRICS_PORT + worker_index)
+    run_in_background(activity_flusher())
+    # При нескольких воркерах историю и сессии FSM чистит только первый
+    if worker_index == 0:
+        run_in_background(history_compactor())
+        run_in_background(fsm_sweeper())
+
+
+async def on_shutdown():
+    for task in list(background_tasks):
+        task.cancel()
+    await scheduler.stop()
+    await metrics.stop_server()
+    await api.close_session()
+    await flush_activity()
+    await close_result_cache()
+    await close_db()
+
+
+async def on_webhook_startup():
+    if not WEBHOOK_SET:
+        # Локальная отладка: Telegram не знает об адресе, обновления присылаются на него вручную
+        logger.info("Вебхук не регистрируется в Telegram, ожидаю обновления на %s:%s%s",
+                    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        return
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info("Вебхук установлен: %s%s", WEBHOOK_BASE_URL.rstrip('/'), WEBHOOK_PATH)
+
+
+async def on_webhook_shutdown():
+    await bot.session.close()
+
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
+def run_webhook():
+    dp.startup.register(on_webhook_startup)
+    dp.shutdown.register(on_webhook_shutdown)
+
+    app = web.Application()
+    # Telegram получает 200 сразу, обновление обрабатывается в фоне; чужие запросы отсекаются по секрету
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)
+
+
+async def on_supervisor_startup():
+    # Схемы БД создаются и мигрируются один раз до запуска воркеров, а не наперегонки в каждом из них
+    await init_db()
+    await init_result_cache()
+    await close_result_cache()
+    await close_db()
+    await on_webhook_startup()
+
+
+def worker_main(index, queue, workers, log_queue):
+    supervisor.run_worker(bot, dp, index, queue, workers, log_queue)
+
 
 if __name__ == "__main__":
-    logger.info("🔁 Бот запущен.")
+    logger.info("🔁 Бот запущен в режиме %s.", BOT_MODE)
     try:
-        dp.run_polling(bot)
+        if WORKER_PROCESSES > 1:
+            supervisor.run_supervisor(WORKER_PROCESSES, worker_main, on_supervisor_startup, on_webhook_shutdown)
+        elif BOT_MODE == "webhook":
+            run_webhook()
+        else:
+            dp.run_polling(bot)
     except Exception as e:
-        logger.critical(f"🔥 Критическая ошибка: {e}")
+        logger.critical("🔥 Критическая ошибка: %s", e)
@@ -8,3 +8,133 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SECRET_CODE = os.getenv("SECRET_CODE")
 API_URL = os.getenv("API_URL")
 ADMIN_USER_ID = os.getenv("ADMIN_USER_ID")
+
+# HTTP-клиент для document-checker
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "20"))
+API_KEEPALIVE_TIMEOUT = float(os.getenv("API_KEEPALIVE_TIMEOUT", "30"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "10"))
+API_LOOKUP_TIMEOUT = float(os.getenv("API_LOOKUP_TIMEOUT", "15"))
+API_UPDATE_TIMEOUT = float(os.getenv("API_UPDATE_TIMEOUT", "30"))
+# Таймаут проверки: базовый плюс секунды на каждый МБ файлов, но не больше API_VALIDATE_TIMEOUT
+API_VALIDATE_TIMEOUT = float(os.getenv("API_VALIDATE_TIMEOUT", "300"))
+API_VALIDATE_TIMEOUT_BASE = float(os.getenv("API_VALIDATE_TIMEOUT_BASE", "60"))
+API_VALIDATE_TIMEOUT_PER_MB = float(os.getenv("API_VALIDATE_TIMEOUT_PER_MB", "20"))
+# Circuit breaker: после скольких сбоев подряд запросы к API приостанавливаются и на сколько секунд
+API_BREAKER_FAILURES = int(os.getenv("API_BREAKER_FAILURES", "5"))
+API_BREAKER_RECOVERY = float(os.getenv("API_BREAKER_RECOVERY", "30"))
+# Повторы GET-запросов (типы документов, правила) с экспоненциальной задержкой
+API_GET_RETRIES = int(os.getenv("API_GET_RETRIES", "3"))
+API_RETRY_BASE_DELAY = float(os.getenv("API_RETRY_BASE_DELAY", "0.5"))
+API_RETRY_MAX_DELAY = float(os.getenv("API_RETRY_MAX_DELAY", "5"))
+
+# Очередь проверок документов
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", "4"))
+VALIDATION_CONCURRENCY = int(os.getenv("VALIDATION_CONCURRENCY", "4"))
+QUEUE_POSITION_UPDATE_INTERVAL = float(os.getenv("QUEUE_POSITION_UPDATE_INTERVAL", "3"))
+
+# Кэш результатов проверок (SQLite рядом с roles.db)
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "results_cache.db")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(3 * 24 * 60 * 60)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+
+# Кэш правил и типов документов
+RULES_CACHE_TTL = float(os.getenv("RULES_CACHE_TTL", "300"))
+RULES_CACHE_MAX_STALE = float(os.getenv("RULES_CACHE_MAX_STALE", "3600"))
+
+# Кэш ролей и отложенная запись активности пользователей. ROLE_CACHE_TTL ограничивает, сколько секунд
+# воркер может не видеть смену роли, сделанную в другом процессе
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "10000"))
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "60"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+
+# SQLite. В docker-compose база лежит в смонтированном каталоге вместе с файлами -wal и -shm
+DB_PATH = os.getenv("DB_PATH", "roles.db")
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+
+# История проверок: 0 — хранить без ограничения срока
+CHECK_HISTORY_RETENTION_DAYS = int(os.getenv("CHECK_HISTORY_RETENTION_DAYS", "730"))
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", str(6 * 60 * 60)))
+
+RECENT_CHECKS_PAGE_SIZE = int(os.getenv("RECENT_CHECKS_PAGE_SIZE", "15"))
+
+# Скачивание файлов из Telegram: до порога файл держится в памяти, выше — во временном файле
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+TELEGRAM_DOWNLOAD_TIMEOUT = int(os.getenv("TELEGRAM_DOWNLOAD_TIMEOUT", "120"))
+# Bot API отдаёт боту файлы не больше 20 МБ
+TELEGRAM_DOWNLOAD_LIMIT = int(os.getenv("TELEGRAM_DOWNLOAD_LIMIT", str(20 * 1024 * 1024)))
+
+# Локальная предварительная проверка: сколько байт из начала .tex/.sty читается для анализа
+PREVALIDATION_SNIFF_BYTES = int(os.getenv("PREVALIDATION_SNIFF_BYTES", str(64 * 1024)))
+
+# Лимиты отправки сообщений в Telegram (сообщений в секунду, 0 — без ограничения) и число повторов после 429
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Отчёт длиннее порога (в символах) отправляется HTML-файлом; REPORT_COMPRESS=1 — сжимать его gzip
+REPORT_ATTACHMENT_THRESHOLD = int(os.getenv("REPORT_ATTACHMENT_THRESHOLD", "8192"))
+REPORT_COMPRESS = os.getenv("REPORT_COMPRESS", "0") == "1"
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Вебхук: публичный адрес, путь и адрес, на котором слушает aiohttp.
+# WEBHOOK_SET=0 — не регистрировать вебхук в Telegram (для локальной отправки обновлений вручную)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_SET = os.getenv("WEBHOOK_SET", "1") == "1"
+
+# Число процессов-воркеров в режиме вебхука (1 — всё в одном процессе) и сколько ждать их остановки
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Сколько процессов обрабатывают обновления. У каждого свои счётчики глобальных лимитов
+# (TELEGRAM_GLOBAL_RATE, THROTTLE_GLOBAL_*), поэтому лимиты делятся между ними поровну
+WORKER_PROCESSES = BOT_WORKERS if BOT_MODE == "webhook" and BOT_WORKERS > 1 else 1
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "30"))
+
+# Сессии FSM (незавершённые проверки) хранятся в БД; заброшенные удаляются через FSM_STATE_TTL секунд
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "3600"))
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "600"))
+
+# Журнал заданий: сколько раз задание перезапускается после сбоя и сколько хранятся завершённые записи
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+FINISHED_JOBS_RETENTION = int(os.getenv("FINISHED_JOBS_RETENTION", str(7 * 24 * 3600)))
+
+# Защита от повторной доставки апдейтов: сколько секунд и сколько последних update_id помнить
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", "600"))
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+
+# Ограничение частоты команд (запросов в минуту и запас на всплеск) для студентов;
+# квота нормоконтролёров больше в THROTTLE_REVIEWER_FACTOR раз. Общие лимиты — на всех пользователей сразу.
+# Значение 0 в *_PER_MIN отключает соответствующий лимит
+THROTTLE_VALIDATION_PER_MIN = float(os.getenv("THROTTLE_VALIDATION_PER_MIN", "3"))
+THROTTLE_VALIDATION_BURST = float(os.getenv("THROTTLE_VALIDATION_BURST", "3"))
+THROTTLE_LOOKUP_PER_MIN = float(os.getenv("THROTTLE_LOOKUP_PER_MIN", "20"))
+THROTTLE_LOOKUP_BURST = float(os.getenv("THROTTLE_LOOKUP_BURST", "10"))
+THROTTLE_REVIEWER_FACTOR = float(os.getenv("THROTTLE_REVIEWER_FACTOR", "5"))
+THROTTLE_GLOBAL_VALIDATION_PER_MIN = float(os.getenv("THROTTLE_GLOBAL_VALIDATION_PER_MIN", "60"))
+THROTTLE_GLOBAL_LOOKUP_PER_MIN = float(os.getenv("THROTTLE_GLOBAL_LOOKUP_PER_MIN", "600"))
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — не запускать).
+# При нескольких процессах-воркерах воркер с номером i слушает METRICS_PORT + i
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Трассировки апдейтов и заданий дольше TRACE_SLOW_THRESHOLD секунд дописываются в TRACE_SLOW_FILE (JSONL)
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "30"))
+TRACE_SLOW_FILE = os.getenv("TRACE_SLOW_FILE", "slow_traces.jsonl")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200"))
+
+# Лог: ротация по размеру (size), по времени (time, период LOG_ROTATE_WHEN) или без неё (none);
+# старые файлы сжимаются gzip. LOG_FORMAT=json — по записи JSON на строку
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") == "1"
@@ -1,125 +1,663 @@
+import asyncio
+import json
 import sqlite3
-from datetime import datetime, timezone, timedelta
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timezone, timedelta
+from typing import Any, Callable, Iterator
 
-DB_NAME = "roles.db"
+from config import (DB_PATH, ROLE_CACHE_SIZE, ROLE_CACHE_TTL, ACTIVITY_FLUSH_INTERVAL, DB_BUSY_TIMEOUT,
+                    DB_CACHE_SIZE_KB, CHECK_HISTORY_RETENTION_DAYS, HISTORY_COMPACT_INTERVAL, RECENT_CHECKS_PAGE_SIZE,
+                    FSM_STATE_TTL, FSM_SWEEP_INTERVAL, FINISHED_JOBS_RETENTION)
+from logger import logger
+from services.metrics import DB_QUERY_SECONDS
+from services.tracing import span
 
 STUDENT_ROLE = "student"
 REVIEWER_ROLE = "reviewer"
 
 TIMEDELTA_FOR_LAST_ACTIVE = 10
 
+# Время проверок хранится со сдвигом на иркутское время
+CHECK_TIME_OFFSET = timedelta(hours=8)
 
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# Статусы заданий в журнале validation_jobs
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+# Результат начал отправляться пользователю: такое задание больше не повторяется, чтобы отчёт не пришёл дважды
+JOB_DELIVERING = "delivering"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Порядок вывода типов документов в отчётах для нормоконтролёров
+DOC_TYPE_ORDER = ("diploma", "course_work", "practice_report")
+
+# user_id -> (роль, last_active, момент чтения из БД по time.monotonic)
+_role_cache: OrderedDict[int, tuple[str, datetime | None, float]] = OrderedDict()
+# user_id -> (username, last_active), ещё не записанные в БД
+_pending_activity: dict[int, tuple[str | None, str]] = {}
+
+# Все запросы к SQLite выполняются в одном выделенном потоке на одном долгоживущем соединении
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+_connection: sqlite3.Connection | None = None
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    # Транзакция сразу берёт блокировку на запись: при нескольких процессах-воркерах ожидание
+    # занятой БД укладывается в busy_timeout, а не обрывается ошибкой при повышении блокировки
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level="IMMEDIATE")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = open_connection(DB_PATH)
+    return _connection
+
+
+async def run_in_db_thread(func: Callable[..., Any], *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def _run(func: Callable[..., Any], *args) -> Any:
+    # func(conn, *args) выполняется в потоке БД внутри одной транзакции
+    def call():
+        conn = _get_connection()
+        with DB_QUERY_SECONDS.labels("roles", func.__name__.lstrip("_")).time(), conn:
+            return func(conn, *args)
+
+    with span(f"db.{func.__name__.lstrip('_')}"):
+        return await run_in_db_thread(call)
+
+
+async def close_db():
+    def close():
+        global _connection
+        if _connection is not None:
+            _connection.execute("PRAGMA optimize")
+            _connection.close()
+            _connection = None
+
+    await run_in_db_thread(close)
+
+
+def _init_db(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS roles (
+            user_id INTEGER PRIMARY KEY,
+            role TEXT NOT NULL,
+            username TEXT,
+            registered_at TEXT,
+            last_active TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checks_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            doc_type TEXT,
+            check_type TEXT,
+            result TEXT,
+            file_hash TEXT,
+            duration REAL,
+            error_count INTEGER,
+            check_time TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES roles(user_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checks_history_time ON checks_history (check_time)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_checks_history_doc_type_time ON checks_history (doc_type, check_time)"
+    )
+
+    # Миграция со старой таблицы, где хранилась только последняя проверка каждого пользователя
+    legacy = cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users_checks'"
+    ).fetchone()
+    if legacy:
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS roles (
-                user_id INTEGER PRIMARY KEY,
-                role TEXT NOT NULL,
-                username TEXT,
-                registered_at TEXT,
-                last_active TEXT
-            )
+            INSERT INTO checks_history (user_id, doc_type, check_type, result, check_time)
+            SELECT user_id, doc_type, check_type, result, check_time
+            FROM users_checks
+            WHERE check_time IS NOT NULL
         ''')
+        migrated = cursor.rowcount
+        cursor.execute("DROP TABLE users_checks")
+        logger.info("Проверки перенесены из users_checks в checks_history: %s", migrated)
 
+    # Дневные агрегаты для /stats, обновляются вместе с каждой записью в checks_history
+    stats_exist = cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'checks_daily_stats'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checks_daily_stats (
+            day TEXT NOT NULL,
+            doc_type TEXT NOT NULL,
+            check_type TEXT NOT NULL,
+            result TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, doc_type, check_type, result)
+        ) WITHOUT ROWID
+    ''')
+    if not stats_exist:
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users_checks (
-                user_id INTEGER PRIMARY KEY,
-                doc_type TEXT,
-                check_type TEXT,
-                result TEXT,
-                check_time TEXT,
-                FOREIGN KEY (user_id) REFERENCES roles(user_id)
-            )
+            INSERT INTO checks_daily_stats (day, doc_type, check_type, result, count)
+            SELECT substr(check_time, 1, 10), COALESCE(doc_type, ''), COALESCE(check_type, ''),
+                   COALESCE(result, ''), COUNT(*)
+            FROM checks_history
+            GROUP BY 1, 2, 3, 4
         ''')
 
-        conn.commit()
+    # Состояния FSM: только состояние и компактные данные диалога в JSON
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)")
 
+    # Журнал заданий проверки: незавершённые задания подхватываются после перезапуска
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS validation_jobs (
+            job_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            username TEXT,
+            check_type TEXT NOT NULL,
+            doc_type TEXT NOT NULL,
+            files TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            status_message_id INTEGER,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validation_jobs_status ON validation_jobs (status, created_at)")
+
+
+async def init_db():
+    await _run(_init_db)
 
-def get_user_role(user_id: int, username: str = None) -> str:
-    now_utc = datetime.now(timezone.utc).isoformat()
 
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+def _select_role(conn: sqlite3.Connection, user_id: int) -> tuple | None:
+    return conn.execute("SELECT role, last_active FROM roles WHERE user_id = ?", (user_id,)).fetchone()
 
-        cursor.execute("SELECT role, last_active FROM roles WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
 
+async def get_user_role(user_id: int, username: str = None) -> str:
+    now = datetime.now(timezone.utc)
+
+    cached = _role_cache.get(user_id)
+    # Роль могли сменить в другом процессе-воркере: устаревшая запись перечитывается из БД
+    if cached is None or time.monotonic() - cached[2] > ROLE_CACHE_TTL:
+        loaded_at = time.monotonic()
+        result = await _run(_select_role, user_id)
         if result:
             role, last_active = result
-
-            # Обновляем last_active, если прошло более 10 минут
-            if last_active:
-                last_dt = datetime.fromisoformat(last_active)
-                if datetime.now(timezone.utc) - last_dt > timedelta(minutes=TIMEDELTA_FOR_LAST_ACTIVE):
-                    cursor.execute(
-                        "UPDATE roles SET last_active = ? WHERE user_id = ?",
-                        (now_utc, user_id)
-                    )
-            else:
-                cursor.execute(
-                    "UPDATE roles SET last_active = ? WHERE user_id = ?",
-                    (now_utc, user_id)
-                )
-
-            conn.commit()
-            return role
+            cached = (role, datetime.fromisoformat(last_active) if last_active else None, loaded_at)
         else:
-            # Если пользователь не найден, добавим как студента
-            cursor.execute('''
-                INSERT INTO roles (user_id, role, username, registered_at, last_active)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, STUDENT_ROLE, username, now_utc, now_utc))
-            conn.commit()
-            return STUDENT_ROLE
+            # Если пользователь не найден, он будет добавлен как студент при ближайшей записи активности
+            cached = (STUDENT_ROLE, None, loaded_at)
+
+    role, last_active, loaded_at = cached
+    # Обновляем last_active, если прошло более 10 минут; запись в БД откладывается до flush_activity
+    if last_active is None or now - last_active > timedelta(minutes=TIMEDELTA_FOR_LAST_ACTIVE):
+        _pending_activity[user_id] = (username, now.isoformat())
+        cached = (role, now, loaded_at)
+
+    _role_cache[user_id] = cached
+    _role_cache.move_to_end(user_id)
+    if len(_role_cache) > ROLE_CACHE_SIZE:
+        _role_cache.popitem(last=False)
+    return role
+
+
+def _upsert_activity(conn: sqlite3.Connection, pending: list[tuple]):
+    conn.executemany('''
+        INSERT INTO roles (user_id, role, username, registered_at, last_active)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            last_active = excluded.last_active,
+            username = COALESCE(roles.username, excluded.username),
+            registered_at = COALESCE(roles.registered_at, excluded.registered_at)
+    ''', pending)
+
+
+async def flush_activity() -> int:
+    if not _pending_activity:
+        return 0
+    pending = [
+        (user_id, STUDENT_ROLE, username, active_at, active_at)
+        for user_id, (username, active_at) in _pending_activity.items()
+    ]
+    _pending_activity.clear()
+    try:
+        await _run(_upsert_activity, pending)
+    except sqlite3.Error:
+        # Возвращаем незаписанную активность, если её ещё не перекрыла более свежая
+        for user_id, _, username, active_at, _ in pending:
+            _pending_activity.setdefault(user_id, (username, active_at))
+        raise
+    return len(pending)
+
+
+async def activity_flusher():
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+        try:
+            await flush_activity()
+        except sqlite3.Error as e:
+            logger.error("Ошибка при записи активности пользователей: %s", e)
+
+
+def _set_user_role(conn: sqlite3.Connection, user_id: int, role: str, now_utc: str):
+    conn.execute('''
+        INSERT INTO roles (user_id, role, last_active)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET role = excluded.role, last_active = excluded.last_active
+    ''', (user_id, role, now_utc))
 
 
-def set_user_role(user_id: int, role: str):
+async def set_user_role(user_id: int, role: str):
     now_utc = datetime.now(timezone.utc).isoformat()
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO roles (user_id, role, last_active)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET role = excluded.role, last_active = excluded.last_active
-        ''', (user_id, role, now_utc))
-        conn.commit()
-
-def get_recent_checks(days: int = 14) -> list[tuple]:
-    since = datetime.now(timezone.utc) - timedelta(days=days)
-    since_str = since.isoformat()
-
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.username, c.doc_type, c.check_type, c.result, c.check_time
-            FROM users_checks c
-            JOIN roles r ON c.user_id = r.user_id
-            WHERE c.check_time >= ?
-            ORDER BY 
-                CASE c.doc_type
-                    WHEN 'diploma' THEN 1
-                    WHEN 'course_work' THEN 2
-                    WHEN 'practice_report' THEN 3
-                    ELSE 4
-                END,
-                c.check_time DESC
-        ''', (since_str,))
-        return cursor.fetchall()
-
-def save_check_result(user_id: int, doc_type: str, check_type: str, result: str):
-    from datetime import datetime, timezone
-    check_time = datetime.now(timezone.utc).isoformat()
-
-    utc_now = datetime.now(timezone.utc)
-    check_time = (utc_now + timedelta(hours=8)).isoformat()
-
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO users_checks (user_id, doc_type, check_type, result, check_time)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, doc_type, check_type, result, check_time))
-        conn.commit()
+    await _run(_set_user_role, user_id, role, now_utc)
+    _role_cache.pop(user_id, None)
+
+
+@dataclass
+class ChecksPage:
+    # (id, username, doc_type, check_type, result, время в формате ДД.ММ.ГГГГ ЧЧ:ММ)
+    rows: list[tuple]
+    has_prev: bool
+    has_next: bool
+
+
+def _page_group_query(group: int, since_str: str, anchor: tuple | None, backwards: bool,
+                      limit: int) -> tuple[str, tuple]:
+    # Группа — один тип документа из DOC_TYPE_ORDER либо все остальные типы (последняя группа)
+    if group < len(DOC_TYPE_ORDER):
+        where, params = "c.doc_type = ?", [DOC_TYPE_ORDER[group]]
+    else:
+        # Проверки без типа (перенесённые из users_checks) тоже попадают в последнюю группу
+        placeholders = ", ".join("?" * len(DOC_TYPE_ORDER))
+        where, params = f"(c.doc_type IS NULL OR c.doc_type NOT IN ({placeholders}))", list(DOC_TYPE_ORDER)
+    where += " AND c.check_time >= ?"
+    params.append(since_str)
+    if anchor is not None:
+        where += " AND (c.check_time, c.id) > (?, ?)" if backwards else " AND (c.check_time, c.id) < (?, ?)"
+        params += anchor
+    order = "ASC" if backwards else "DESC"
+    params.append(limit)
+    return f'''
+        SELECT c.id, r.username, c.doc_type, c.check_type, c.result,
+               strftime('%d.%m.%Y %H:%M', c.check_time)
+        FROM checks_history c
+        LEFT JOIN roles r ON c.user_id = r.user_id
+        WHERE {where}
+        ORDER BY c.check_time {order}, c.id {order}
+        LIMIT ?
+    ''', tuple(params)
+
+
+def _group_of(doc_type: str) -> int:
+    return DOC_TYPE_ORDER.index(doc_type) if doc_type in DOC_TYPE_ORDER else len(DOC_TYPE_ORDER)
+
+
+def _get_checks_page(conn: sqlite3.Connection, since_str: str, anchor_id: int | None, backwards: bool,
+                     limit: int) -> ChecksPage:
+    # Keyset-пагинация по (группа типа документа, check_time, id): каждая страница — несколько
+    # диапазонных проходов индекса (doc_type, check_time) начиная с якорной записи
+    anchor = None
+    if anchor_id is not None:
+        anchor_row = conn.execute(
+            "SELECT doc_type, check_time FROM checks_history WHERE id = ?", (anchor_id,)
+        ).fetchone()
+        if anchor_row:
+            anchor = (anchor_row[1], anchor_id)
+            start_group = _group_of(anchor_row[0])
+    if anchor is None:
+        backwards = False
+        start_group = 0
+
+    groups = range(start_group, -1, -1) if backwards else range(start_group, len(DOC_TYPE_ORDER) + 1)
+    rows = []
+    for group in groups:
+        sql, params = _page_group_query(
+            group, since_str, anchor if group == start_group else None, backwards, limit + 1 - len(rows)
+        )
+        rows += conn.execute(sql, params).fetchall()
+        if len(rows) > limit:
+            break
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        return ChecksPage(rows=rows, has_prev=more, has_next=True)
+    return ChecksPage(rows=rows, has_prev=anchor is not None, has_next=more)
+
+
+async def get_checks_page(days: int = 14, anchor_id: int = None, backwards: bool = False,
+                          limit: int = RECENT_CHECKS_PAGE_SIZE) -> ChecksPage:
+    since = local_now() - timedelta(days=days)
+    return await _run(_get_checks_page, since.isoformat(), anchor_id, backwards, limit)
+
+
+def _save_check_result(conn: sqlite3.Connection, row: tuple, job_id: str | None) -> bool:
+    # Результат задания из журнала записывается только при первом завершении этого задания
+    if job_id is not None and not _finish_job(conn, job_id, JOB_DONE):
+        return False
+    conn.execute('''
+        INSERT INTO checks_history
+            (user_id, doc_type, check_type, result, file_hash, duration, error_count, check_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', row)
+    _, doc_type, check_type, result, _, _, _, check_time = row
+    conn.execute('''
+        INSERT INTO checks_daily_stats (day, doc_type, check_type, result, count)
+        VALUES (?, COALESCE(?, ''), COALESCE(?, ''), COALESCE(?, ''), 1)
+        ON CONFLICT (day, doc_type, check_type, result) DO UPDATE SET count = count + 1
+    ''', (check_time[:10], doc_type, check_type, result))
+    return True
+
+
+async def save_check_result(user_id: int, doc_type: str, check_type: str, result: str, file_hash: str = None,
+                            duration: float = None, error_count: int = None, job_id: str = None) -> bool:
+    check_time = local_now().isoformat()
+    return await _run(
+        _save_check_result,
+        (user_id, doc_type, check_type, result, file_hash, duration, error_count, check_time),
+        job_id
+    )
+
+
+EXPORT_COLUMNS = ("id", "check_time", "user_id", "username", "doc_type", "check_type", "result",
+                  "error_count", "duration", "file_hash")
+
+
+def iter_checks(conn: sqlite3.Connection, since_str: str, batch_size: int = 1000) -> Iterator[tuple]:
+    # Строки читаются курсором порциями, вся выборка в память не загружается
+    cursor = conn.execute('''
+        SELECT c.id, c.check_time, c.user_id, r.username, c.doc_type, c.check_type, c.result,
+               c.error_count, c.duration, c.file_hash
+        FROM checks_history c
+        LEFT JOIN roles r ON c.user_id = r.user_id
+        WHERE c.check_time >= ?
+        ORDER BY c.check_time
+    ''', (since_str,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def _get_daily_stats(conn: sqlite3.Connection, date_from: str, date_to: str) -> list[tuple]:
+    return conn.execute('''
+        SELECT day, doc_type, check_type,
+               SUM(CASE WHEN result = '1' THEN count ELSE 0 END),
+               SUM(CASE WHEN result = '1' THEN 0 ELSE count END)
+        FROM checks_daily_stats
+        WHERE day BETWEEN ? AND ?
+        GROUP BY day, doc_type, check_type
+        ORDER BY day DESC, doc_type, check_type
+    ''', (date_from, date_to)).fetchall()
+
+
+async def get_daily_stats(date_from: date, date_to: date) -> list[tuple]:
+    # (день, тип документа, тип проверки, без ошибок, с ошибками) по дням в локальном времени проверок
+    return await _run(_get_daily_stats, date_from.isoformat(), date_to.isoformat())
+
+
+def local_now() -> datetime:
+    # Текущее время в том же сдвиге, что и check_time: с ним сравниваются границы выборок по истории
+    return datetime.now(timezone.utc) + CHECK_TIME_OFFSET
+
+
+def local_today() -> date:
+    return local_now().date()
+
+
+def _compact_history(conn: sqlite3.Connection, before: str) -> int:
+    deleted = conn.execute("DELETE FROM checks_history WHERE check_time < ?", (before,)).rowcount
+    conn.execute("PRAGMA optimize")
+    return deleted
+
+
+async def compact_history(retention_days: int = CHECK_HISTORY_RETENTION_DAYS) -> int:
+    if retention_days <= 0:
+        return 0
+    before = local_now() - timedelta(days=retention_days)
+    deleted = await _run(_compact_history, before.isoformat())
+    if deleted:
+        logger.info("Из истории проверок удалено записей старше %s дней: %s", retention_days, deleted)
+    return deleted
+
+
+async def history_compactor():
+    while True:
+        try:
+            await compact_history()
+            await purge_finished_jobs()
+        except sqlite3.Error as e:
+            logger.error("Ошибка при очистке истории проверок: %s", e)
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+
+
+def _get_fsm_record(conn: sqlite3.Connection, key: str) -> tuple[str | None, dict]:
+    row = conn.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else (None, {})
+
+
+async def get_fsm_state(key: str) -> str | None:
+    state, _ = await _run(_get_fsm_record, key)
+    return state
+
+
+async def get_fsm_data(key: str) -> dict:
+    _, data = await _run(_get_fsm_record, key)
+    return data
+
+
+def _drop_empty_fsm_record(conn: sqlite3.Connection, key: str):
+    conn.execute("DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+
+def _set_fsm_state(conn: sqlite3.Connection, key: str, state: str | None):
+    conn.execute('''
+        INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', (key, state, time.time()))
+    _drop_empty_fsm_record(conn, key)
+
+
+async def set_fsm_state(key: str, state: str | None):
+    await _run(_set_fsm_state, key, state)
+
+
+def _set_fsm_data(conn: sqlite3.Connection, key: str, data: dict):
+    conn.execute('''
+        INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    ''', (key, json.dumps(data, ensure_ascii=False), time.time()))
+    _drop_empty_fsm_record(conn, key)
+
+
+async def set_fsm_data(key: str, data: dict):
+    await _run(_set_fsm_data, key, data)
+
+
+def _update_fsm_data(conn: sqlite3.Connection, key: str, data: dict) -> dict:
+    # Неявный BEGIN модуль sqlite3 выполняет только перед первым изменением, то есть уже после SELECT.
+    # Явный BEGIN IMMEDIATE берёт блокировку записи до чтения: другой процесс не изменит запись
+    # между чтением и записью, и параллельные обновления не затирают друг друга
+    conn.execute("BEGIN IMMEDIATE")
+    _, current = _get_fsm_record(conn, key)
+    current.update(data)
+    _set_fsm_data(conn, key, current)
+    return current
+
+
+async def update_fsm_data(key: str, data: dict) -> dict:
+    return await _run(_update_fsm_data, key, data)
+
+
+def _purge_fsm_states(conn: sqlite3.Connection, before: float) -> int:
+    return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)).rowcount
+
+
+async def purge_fsm_states(ttl: float = FSM_STATE_TTL) -> int:
+    purged = await _run(_purge_fsm_states, time.time() - ttl)
+    if purged:
+        logger.info("Удалено заброшенных сессий FSM: %s", purged)
+    return purged
+
+
+def _count_fsm_states(conn: sqlite3.Connection, since: float) -> int:
+    return conn.execute("SELECT COUNT(*) FROM fsm_states WHERE updated_at >= ?", (since,)).fetchone()[0]
+
+
+async def count_fsm_states(ttl: float = FSM_STATE_TTL) -> int:
+    return await _run(_count_fsm_states, time.time() - ttl)
+
+
+async def fsm_sweeper():
+    while True:
+        await asyncio.sleep(FSM_SWEEP_INTERVAL)
+        try:
+            await purge_fsm_states()
+        except sqlite3.Error as e:
+            logger.error("Ошибка при очистке сессий FSM: %s", e)
+
+
+@dataclass
+class JournaledJob:
+    job_id: str
+    user_id: int
+    chat_id: int
+    username: str | None
+    check_type: str
+    doc_type: str
+    files: list[dict]
+    status_message_id: int | None
+    attempts: int
+    status: str
+
+
+def _journal_job(conn: sqlite3.Connection, row: tuple):
+    conn.execute('''
+        INSERT OR IGNORE INTO validation_jobs
+            (job_id, user_id, chat_id, username, check_type, doc_type, files, status, status_message_id,
+             created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', row)
+
+
+async def journal_job(job_id: str, user_id: int, chat_id: int, username: str | None, check_type: str,
+                      doc_type: str, files: list[dict], status_message_id: int | None):
+    now = time.time()
+    await _run(_journal_job, (job_id, user_id, chat_id, username, check_type, doc_type,
+                              json.dumps(files, ensure_ascii=False), JOB_QUEUED, status_message_id, now, now))
+
+
+def _mark_job_running(conn: sqlite3.Connection, job_id: str, now: float):
+    conn.execute('''
+        UPDATE validation_jobs SET status = ?, attempts = attempts + 1, updated_at = ?
+        WHERE job_id = ? AND status IN (?, ?)
+    ''', (JOB_RUNNING, now, job_id, JOB_QUEUED, JOB_RUNNING))
+
+
+async def mark_job_running(job_id: str):
+    await _run(_mark_job_running, job_id, time.time())
+
+
+def _mark_job_delivering(conn: sqlite3.Connection, job_id: str, now: float):
+    conn.execute('''
+        UPDATE validation_jobs SET status = ?, updated_at = ?
+        WHERE job_id = ? AND status = ?
+    ''', (JOB_DELIVERING, now, job_id, JOB_RUNNING))
+
+
+async def mark_job_delivering(job_id: str):
+    await _run(_mark_job_delivering, job_id, time.time())
+
+
+def _requeue_job(conn: sqlite3.Connection, job_id: str, now: float):
+    conn.execute('''
+        UPDATE validation_jobs SET status = ?, attempts = MAX(attempts - 1, 0), updated_at = ?
+        WHERE job_id = ? AND status = ?
+    ''', (JOB_QUEUED, now, job_id, JOB_RUNNING))
+
+
+async def requeue_job(job_id: str):
+    # Попытка, которая не дошла до сервиса проверки, не засчитывается
+    await _run(_requeue_job, job_id, time.time())
+
+
+def _retry_job(conn: sqlite3.Connection, job_id: str, now: float) -> int | None:
+    updated = conn.execute('''
+        UPDATE validation_jobs SET status = ?, updated_at = ?
+        WHERE job_id = ? AND status = ?
+    ''', (JOB_QUEUED, now, job_id, JOB_RUNNING)).rowcount
+    if not updated:
+        return None
+    return conn.execute("SELECT attempts FROM validation_jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+
+async def retry_job(job_id: str) -> int | None:
+    # Попытка засчитана: задание возвращается в очередь с сохранённым числом попыток.
+    # Возвращает число попыток или None, если задание уже не выполняется
+    return await _run(_retry_job, job_id, time.time())
+
+
+def _finish_job(conn: sqlite3.Connection, job_id: str, status: str) -> bool:
+    return conn.execute('''
+        UPDATE validation_jobs SET status = ?, updated_at = ?
+        WHERE job_id = ? AND status IN (?, ?, ?)
+    ''', (status, time.time(), job_id, JOB_QUEUED, JOB_RUNNING, JOB_DELIVERING)).rowcount == 1
+
+
+async def fail_job(job_id: str) -> bool:
+    return await _run(_finish_job, job_id, JOB_FAILED)
+
+
+def _load_unfinished_jobs(conn: sqlite3.Connection, shard: int, shards: int) -> list[JournaledJob]:
+    # Остаток от деления в SQLite для отрицательных chat_id групп отрицательный, а шард выбирается
+    # по остатку Python (supervisor.shard_of), поэтому остаток приводится к неотрицательному
+    rows = conn.execute('''
+        SELECT job_id, user_id, chat_id, username, check_type, doc_type, files, status_message_id, attempts,
+               status
+        FROM validation_jobs
+        WHERE status IN (?, ?, ?) AND ((chat_id % ?) + ?) % ? = ?
+        ORDER BY created_at
+    ''', (JOB_QUEUED, JOB_RUNNING, JOB_DELIVERING, shards, shards, shards, shard)).fetchall()
+    return [JournaledJob(*row[:6], json.loads(row[6]), *row[7:]) for row in rows]
+
+
+async def load_unfinished_jobs(shard: int = 0, shards: int = 1) -> list[JournaledJob]:
+    # Задания чатов, которые обрабатывает воркер shard из shards
+    return await _run(_load_unfinished_jobs, shard, shards)
+
+
+def _purge_finished_jobs(conn: sqlite3.Connection, before: float) -> int:
+    return conn.execute(
+        "DELETE FROM validation_jobs WHERE status IN (?, ?) AND updated_at < ?",
+        (JOB_DONE, JOB_FAILED, before)
+    ).rowcount
 
 
+async def purge_finished_jobs(retention: float = FINISHED_JOBS_RETENTION) -> int:
+    return await _run(_purge_finished_jobs, time.time() - retention)
@@ -1,21 +1,39 @@
+import time
 from datetime import datetime
+from functools import partial
+from typing import BinaryIO
 
-from aiogram import F
+from aiogram import Bot, F
 from aiogram import Router
+from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message
+from aiogram.types import Document, Message, ReplyParameters
 
-from db import save_check_result
+from config import REPORT_ATTACHMENT_THRESHOLD, JOB_MAX_ATTEMPTS
+from db import (save_check_result, journal_job, mark_job_running, mark_job_delivering, requeue_job, retry_job,
+                fail_job, load_unfinished_jobs, JOB_DELIVERING)
 from logger import logger
+from middlewares.throttling import VALIDATION
 from services.api import validate_docx_document, validate_latex_document
-from services.formatting import format_docx_validation_result, send_long_message, format_latex_validation_result
+from services.delivery import delivery
+from services.files import download_document
+from services.prevalidation import PrevalidationError, check_header, check_metadata, prevalidate
+from services.formatting import format_docx_validation_result, send_long_text, format_latex_validation_result
+from services.report import build_report_file, report_summary
+from services.result_cache import combine_digests, make_cache_key, get_cached_result, save_cached_result
+from services.rules_cache import get_rules_cached
+from services.scheduler import ValidationJob, scheduler
+from services.tracing import current_trace_id, span, set_attrs
 
 router = Router()
 
 MAX_STATE_LIFETIME = 300
 
+FAILED_TEXT = "❌ Не удалось проверить документ. Отправьте его снова."
+PARTIAL_DELIVERY_TEXT = "❌ Не удалось отправить результат проверки полностью. Отправьте документ снова."
+
 
 class DocxCheck(StatesGroup):
     waiting_for_file = State()
@@ -38,11 +56,21 @@ def get_valid_types_str():
 async def check_file_size(message: Message, max_size_mb: int = 25) -> bool:
     if message.document.file_size > max_size_mb * 1024 * 1024:
         await message.answer(f"❌ Файл слишком большой. Максимальный размер — {max_size_mb} МБ.")
-        logger.warning(f"Файл от пользователя {message.from_user.username} превышает размер {max_size_mb} МБ")
+        logger.warning("Файл от пользователя %s превышает размер %s МБ", message.from_user.username, max_size_mb)
         return False
     return True
 
 
+def document_info(document: Document) -> dict:
+    # В состоянии FSM хранятся только поля, нужные для скачивания и проверки файла
+    return {
+        "file_id": document.file_id,
+        "file_unique_id": document.file_unique_id,
+        "file_name": document.file_name,
+        "file_size": document.file_size,
+    }
+
+
 async def is_state_expired(state: FSMContext) -> bool:
     data = await state.get_data()
     start_time = data.get("start_time")
@@ -54,13 +82,13 @@ async def is_state_expired(state: FSMContext) -> bool:
 
 @router.message(Command("check_docx"))
 async def handle_docx_check(message: Message, state: FSMContext):
-    logger.info(f"Пользователь {message.from_user.username} начал проверку docx")
+    logger.info("Пользователь %s начал проверку docx", message.from_user.username)
     parts = message.text.split(maxsplit=1)
     if len(parts) >= 2:
         doc_type = parts[1].strip().lower().replace(" ", "_")
-        logger.debug(f"Пользователь {message.from_user.username} ввел тип документа docx: {doc_type}")
+        logger.debug("Пользователь %s ввел тип документа docx: %s", message.from_user.username, doc_type)
         if doc_type not in VALID_TYPES:
-            logger.warning(f"Пользователь {message.from_user.username} указал неверный тип docx: {doc_type}")
+            logger.warning("Пользователь %s указал неверный тип docx: %s", message.from_user.username, doc_type)
             await message.answer(
                 f"❌ Неизвестный тип документа: {doc_type}.\n"
                 f"✅ Возможные типы: {get_valid_types_str()}.\n"
@@ -77,60 +105,30 @@ async def handle_docx_check(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, отправьте .docx файл для проверки.")
 
 
-@router.message(DocxCheck.waiting_for_file, F.document)
+@router.message(DocxCheck.waiting_for_file, F.document, flags={"throttle": VALIDATION})
 async def handle_docx_file(message: Message, state: FSMContext):
     if await is_state_expired(state):
-        logger.info(f"Сессия истекла для пользователя {message.from_user.username}")
+        logger.info("Сессия истекла для пользователя %s", message.from_user.username)
         await message.answer(
             "⌛ Слишком долго не было ответа. Начните проверку заново командой /check_docx или /check_latex.")
         await state.clear()
         return
 
     if not message.document.file_name.endswith(".docx"):
-        logger.warning(
-            f"Пользователь {message.from_user.username} отправил файл с неправильным расширением: {message.document.file_name}")
+        logger.warning("Пользователь %s отправил файл с неправильным расширением: %s",
+                       message.from_user.username, message.document.file_name)
         await message.answer("Пожалуйста, отправьте файл с расширением .docx")
         return
     if not await check_file_size(message):
         return
 
-    await state.update_data(file=message.document)
+    await state.update_data(file=document_info(message.document))
 
     data = await state.get_data()
-    logger.info(f"Пользователь {message.from_user.username} отправил файл {message.document.file_name}")
+    logger.info("Пользователь %s отправил файл %s", message.from_user.username, message.document.file_name)
 
     if "doc_type" in data:
-        file_obj = await message.bot.get_file(data["file"].file_id)
-        file = await message.bot.download_file(file_obj.file_path)
-
-        logger.info(f"Началась проверка docx файла {data['file'].file_name} для пользователя {message.from_user.username}")
-        await message.answer("⏳ Проверка документа началась, подождите немного...")
-
-        result = validate_docx_document(file, data["file"].file_name, data["doc_type"])
-
-        if result.get("error"):
-            r = result.get("error")
-            logger.error(f"Ошибка при проверке docx: {r}")
-            await message.answer(f"❌ Произошла ошибка при проверке документа: {r}")
-        else:
-            logger.info(f"Проверка docx завершена для пользователя {message.from_user.username}")
-            save_check_result(
-                user_id=message.from_user.id,
-                doc_type=data["doc_type"],
-                check_type="docx",
-                result=bool(result['valid'])
-            )
-            logger.debug(f"Проверка latex по пользователю {message.from_user.username} записана в таблицу users_checks")
-            res = format_docx_validation_result(result)
-            # await message.answer(res, parse_mode="Markdown")
-            await send_long_message(message, res)
-            logger.debug(f"Проверка docx завершена для пользователя {message.from_user.username} c результатом {res}")
-
-        # result = validate_docx_document(file, data["file"].file_name, data["doc_type"])
-        #
-        # logger.info(f"Проверка docx завершена для пользователя {message.from_user.id}")
-        # await message.answer(format_validation_result(result), parse_mode="Markdown")
-
+        await enqueue_validation(message, "docx", data["doc_type"], [data["file"]])
         await state.clear()
     else:
         await state.update_data(start_time=datetime.now().timestamp())
@@ -141,50 +139,21 @@ async def handle_docx_file(message: Message, state: FSMContext):
 @router.message(DocxCheck.waiting_for_type)
 async def handle_docx_type(message: Message, state: FSMContext):
     if await is_state_expired(state):
-        logger.info(f"Сессия истекла для пользователя {message.from_user.username}")
+        logger.info("Сессия истекла для пользователя %s", message.from_user.username)
         await message.answer(
             "⌛ Слишком долго не было ответа. Начните проверку заново командой /check_docx или /check_latex.")
         await state.clear()
         return
 
     doc_type = message.text.strip().lower().replace(" ", "_")
-    logger.debug(f"Пользователь {message.from_user.username} ввёл тип документа docx: {doc_type}")
+    logger.debug("Пользователь %s ввёл тип документа docx: %s", message.from_user.username, doc_type)
     if doc_type not in VALID_TYPES:
-        logger.warning(f"Пользователь {message.from_user.username} указал неверный тип docx: {doc_type}")
+        logger.warning("Пользователь %s указал неверный тип docx: %s", message.from_user.username, doc_type)
         await message.answer(f"Неверный тип документа. Возможные типы: {get_valid_types_str()}.")
         return
 
     data = await state.get_data()
-    file_obj = await message.bot.get_file(data["file"].file_id)
-    file = await message.bot.download_file(file_obj.file_path)
-
-    logger.info(f"Началась проверка docx файла {data['file'].file_name} для пользователя {message.from_user.username}")
-    await message.answer("⏳ Проверка документа началась, подождите немного...")
-
-    result = validate_docx_document(file, data["file"].file_name, doc_type)
-
-    if result.get("error"):
-        r = result.get("error")
-        logger.error(f"Ошибка при проверке docx: {r}")
-        await message.answer(f"❌ Произошла ошибка при проверке документа: {r}")
-    else:
-        logger.info(f"Проверка docx завершена для пользователя {message.from_user.username}")
-        save_check_result(
-            user_id=message.from_user.id,
-            doc_type=doc_type,
-            check_type="docx",
-            result=bool(result['valid'])
-        )
-        logger.debug(f"Проверка latex по пользователю {message.from_user.username} записана в таблицу users_checks")
-        res = format_docx_validation_result(result)
-        # await message.answer(res, parse_mode="Markdown")
-        await send_long_message(message, res)
-        logger.debug(f"Проверка docx завершена для пользователя {message.from_user.username} c результатом {res}")
-
-    # result = validate_docx_document(file, data["file"].file_name, doc_type)
-    # logger.info(f"Проверка docx завершена для пользователя {message.from_user.id}")
-    # await message.answer(format_validation_result(result), parse_mode="Markdown")
-
+    await enqueue_validation(message, "docx", doc_type, [data["file"]])
     await state.clear()
 
 
@@ -193,9 +162,9 @@ async def handle_latex_check(message: Message, state: FSMContext):
     parts = message.text.split(maxsplit=1)
     if len(parts) >= 2:
         doc_type = parts[1].strip().lower().replace(" ", "_")
-        logger.debug(f"Пользователь {message.from_user.username} ввел тип документа LaTeX: {doc_type}")
+        logger.debug("Пользователь %s ввел тип документа LaTeX: %s", message.from_user.username, doc_type)
         if doc_type not in VALID_TYPES:
-            logger.warning(f"Пользователь {message.from_user.username} ввел недопустимый тип LaTeX: {doc_type}")
+            logger.warning("Пользователь %s ввел недопустимый тип LaTeX: %s", message.from_user.username, doc_type)
             await message.answer(
                 f"❌ Неизвестный тип документа: {doc_type}.\n"
                 f"✅ Возможные типы: {get_valid_types_str()}.\n"
@@ -212,24 +181,25 @@ async def handle_latex_check(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, отправьте .tex файл.")
 
 
-@router.message(LatexCheck.waiting_for_tex, F.document)
+@router.message(LatexCheck.waiting_for_tex, F.document, flags={"throttle": VALIDATION})
 async def handle_latex_tex(message: Message, state: FSMContext):
     if await is_state_expired(state):
-        logger.info(f"Сессия истекла для пользователя {message.from_user.username} (этап .tex)")
+        logger.info("Сессия истекла для пользователя %s (этап .tex)", message.from_user.username)
         await message.answer(
             "⌛ Слишком долго не было ответа. Начните проверку заново командой /check_docx или /check_latex.")
         await state.clear()
         return
 
     if not message.document.file_name.endswith(".tex"):
-        logger.warning(f"Пользователь {message.from_user.username} отправил не .tex файл: {message.document.file_name}")
+        logger.warning("Пользователь %s отправил не .tex файл: %s",
+                       message.from_user.username, message.document.file_name)
         await message.answer("Пожалуйста, отправьте файл с расширением .tex")
         return
     if not await check_file_size(message):
         return
 
     await state.update_data(start_time=datetime.now().timestamp())
-    await state.update_data(tex=message.document)
+    await state.update_data(tex=document_info(message.document))
     await state.set_state(LatexCheck.waiting_for_sty)
     await message.answer("Теперь отправьте .sty файл.")
 
@@ -237,20 +207,21 @@ async def handle_latex_tex(message: Message, state: FSMContext):
 @router.message(LatexCheck.waiting_for_sty, F.document)
 async def handle_latex_sty(message: Message, state: FSMContext):
     if await is_state_expired(state):
-        logger.info(f"Сессия истекла для пользователя {message.from_user.username} (этап .sty)")
+        logger.info("Сессия истекла для пользователя %s (этап .sty)", message.from_user.username)
         await message.answer(
             "⌛ Слишком долго не было ответа. Начните проверку заново командой /check_docx или /check_latex.")
         await state.clear()
         return
 
     if not message.document.file_name.endswith(".sty"):
-        logger.warning(f"Пользователь {message.from_user.username} отправил не .sty файл: {message.document.file_name}")
+        logger.warning("Пользователь %s отправил не .sty файл: %s",
+                       message.from_user.username, message.document.file_name)
         await message.answer("Пожалуйста, отправьте файл с расширением .sty")
         return
     if not await check_file_size(message):
         return
 
-    await state.update_data(sty=message.document)
+    await state.update_data(sty=document_info(message.document))
 
     data = await state.get_data()
     if "doc_type" in data:
@@ -264,16 +235,17 @@ async def handle_latex_sty(message: Message, state: FSMContext):
 @router.message(LatexCheck.waiting_for_type)
 async def handle_latex_type(message: Message, state: FSMContext):
     if await is_state_expired(state):
-        logger.info(f"Сессия истекла для пользователя {message.from_user.username} (этап выбора типа для latex)")
+        logger.info("Сессия истекла для пользователя %s (этап выбора типа для latex)", message.from_user.username)
         await message.answer(
             "⌛ Слишком долго не было ответа. Начните проверку заново командой /check_docx или /check_latex.")
         await state.clear()
         return
 
     doc_type = message.text.strip().lower().replace(" ", "_")
-    logger.debug(f"Пользователь {message.from_user.username} ввел тип LaTeX-документа: {doc_type}")
+    logger.debug("Пользователь %s ввел тип LaTeX-документа: %s", message.from_user.username, doc_type)
     if doc_type not in VALID_TYPES:
-        logger.warning(f"Пользователь {message.from_user.username} указал недопустимый тип документа LaTeX: {doc_type}")
+        logger.warning("Пользователь %s указал недопустимый тип документа LaTeX: %s",
+                       message.from_user.username, doc_type)
         await message.answer(f"Неверный тип документа. Возможные типы: {get_valid_types_str()}.")
         return
     await state.update_data(doc_type=doc_type)
@@ -282,42 +254,260 @@ async def handle_latex_type(message: Message, state: FSMContext):
 
 async def process_latex_validation(message: Message, state: FSMContext):
     data = await state.get_data()
-    tex_file_info = await message.bot.get_file(data["tex"].file_id)
-    tex_file = await message.bot.download_file(tex_file_info.file_path)
+    await enqueue_validation(message, "latex", data["doc_type"], [data["tex"], data["sty"]])
+    await state.clear()
 
-    sty_file_info = await message.bot.get_file(data["sty"].file_id)
-    sty_file = await message.bot.download_file(sty_file_info.file_path)
 
-    logger.info(f"Началась проверка LaTeX-документов для пользователя {message.from_user.username}")
-    await message.answer("⏳ Проверка документа началась, подождите немного...")
+async def enqueue_validation(message: Message, check_type: str, doc_type: str, files: list[dict]):
+    # Файл, который заведомо не пройдёт проверку, не занимает место в очереди
+    error = check_metadata(check_type, files)
+    if error:
+        logger.warning("Проверка %s пользователя %s отклонена до постановки в очередь: %s",
+                       check_type, message.from_user.username, error)
+        await message.answer(f"❌ {error}")
+        return
 
-    result = validate_latex_document(
-        tex_file, data["tex"].file_name,
-        sty_file, data["sty"].file_name,
-        data["doc_type"]
+    job = ValidationJob(
+        user_id=message.from_user.id,
+        chat_id=message.chat.id,
+        username=message.from_user.username,
+        check_type=check_type,
+        doc_type=doc_type,
+        files=files,
+        trace_id=current_trace_id()
     )
+    duplicate = scheduler.claim(job)
+    if duplicate is not None:
+        # Тот же файл уже проверяется: новое задание не создаётся, результат придёт по исходному
+        logger.info("Пользователь %s повторно отправил файл, уже находящийся в задании %s",
+                    message.from_user.username, duplicate.job_id)
+        # Статус исходного задания мог быть удалён пользователем: тогда ответ уходит без цитаты
+        same_chat = duplicate.chat_id == job.chat_id and duplicate.status_message_id is not None
+        await message.answer(
+            "⏳ Этот документ уже проверяется, результат придёт в этот чат.",
+            reply_parameters=ReplyParameters(
+                message_id=duplicate.status_message_id, allow_sending_without_reply=True
+            ) if same_chat else None
+        )
+        return
 
-    if result.get("error"):
-        r = result.get("error")
-        logger.error(f"Ошибка при проверке latex: {r}")
-        await message.answer(f"❌ Произошла ошибка при проверке документа: {r}")
+    try:
+        job.position = scheduler.estimate_position(job.user_id)
+        job.status_text = scheduler.queued_text(job.position)
+        status = await message.answer(job.status_text)
+        job.status_message_id = status.message_id
+        # Задание попадает в журнал до запуска, чтобы пережить перезапуск бота
+        await journal_job(job.job_id, job.user_id, job.chat_id, job.username, job.check_type, job.doc_type,
+                          job.files, job.status_message_id)
+    except Exception:
+        scheduler.release(job)
+        raise
+    await scheduler.submit(job)
+    logger.info("Проверка %s для пользователя %s поставлена в очередь", check_type, message.from_user.username)
+
+
+async def _notify_job_failed(bot: Bot, chat_id: int, status_message_id: int | None, job_id: str, text: str):
+    if status_message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=status_message_id)
+            return
+        except TelegramAPIError as e:
+            # Статусное сообщение могло быть удалено: тогда ответ уходит отдельным сообщением
+            logger.debug("Не удалось обновить статус задания %s: %s", job_id, e)
+    try:
+        await bot.send_message(chat_id, text)
+    except TelegramAPIError as e:
+        logger.debug("Не удалось уведомить пользователя об ошибке задания %s: %s", job_id, e)
+
+
+async def resume_validation_jobs(bot: Bot, shard: int = 0, shards: int = 1):
+    # При нескольких воркерах каждый поднимает только задания своих чатов
+    resumed = failed = 0
+    for record in await load_unfinished_jobs(shard, shards):
+        if record.status == JOB_DELIVERING or record.attempts >= JOB_MAX_ATTEMPTS:
+            await fail_job(record.job_id)
+            failed += 1
+            if record.status == JOB_DELIVERING:
+                logger.warning("Задание %s пользователя %s прервано во время отправки результата",
+                               record.job_id, record.username)
+                text = PARTIAL_DELIVERY_TEXT
+            else:
+                logger.warning("Задание %s пользователя %s отменено после %s попыток",
+                               record.job_id, record.username, record.attempts)
+                text = FAILED_TEXT
+            await _notify_job_failed(bot, record.chat_id, record.status_message_id, record.job_id, text)
+            continue
+        # Позицию в статусном сообщении обновит очередь
+        await scheduler.submit(ValidationJob(
+            user_id=record.user_id,
+            chat_id=record.chat_id,
+            username=record.username,
+            check_type=record.check_type,
+            doc_type=record.doc_type,
+            files=record.files,
+            status_message_id=record.status_message_id,
+            job_id=record.job_id
+        ))
+        resumed += 1
+    if resumed:
+        logger.info("Возобновлено незавершённых проверок после перезапуска: %s", resumed)
+    if failed:
+        logger.warning("Незавершённых проверок отменено после перезапуска: %s", failed)
+
+
+async def run_validation_job(bot: Bot, job: ValidationJob):
+    # Непредвиденная ошибка не должна оставлять задание выполняющимся в журнале, а пользователя — без ответа
+    try:
+        await _run_validation_job(bot, job)
+    except Exception as e:
+        logger.error("Задание %s пользователя %s завершилось с ошибкой: %s", job.job_id, job.username, e)
+        await _recover_failed_job(bot, job)
+
+
+async def _recover_failed_job(bot: Bot, job: ValidationJob):
+    # Попытка засчитывается: пока не исчерпан JOB_MAX_ATTEMPTS, задание возвращается в очередь.
+    # Если результат уже начал отправляться, повтор прислал бы отчёт второй раз — задание закрывается
+    text = PARTIAL_DELIVERY_TEXT if job.delivery_started else FAILED_TEXT
+    try:
+        if not job.delivery_started:
+            attempts = await retry_job(job.job_id)
+            if attempts is not None and attempts < JOB_MAX_ATTEMPTS:
+                logger.warning("Задание %s возвращено в очередь после ошибки (попытка %s из %s)",
+                               job.job_id, attempts, JOB_MAX_ATTEMPTS)
+                await scheduler.requeue(job)
+                return
+        if not await fail_job(job.job_id):
+            # Задание уже завершено: результат отправлен и записан, ошибка случилась после этого
+            return
+    except Exception as e:
+        logger.error("Не удалось записать в журнал исход задания %s: %s", job.job_id, e)
+
+    await _notify_job_failed(bot, job.chat_id, job.status_message_id, job.job_id, text)
+
+
+async def _run_validation_job(bot: Bot, job: ValidationJob):
+    await mark_job_running(job.job_id)
+    try:
+        with span("telegram.edit_status"):
+            await bot.edit_message_text(
+                "⏳ Проверка документа началась, подождите немного...",
+                chat_id=job.chat_id,
+                message_id=job.status_message_id
+            )
+    except TelegramAPIError as e:
+        logger.debug("Не удалось обновить статус задания %s: %s", job.job_id, e)
+
+    files = []
+    digests = []
+    try:
+        for f in job.files:
+            with span("download", file_name=f["file_name"]):
+                spool, digest = await download_document(bot, f, partial(check_header, f["file_name"]))
+            files.append(spool)
+            digests.append(digest)
+    except PrevalidationError as e:
+        # Начало файла не прошло проверку: скачивание прервано на первых байтах
+        logger.warning("Задание %s пользователя %s отклонено при скачивании: %s", job.job_id, job.username, e)
+        for spool in files:
+            spool.close()
+        await fail_job(job.job_id)
+        await bot.send_message(job.chat_id, f"❌ {e}")
+        return
+    except Exception as e:
+        logger.error("Ошибка при скачивании файлов задания %s: %s", job.job_id, e)
+        for spool in files:
+            spool.close()
+        await fail_job(job.job_id)
+        await bot.send_message(job.chat_id, "❌ Не удалось получить файл из Telegram. Попробуйте отправить его снова.")
+        return
+
+    try:
+        with span("prevalidate"):
+            error = prevalidate(job.check_type, files)
+        if error:
+            logger.warning("Задание %s пользователя %s отклонено до отправки в API: %s",
+                           job.job_id, job.username, error)
+            await fail_job(job.job_id)
+            await bot.send_message(job.chat_id, f"❌ {error}")
+            return
+        await process_downloaded_job(bot, job, files, combine_digests(digests))
+    finally:
+        for spool in files:
+            spool.close()
+
+
+async def process_downloaded_job(bot: Bot, job: ValidationJob, files: list[BinaryIO], files_hash: str):
+    # Повторная отправка того же файла при тех же правилах отвечается из кэша без обращения к API
+    started = time.monotonic()
+    with span("rules"):
+        rules = await get_rules_cached(job.doc_type)
+    cache_key = make_cache_key(job.check_type, job.doc_type, files_hash, rules) if rules else None
+    result = await get_cached_result(cache_key) if cache_key else None
+    from_cache = result is not None
+    set_attrs(from_cache=from_cache)
+
+    if from_cache:
+        logger.info("Результат проверки %s для пользователя %s взят из кэша", job.check_type, job.username)
+    elif job.check_type == "docx":
+        logger.info("Началась проверка docx файла %s для пользователя %s", job.files[0]['file_name'], job.username)
+        result = await validate_docx_document(files[0], job.files[0]["file_name"], job.doc_type)
     else:
-        logger.info(f"Проверка latex завершена для пользователя {message.from_user.username}")
-        save_check_result(
-            user_id=message.from_user.id,
-            doc_type=data["doc_type"],
-            check_type="latex",
-            result=bool(result['valid'])
+        logger.info("Началась проверка LaTeX-документов для пользователя %s", job.username)
+        result = await validate_latex_document(
+            files[0], job.files[0]["file_name"],
+            files[1], job.files[1]["file_name"],
+            job.doc_type
         )
-        logger.debug(f"Проверка latex по пользователю {message.from_user.username} записана в таблицу users_checks")
-        res = format_latex_validation_result(result)
-        await send_long_message(message, res)
-        logger.debug(f"Проверка docx завершена для пользователя {message.from_user.username} c результатом {res}")
 
-    # logger.info(f"Проверка LaTeX завершена для пользователя {message.from_user.id}")
-    # await message.answer(format_validation_result(result), parse_mode="Markdown")
+    if result.get("overloaded"):
+        # Сервис упал уже после начала задания: проверка не считается попыткой и ждёт в очереди
+        logger.warning("Задание %s возвращено в очередь: сервис проверки недоступен", job.job_id)
+        await requeue_job(job.job_id)
+        await scheduler.requeue(job)
+        return
 
-    await state.clear()
+    if result.get("error"):
+        r = result.get("error")
+        logger.error("Ошибка при проверке %s: %s", job.check_type, r)
+        await fail_job(job.job_id)
+        await bot.send_message(job.chat_id, f"❌ Произошла ошибка при проверке документа: {r}")
+        return
+
+    if cache_key and not from_cache:
+        await save_cached_result(cache_key, job.check_type, job.doc_type, result)
+    logger.info("Проверка %s завершена для пользователя %s", job.check_type, job.username)
+    with span("format"):
+        if job.check_type == "docx":
+            res = format_docx_validation_result(result)
+        else:
+            res = format_latex_validation_result(result)
+    # С этого момента задание не повторяется: часть отчёта может уже дойти до пользователя
+    job.delivery_started = True
+    await mark_job_delivering(job.job_id)
+    with span("send", length=len(res)):
+        if len(res) > REPORT_ATTACHMENT_THRESHOLD:
+            # Большой отчёт уходит двумя запросами: краткая сводка и HTML-файл вместо множества сообщений
+            await delivery.send(bot, job.chat_id, report_summary(job.check_type, result), parse_mode="HTML")
+            await delivery.send_document(bot, job.chat_id, build_report_file(job.check_type, job.doc_type, result))
+        else:
+            await send_long_text(bot, job.chat_id, res)
+
+    # Задание закрывается после отправки результата: при сбое до этого момента пользователь получит
+    # результат повторно, а в историю проверка попадёт ровно один раз
+    recorded = await save_check_result(
+        user_id=job.user_id,
+        doc_type=job.doc_type,
+        check_type=job.check_type,
+        result=bool(result['valid']),
+        file_hash=files_hash,
+        duration=time.monotonic() - started,
+        error_count=len(result.get("errors", [])),
+        job_id=job.job_id
+    )
+    if recorded:
+        logger.debug("Проверка %s по пользователю %s записана в историю проверок", job.check_type, job.username)
+    else:
+        logger.debug("Задание %s уже было завершено, повторная запись в историю пропущена", job.job_id)
 
 
 def register(dp):
@@ -0,0 +1,146 @@
+import asyncio
+import os
+from datetime import datetime, date, timedelta
+
+from aiogram import Router, types
+from aiogram.filters import Command
+from aiogram.types import FSInputFile
+
+from db import REVIEWER_ROLE, get_daily_stats, local_today
+from logger import logger
+from middlewares.throttling import LOOKUP
+from services.api import health_snapshot
+from services.export import write_checks_csv
+from services.formatting import send_long_message
+
+router = Router()
+
+DEFAULT_STATS_DAYS = 7
+DEFAULT_EXPORT_DAYS = 30
+DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d")
+
+
+def parse_date(value: str) -> date | None:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def render_stats(rows: list[tuple], date_from: date, date_to: date) -> str:
+    parts = [
+        f"📊 <b>Статистика проверок с {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}</b>\n"
+    ]
+    total_passed = total_failed = 0
+    current_day = None
+
+    for day, doc_type, check_type, passed, failed in rows:
+        if day != current_day:
+            current_day = day
+            parts.append(f"\n📅 <b>{date.fromisoformat(day):%d.%m.%Y}</b>\n")
+        parts.append(f"• {doc_type} / {check_type}: ✅ {passed}  ❌ {failed}\n")
+        total_passed += passed
+        total_failed += failed
+
+    parts.append(f"\n<b>Итого:</b> {total_passed + total_failed} проверок, "
+                 f"✅ без ошибок {total_passed}, ❌ с ошибками {total_failed}")
+    return "".join(parts)
+
+
+@router.message(Command("stats"), flags={"throttle": LOOKUP})
+async def stats(message: types.Message, role: str):
+    if role != REVIEWER_ROLE:
+        logger.warning("Пользователь %s попытался использовать команду stats.", message.from_user.username)
+        await message.answer("⛔️ Эта команда доступна только нормоконтролёрам.")
+        return
+
+    parts = message.text.split()[1:]
+    dates = [parse_date(p) for p in parts[:2]]
+    if len(parts) > 2 or None in dates:
+        await message.answer(
+            "Использование: /stats [с] [по]\n"
+            "Даты в формате ДД.ММ.ГГГГ, например: /stats 01.05.2025 31.05.2025\n"
+            f"Без аргументов — статистика за последние {DEFAULT_STATS_DAYS} дней."
+        )
+        return
+
+    date_to = dates[1] if len(dates) == 2 else local_today()
+    date_from = dates[0] if dates else date_to - timedelta(days=DEFAULT_STATS_DAYS - 1)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+
+    rows = await get_daily_stats(date_from, date_to)
+    if not rows:
+        await message.answer(f"С {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y} проверок не было.")
+        return
+
+    await send_long_message(message, render_stats(rows, date_from, date_to))
+
+
+@router.message(Command("export_checks"), flags={"throttle": LOOKUP})
+async def export_checks(message: types.Message, role: str):
+    if role != REVIEWER_ROLE:
+        logger.warning("Пользователь %s попытался использовать команду export_checks.", message.from_user.username)
+        await message.answer("⛔️ Эта команда доступна только нормоконтролёрам.")
+        return
+
+    parts = message.text.split()[1:]
+    compress = "gz" in parts
+    args = [p for p in parts if p != "gz"]
+    if len(args) > 1 or (args and not (args[0].isdigit() and int(args[0]) > 0)):
+        await message.answer(
+            "Использование: /export_checks [дней] [gz]\n"
+            f"По умолчанию выгружаются проверки за последние {DEFAULT_EXPORT_DAYS} дней, "
+            "gz — сжать файл."
+        )
+        return
+    days = int(args[0]) if args else DEFAULT_EXPORT_DAYS
+
+    logger.info("Нормоконтролер %s выгружает историю проверок за %s дней", message.from_user.username, days)
+    path, count = await asyncio.to_thread(write_checks_csv, days, compress)
+    try:
+        if not count:
+            await message.answer(f"За последние {days} дней не было проверок.")
+            return
+        filename = f"checks_{local_today():%Y%m%d}_{days}d.csv" + (".gz" if compress else "")
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📄 История проверок за {days} дней: {count} записей"
+        )
+    finally:
+        os.remove(path)
+
+
+BREAKER_STATES = {"closed": "✅ работает", "open": "⛔️ недоступен", "half_open": "🔄 пробный запрос"}
+
+
+def render_api_status(snapshot: dict) -> str:
+    breaker = snapshot["breaker"]
+    parts = [
+        "🩺 <b>Состояние сервиса проверки</b>\n",
+        f"Статус: {BREAKER_STATES.get(breaker['state'], breaker['state'])}",
+        f"Сбоев подряд: {breaker['consecutive_failures']}, отключений всего: {breaker['opened_total']}",
+    ]
+    if breaker["retry_after"]:
+        parts.append(f"Следующая попытка через {breaker['retry_after']} с")
+    if snapshot["calls"]:
+        parts.append("\n<b>Запросы (вызовов / ошибок / среднее / макс., с):</b>")
+        for name, stats in snapshot["calls"].items():
+            parts.append(f"• {name}: {stats['calls']} / {stats['failures']} / "
+                         f"{stats['avg_time']} / {stats['max_time']}")
+    return "\n".join(parts)
+
+
+@router.message(Command("api_status"), flags={"throttle": LOOKUP})
+async def api_status(message: types.Message, role: str):
+    if role != REVIEWER_ROLE:
+        logger.warning("Пользователь %s попытался использовать команду api_status.", message.from_user.username)
+        await message.answer("⛔️ Эта команда доступна только нормоконтролёрам.")
+        return
+    await message.answer(render_api_status(health_snapshot()), parse_mode="HTML")
+
+
+def register(dp):
+    dp.include_router(router)
@@ -6,21 +6,28 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from db import get_user_role, REVIEWER_ROLE
+from db import REVIEWER_ROLE
 from logger import logger
-from services.api import get_doc_options, get_rules, change_rule, change_rule_for_all
+from middlewares.throttling import LOOKUP
+from services.api import change_rule, change_rule_for_all
+from services.delivery import delivery
+from services.formatting import merge_lines
+from services.result_cache import invalidate_cached_results
+from services.rules_cache import get_doc_options_cached, get_rules_cached, invalidate_rules
 
 router = Router()
 
 MAX_STATE_LIFETIME = 300
+# Запас до лимита Telegram под обрамление блока кода
+RULES_CHUNK_LIMIT = 4000
 
 
 class RuleStates(StatesGroup):
     waiting_for_doc_type = State()
 
 
-def get_valid_doc_types():
-    options = get_doc_options()
+async def get_valid_doc_types():
+    options = await get_doc_options_cached()
     return [opt["name"].lower() for opt in options] if options else []
 
 
@@ -33,10 +40,10 @@ async def is_state_expired(state: FSMContext) -> bool:
     return (now - start_time) > MAX_STATE_LIFETIME
 
 
-@router.message(Command("types"))
+@router.message(Command("types"), flags={"throttle": LOOKUP})
 async def available_types(message: types.Message):
-    logger.debug(f"Пользователь {message.from_user.username} запросил типы документов")
-    options = get_doc_options()
+    logger.debug("Пользователь %s запросил типы документов", message.from_user.username)
+    options = await get_doc_options_cached()
     if options:
         text = "\n".join(opt["name"].lower().replace("_", "\\_") for opt in options)
         await message.answer(f"*Доступные типы документов:*\n{text}", parse_mode="Markdown")
@@ -44,8 +51,8 @@ async def available_types(message: types.Message):
         await message.answer("❌ Ошибка при получении типов документов.")
 
 
-@router.message(Command("rules"))
-async def show_rules(message: types.Message, state: FSMContext):
+@router.message(Command("rules"), flags={"throttle": LOOKUP})
+async def show_rules(message: types.Message, state: FSMContext, role: str):
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
         await state.update_data(start_time=datetime.now().timestamp())
@@ -54,22 +61,22 @@ async def show_rules(message: types.Message, state: FSMContext):
         return
 
     doc_type = parts[1].strip().lower().replace(" ", "_")
-    await process_doc_type_internal(message, doc_type, state)
+    await process_doc_type_internal(message, doc_type, state, role)
 
 
-@router.message(RuleStates.waiting_for_doc_type)
-async def process_doc_type(message: types.Message, state: FSMContext):
+@router.message(RuleStates.waiting_for_doc_type, flags={"throttle": LOOKUP})
+async def process_doc_type(message: types.Message, state: FSMContext, role: str):
     if await is_state_expired(state):
         await message.answer("⌛ Слишком долго не было ответа. Начните заново командой /rules.")
         await state.clear()
         return
 
     doc_type = message.text.strip().lower().replace(" ", "_")
-    await process_doc_type_internal(message, doc_type, state)
+    await process_doc_type_internal(message, doc_type, state, role)
 
 
-async def process_doc_type_internal(message: types.Message, doc_type: str, state: FSMContext):
-    valid_types = get_valid_doc_types()
+async def process_doc_type_internal(message: types.Message, doc_type: str, state: FSMContext, role: str):
+    valid_types = await get_valid_doc_types()
 
     if doc_type not in valid_types:
         ds = '\\'
@@ -80,21 +87,18 @@ async def process_doc_type_internal(message: types.Message, doc_type: str, state
         await state.set_state(RuleStates.waiting_for_doc_type)
         return
 
-    await send_rules(message, doc_type)
+    await send_rules(message, doc_type, role)
     await state.clear()
 
 
-async def send_rules(message: types.Message, doc_type: str):
-    logger.debug(f"Пользователь {message.from_user.username} запросил правила для {doc_type}")
-    rules = get_rules(doc_type)
+async def send_rules(message: types.Message, doc_type: str, role: str):
+    logger.debug("Пользователь %s запросил правила для %s", message.from_user.username, doc_type)
+    rules = await get_rules_cached(doc_type)
 
     if not rules:
         await message.answer("❌ Ошибка при получении правил.")
         return
 
-    user_id = message.from_user.id
-    role = get_user_role(user_id)
-
     if role == REVIEWER_ROLE:
         pretty_rules = json.dumps(rules, indent=2, ensure_ascii=False)
     else:
@@ -107,20 +111,15 @@ async def send_rules(message: types.Message, doc_type: str):
         "• [Документ с правилами оформления ИГУ](https://docs.google.com/document/d/1u4fIvEEHkwORaAj1kNBk3aBlEca7_pJ7/edit?usp=drive_link&ouid=115137208764228085296&rtpof=true&sd=true)"
     )
 
-    pretty_rules += links
-    max_length = 4000
-
-    if len(pretty_rules) > max_length:
-        chunks = [pretty_rules[i:i + max_length] for i in range(0, len(pretty_rules), max_length)]
-        await message.answer(f"*Правила для типа:* `{doc_type}`", parse_mode="Markdown")
-        for chunk in chunks:
-            await message.answer(f"```\n{chunk}\n```" if not chunk.startswith("🔗") else chunk, parse_mode="Markdown")
+    # Правила режутся только по границам строк, чтобы не разрывать разметку внутри строки
+    header = f"*Правила для типа:* `{doc_type}`"
+    if role == REVIEWER_ROLE:
+        chunks = [f"```\n{chunk}\n```" for chunk in merge_lines(pretty_rules, RULES_CHUNK_LIMIT - len(header))]
+        chunks[0] = f"{header}\n{chunks[0]}"
+        chunks.append(links.strip())
     else:
-        await message.answer(
-            f"*Правила для типа:* `{doc_type}`\n```\n{pretty_rules}\n```" if not pretty_rules.endswith(")")
-            else f"*Правила для типа:* `{doc_type}`\n{pretty_rules}",
-            parse_mode="Markdown"
-        )
+        chunks = merge_lines(f"{header}\n{pretty_rules}{links}", RULES_CHUNK_LIMIT)
+    await delivery.send_chunks(message.bot, message.chat.id, chunks, parse_mode="Markdown")
 
 
 def format_rules_for_students(rules: dict) -> str:
@@ -180,12 +179,10 @@ def format_rules_for_students(rules: dict) -> str:
     return "\n".join(parts)
 
 
-@router.message(Command("change_rule"))
-async def update_rule(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id)
+@router.message(Command("change_rule"), flags={"throttle": LOOKUP})
+async def update_rule(message: types.Message, role: str):
     if role != REVIEWER_ROLE:
-        logger.warning(f"Пользователь {message.from_user.username} попытался изменить правило без прав.")
+        logger.warning("Пользователь %s попытался изменить правило без прав.", message.from_user.username)
         await message.answer("🚫 У вас нет прав для изменения правил.")
         return
 
@@ -199,20 +196,21 @@ async def update_rule(message: types.Message):
     # new_value = parts[3]
     doc_type, rule_key, new_value = parts[1], parts[2], " ".join(parts[3:])
 
-    logger.debug(f"Нормоконтролер {message.from_user.username} меняет правило {rule_key} для {doc_type} на {new_value}")
-    result = change_rule(doc_type, rule_key, new_value)
+    logger.debug("Нормоконтролер %s меняет правило %s для %s на %s",
+                 message.from_user.username, rule_key, doc_type, new_value)
+    result = await change_rule(doc_type, rule_key, new_value)
     if result:
+        invalidate_rules(doc_type)
+        await invalidate_cached_results(doc_type)
         await message.answer(result.get("message", "✅ Правило изменено."))
     else:
         await message.answer("❌ Ошибка при изменении правила.")
 
 
-@router.message(Command("change_rule_for_all"))
-async def handle_change_rule_for_all(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id)
+@router.message(Command("change_rule_for_all"), flags={"throttle": LOOKUP})
+async def handle_change_rule_for_all(message: types.Message, role: str):
     if role != REVIEWER_ROLE:
-        logger.warning(f"Пользователь {message.from_user.username} попытался изменить правило без прав.")
+        logger.warning("Пользователь %s попытался изменить правило без прав.", message.from_user.username)
         await message.answer("🚫 У вас нет прав для изменения правил.")
         return
 
@@ -227,7 +225,9 @@ async def handle_change_rule_for_all(message: types.Message):
     # rule_key = parts[1]
     # new_value = parts[2]
 
-    result = change_rule_for_all(rule_key, new_value)
+    result = await change_rule_for_all(rule_key, new_value)
+    invalidate_rules()
+    await invalidate_cached_results()
     if result:
         text = result.get("message", "✅ Правило изменено.")
         if "errors" in result:
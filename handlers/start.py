@@ -1,16 +1,18 @@
-from datetime import datetime
-
 from aiogram import Router, types
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from config import SECRET_CODE, ADMIN_USER_ID
-from db import get_user_role, set_user_role, REVIEWER_ROLE, STUDENT_ROLE, get_recent_checks
+from db import set_user_role, REVIEWER_ROLE, STUDENT_ROLE, get_checks_page, ChecksPage
 
 from logger import logger
-from services.formatting import send_long_message
+from middlewares.throttling import LOOKUP
 
 router = Router()
 
+RECENT_CHECKS_DAYS = 14
+
 
 def get_available_commands(role: str) -> list[str]:
     commands = [
@@ -31,16 +33,17 @@ def get_available_commands(role: str) -> list[str]:
         commands.append("/change_rule <тип> <ключ> <значение> — изменить правило")
         commands.append("/change_rule_for_all <ключ> <значение> — изменить правило для всех типов")
         commands.append("/recent_checks — список проверок за последние 14 дней")
+        commands.append("/stats [с] [по] — статистика проверок по дням")
+        commands.append("/export_checks [дней] [gz] — выгрузить историю проверок в CSV")
+        commands.append("/api_status — состояние сервиса проверки")
         commands.append("/reset_role — сбросить роль до student")
 
     return commands
 
 
 @router.message(Command("start"))
-async def start(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id, message.from_user.username)
-    logger.info(f"👤 Пользователь {message.from_user.username} начал сессию как {role}.")
+async def start(message: types.Message, role: str):
+    logger.info("👤 Пользователь %s начал сессию как %s.", message.from_user.username, role)
 
     commands = get_available_commands(role)
 
@@ -56,7 +59,7 @@ async def start(message: types.Message):
 
 
 
-@router.message(Command("set_reviewer"))
+@router.message(Command("set_reviewer"), flags={"throttle": LOOKUP})
 async def set_reviewer(message: types.Message):
     parts = message.text.split()
     if len(parts) != 2:
@@ -66,8 +69,8 @@ async def set_reviewer(message: types.Message):
     secret = parts[1]
     if secret == SECRET_CODE:
         user_id = message.from_user.id
-        set_user_role(user_id, REVIEWER_ROLE)
-        logger.info(f"✅ Пользователю {message.from_user.username} присвоена роль: reviewer")
+        await set_user_role(user_id, REVIEWER_ROLE)
+        logger.info("✅ Пользователю %s присвоена роль: reviewer", message.from_user.username)
 
         commands = get_available_commands(REVIEWER_ROLE)
         await message.answer(
@@ -76,21 +79,17 @@ async def set_reviewer(message: types.Message):
             "\n".join(commands)
         )
     else:
-        logger.warning(f"❌ Пользователь {message.from_user.id} ввел неверный секретный код")
+        logger.warning("❌ Пользователь %s ввел неверный секретный код", message.from_user.id)
         await message.answer("Неверный секретный код.")
 
 
 @router.message(Command("my_role"))
-async def my_role(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id, message.from_user.username)
+async def my_role(message: types.Message, role: str):
     await message.answer(f"Ваша текущая роль: {role}")
 
 
 @router.message(Command("help"))
-async def help_command(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id, message.from_user.username)
+async def help_command(message: types.Message, role: str):
     commands = get_available_commands(role)
     await message.answer("Справка по доступным командам:\n" + "\n".join(commands))
 
@@ -135,8 +134,8 @@ async def info(message: types.Message):
 @router.message(Command("reset_role"))
 async def reset_role(message: types.Message):
     user_id = message.from_user.id
-    set_user_role(user_id, STUDENT_ROLE)
-    logger.info(f"🔄 Пользователю {message.from_user.username} сброшена роль до student.")
+    await set_user_role(user_id, STUDENT_ROLE)
+    logger.info("🔄 Пользователю %s сброшена роль до student.", message.from_user.username)
     await message.answer("Ваша роль сброшена до 'student'. Вы больше не нормоконтролер.")
 
 
@@ -152,7 +151,7 @@ async def feedback(message: types.Message):
     feedback_text = text_parts[1]
 
     # Логирование
-    logger.feedback(f"✉️ Отзыв от {message.from_user.username}: {feedback_text}")
+    logger.feedback("✉️ Отзыв от %s: %s", message.from_user.username, feedback_text)
 
     # Отправка админу
     try:
@@ -161,50 +160,92 @@ async def feedback(message: types.Message):
             f"📩 Отзыв от пользователя {user_id} (@{message.from_user.username}):\n{feedback_text}"
         )
     except Exception as e:
-        logger.warning(f"⚠️ Не удалось отправить сообщение админу: {e}")
+        logger.warning("⚠️ Не удалось отправить сообщение админу: %s", e)
 
     await message.answer("Спасибо за ваш отзыв! Он был отправлен администратору.")
 
 
-@router.message(Command("recent_checks"))
-async def recent_checks(message: types.Message):
-    user_id = message.from_user.id
-    role = get_user_role(user_id)
+class RecentChecksPage(CallbackData, prefix="recent_checks"):
+    direction: str
+    anchor: int
 
-    if role != REVIEWER_ROLE:
-        logger.warning(f"Пользователь {message.from_user.username} попытался использовать команду recent_checks.")
-        await message.answer("⛔️ Эта команда доступна только нормоконтролёрам.")
-        return
 
-    checks = get_recent_checks(14)
-    if not checks:
-        await message.answer("За последние 14 дней не было проверок.")
-        return
+RESULT_LABELS = {
+    "0": "Найдены ошибки ❌",
+    "1": "Ошибки не найдены ✅",
+}
 
-    text = "📄 <b>Последние проверки за 14 дней:</b>\n"
+
+def render_checks_page(page: ChecksPage) -> str:
+    parts = [f"📄 <b>Последние проверки за {RECENT_CHECKS_DAYS} дней:</b>\n"]
     current_type = None
 
-    for username, doc_type, check_type, result, check_time in checks:
+    for _, username, doc_type, check_type, result, readable_time in page.rows:
         if doc_type != current_type:
             current_type = doc_type
-            text += f"\n🔷 <u><b>Тип документа: {doc_type}</b></u>\n"
-
-        readable_time = datetime.fromisoformat(str(check_time)).strftime("%d.%m.%Y %H:%M")
-        if result == '0':
-            result_str = "Найдены ошибки ❌"
-        elif result == '1':
-            result_str = "Ошибки не найдены ✅"
-        else:
-            result_str = "Неизвестный результат"
+            parts.append(f"\n🔷 <u><b>Тип документа: {doc_type}</b></u>\n")
 
-        text += (
+        parts.append(
             f"👤 @{username or 'неизвестно'}\n"
             f"🕒 Время: {readable_time}\n"
             f"🔍 Проверка: {check_type}\n"
-            f"☑️ Результат: {result_str}\n\n"
+            f"☑️ Результат: {RESULT_LABELS.get(str(result), 'Неизвестный результат')}\n\n"
         )
 
-    await send_long_message(message, text)
+    return "".join(parts)
+
+
+def checks_page_keyboard(page: ChecksPage) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if page.has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=RecentChecksPage(direction="prev", anchor=page.rows[0][0]).pack()
+        ))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton(
+            text="Вперёд ➡️",
+            callback_data=RecentChecksPage(direction="next", anchor=page.rows[-1][0]).pack()
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+@router.message(Command("recent_checks"), flags={"throttle": LOOKUP})
+async def recent_checks(message: types.Message, role: str):
+    if role != REVIEWER_ROLE:
+        logger.warning("Пользователь %s попытался использовать команду recent_checks.", message.from_user.username)
+        await message.answer("⛔️ Эта команда доступна только нормоконтролёрам.")
+        return
+
+    page = await get_checks_page(RECENT_CHECKS_DAYS)
+    if not page.rows:
+        await message.answer(f"За последние {RECENT_CHECKS_DAYS} дней не было проверок.")
+        return
+
+    await message.answer(render_checks_page(page), parse_mode="HTML", reply_markup=checks_page_keyboard(page))
+
+
+@router.callback_query(RecentChecksPage.filter(), flags={"throttle": LOOKUP})
+async def recent_checks_page(callback: types.CallbackQuery, callback_data: RecentChecksPage, role: str):
+    if role != REVIEWER_ROLE:
+        await callback.answer("⛔️ Эта команда доступна только нормоконтролёрам.", show_alert=True)
+        return
+
+    page = await get_checks_page(
+        RECENT_CHECKS_DAYS,
+        anchor_id=callback_data.anchor,
+        backwards=callback_data.direction == "prev"
+    )
+    if not page.rows:
+        await callback.answer("Больше проверок нет.")
+        return
+
+    await callback.message.edit_text(
+        render_checks_page(page),
+        parse_mode="HTML",
+        reply_markup=checks_page_keyboard(page)
+    )
+    await callback.answer()
 
 
 def register(dp):
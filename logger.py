@@ -1,4 +1,16 @@
+import atexit
+import gzip
+import json
 import logging
+import os
+import queue
+import shutil
+from contextvars import ContextVar
+from logging.handlers import (BaseRotatingHandler, QueueHandler, QueueListener, RotatingFileHandler,
+                              TimedRotatingFileHandler)
+
+from config import (LOG_FILE, LOG_FORMAT, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT,
+                    LOG_COMPRESS)
 
 FEEDBACK_LEVEL_NUM = 25
 logging.addLevelName(FEEDBACK_LEVEL_NUM, "FEEDBACK")
@@ -11,11 +23,81 @@ def feedback(self, message, *args, **kws):
 
 logging.Logger.feedback = feedback
 
-log_format = "%(asctime)s [%(levelname)s] %(message)s"
-file_handler = logging.FileHandler("bot.log", encoding="utf-8")
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(logging.Formatter(log_format))
+# Id трассировки текущего апдейта или задания проверки (services/tracing.py), "-" — вне трассировки
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+
+class TraceIdFilter(logging.Filter):
+    # Стоит на QueueHandler: contextvar читается в том потоке и задаче, где вызван логгер
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "process": record.processName,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+log_format = "%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s"
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _build_file_handler() -> logging.Handler:
+    # Файл открывается при первой записи: процессы-воркеры в него не пишут (см. forward_to)
+    if LOG_ROTATION == "size":
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                      encoding="utf-8", delay=True)
+    elif LOG_ROTATION == "time":
+        handler = TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT,
+                                           encoding="utf-8", delay=True)
+    else:
+        handler = logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True)
+    if LOG_COMPRESS and isinstance(handler, BaseRotatingHandler):
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(log_format))
+    return handler
+
+
+# Логгер только кладёт запись в очередь; запись в файл, ротация и сжатие идут в потоке QueueListener,
+# а не в цикле событий
+file_handler = _build_file_handler()
+_queue = queue.SimpleQueue()
+queue_handler = QueueHandler(_queue)
+queue_handler.addFilter(TraceIdFilter())
+_listener = QueueListener(_queue, file_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
-logger.addHandler(file_handler)
+logger.addHandler(queue_handler)
+
+
+def listen(source_queue) -> QueueListener:
+    # Процесс-супервизор пишет в файл записи, пришедшие от воркеров через source_queue
+    listener = QueueListener(source_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def forward_to(target_queue):
+    # Процесс-воркер не пишет в файл сам: несколько процессов, ротирующих один файл, теряют записи
+    atexit.unregister(_listener.stop)
+    _listener.stop()
+    file_handler.close()
+    queue_handler.queue = target_queue
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import UPDATE_DEDUP_TTL, UPDATE_DEDUP_SIZE
+from logger import logger
+
+
+# Множество недавно виденных ключей: записи живут ttl секунд, всего не больше max_size
+class TTLSet:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires: OrderedDict[Any, float] = OrderedDict()
+
+    def add(self, key) -> bool:
+        # True, если ключ новый; False — если он уже встречался в пределах ttl
+        now = time.monotonic()
+        while self._expires and (len(self._expires) >= self.max_size or next(iter(self._expires.values())) < now):
+            self._expires.popitem(last=False)
+        if key in self._expires:
+            return False
+        self._expires[key] = now + self.ttl
+        return True
+
+
+# Telegram повторно доставляет апдейт после таймаута вебхука — второй раз он не обрабатывается
+class DedupMiddleware(BaseMiddleware):
+    def __init__(self, ttl: float, max_size: int):
+        self.seen = TTLSet(ttl, max_size)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update) and not self.seen.add(event.update_id):
+            logger.debug("Повторный апдейт %s пропущен", event.update_id)
+            return None
+        return await handler(event, data)
+
+
+def register(dp):
+    dp.update.outer_middleware(DedupMiddleware(UPDATE_DEDUP_TTL, UPDATE_DEDUP_SIZE))
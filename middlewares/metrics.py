@@ -0,0 +1,42 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.metrics import HANDLER_REQUESTS, HANDLER_SECONDS
+
+
+def _handler_name(data: dict[str, Any]) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return "unknown"
+    return f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}"
+
+
+# Число вызовов и время работы каждого хендлера. Подключается последним, поэтому
+# отклонённые ограничением частоты запросы сюда не попадают
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        name = _handler_name(data)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+            HANDLER_REQUESTS.labels(name, status).inc()
+
+
+def register(dp):
+    middleware = MetricsMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
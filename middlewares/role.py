@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db import get_user_role
+
+
+# Роль пользователя определяется один раз на апдейт и передаётся в хендлеры аргументом role
+class RoleMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            data["role"] = await get_user_role(user.id, user.username)
+        return await handler(event, data)
+
+
+def register(dp):
+    dp.update.outer_middleware(RoleMiddleware())
@@ -0,0 +1,100 @@
+import math
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import (THROTTLE_VALIDATION_PER_MIN, THROTTLE_VALIDATION_BURST, THROTTLE_LOOKUP_PER_MIN,
+                    THROTTLE_LOOKUP_BURST, THROTTLE_REVIEWER_FACTOR, THROTTLE_GLOBAL_VALIDATION_PER_MIN,
+                    THROTTLE_GLOBAL_LOOKUP_PER_MIN, WORKER_PROCESSES)
+from db import REVIEWER_ROLE
+from logger import logger
+from services.metrics import THROTTLED_REQUESTS
+from services.ratelimit import TokenBucket, BucketRegistry
+
+VALIDATION = "validation"
+LOOKUP = "lookup"
+
+# Не чаще одного предупреждения о лимите на пользователя за это время, чтобы не отвечать на каждый спам
+NOTICE_INTERVAL = 10
+
+
+def _registry(per_minute: float, burst: float) -> BucketRegistry:
+    return BucketRegistry(rate=per_minute / 60, capacity=burst)
+
+
+# Ограничение частоты для хендлеров с флагом throttle: корзина на пользователя и класс команды
+# (у нормоконтролёров своя, более щедрая квота) и общая корзина класса, защищающая сервис проверки
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.user_buckets = {
+            (VALIDATION, False): _registry(THROTTLE_VALIDATION_PER_MIN, THROTTLE_VALIDATION_BURST),
+            (VALIDATION, True): _registry(THROTTLE_VALIDATION_PER_MIN * THROTTLE_REVIEWER_FACTOR,
+                                          THROTTLE_VALIDATION_BURST * THROTTLE_REVIEWER_FACTOR),
+            (LOOKUP, False): _registry(THROTTLE_LOOKUP_PER_MIN, THROTTLE_LOOKUP_BURST),
+            (LOOKUP, True): _registry(THROTTLE_LOOKUP_PER_MIN * THROTTLE_REVIEWER_FACTOR,
+                                      THROTTLE_LOOKUP_BURST * THROTTLE_REVIEWER_FACTOR),
+        }
+        # Пользователь всегда попадает в один процесс (обновления раскладываются по chat_id),
+        # а общий лимит делится между процессами
+        validation_per_min = THROTTLE_GLOBAL_VALIDATION_PER_MIN / WORKER_PROCESSES
+        lookup_per_min = THROTTLE_GLOBAL_LOOKUP_PER_MIN / WORKER_PROCESSES
+        self.global_buckets = {
+            VALIDATION: TokenBucket(validation_per_min / 60, validation_per_min / 6),
+            LOOKUP: TokenBucket(lookup_per_min / 60, lookup_per_min / 6),
+        }
+        self._notified_until: dict[int, float] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        command_class = get_flag(data, "throttle")
+        user = data.get("event_from_user")
+        if command_class is None or user is None:
+            return await handler(event, data)
+
+        reviewer = data.get("role") == REVIEWER_ROLE
+        user_bucket = self.user_buckets[(command_class, reviewer)].get(user.id)
+        wait = user_bucket.try_acquire()
+        if wait > 0:
+            THROTTLED_REQUESTS.labels(command_class, "user").inc()
+            logger.warning("Пользователь %s превысил лимит запросов (%s)", user.username, command_class)
+            await self._notify(event, user.id, wait, "⏳ Слишком много запросов. Повторите через {seconds} с.")
+            return None
+
+        wait = self.global_buckets[command_class].try_acquire()
+        if wait > 0:
+            # Пользователь не виноват в общей перегрузке — его токен возвращается
+            user_bucket.refund()
+            THROTTLED_REQUESTS.labels(command_class, "global").inc()
+            logger.warning("Общий лимит запросов (%s) исчерпан, запрос %s отклонён", command_class, user.username)
+            await self._notify(event, user.id, wait,
+                               "⏳ Бот сейчас обрабатывает слишком много запросов. Повторите через {seconds} с.")
+            return None
+
+        return await handler(event, data)
+
+    async def _notify(self, event: TelegramObject, user_id: int, wait: float, text: str):
+        now = time.monotonic()
+        if self._notified_until.get(user_id, 0) > now:
+            return
+        if len(self._notified_until) > 10000:
+            self._notified_until = {k: v for k, v in self._notified_until.items() if v > now}
+        self._notified_until[user_id] = now + NOTICE_INTERVAL
+
+        text = text.format(seconds=math.ceil(wait))
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer(text)
+
+
+def register(dp):
+    middleware = ThrottlingMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
@@ -0,0 +1,33 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiogram.types.update import UpdateTypeLookupError
+
+from services.tracing import start_trace
+
+
+# Трассировка на каждый апдейт: её id попадает в строки лога и в задания проверки, созданные хендлером
+class TracingMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        attrs = {"user_id": user.id} if user is not None else {}
+        if isinstance(event, Update):
+            attrs["update_id"] = event.update_id
+            try:
+                attrs["event_type"] = event.event_type
+            except UpdateTypeLookupError:
+                # Тип апдейта из новой версии Bot API, который aiogram ещё не знает
+                attrs["event_type"] = "unknown"
+        with start_trace("update", **attrs):
+            return await handler(event, data)
+
+
+def register(dp):
+    # Подключается первым, чтобы трассировка охватывала и остальные middleware
+    dp.update.outer_middleware(TracingMiddleware())
@@ -1,90 +1,224 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from typing import BinaryIO
 
-import requests
+import aiohttp
 
-from config import API_URL
+from config import (API_URL, API_POOL_SIZE, API_KEEPALIVE_TIMEOUT, API_CONNECT_TIMEOUT, API_LOOKUP_TIMEOUT,
+                    API_UPDATE_TIMEOUT, API_VALIDATE_TIMEOUT, API_VALIDATE_TIMEOUT_BASE,
+                    API_VALIDATE_TIMEOUT_PER_MB, API_BREAKER_FAILURES, API_BREAKER_RECOVERY, API_GET_RETRIES,
+                    API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY)
 from logger import logger
+from services.metrics import API_REQUESTS, API_SECONDS, API_BREAKER_STATE
+from services.resilience import CircuitBreaker, CircuitOpenError, CallStats, retry, CLOSED, HALF_OPEN
+from services.tracing import span
 
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+OVERLOADED_ERROR = "Сервис проверки временно недоступен"
 
-def get_doc_options():
+LOOKUP_TIMEOUT = aiohttp.ClientTimeout(total=API_LOOKUP_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+UPDATE_TIMEOUT = aiohttp.ClientTimeout(total=API_UPDATE_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+
+# Один breaker на весь сервис document-checker: все методы живут в одном процессе за одним адресом
+_breaker = CircuitBreaker("document-checker", API_BREAKER_FAILURES, API_BREAKER_RECOVERY)
+_stats: dict[str, CallStats] = defaultdict(CallStats)
+API_BREAKER_STATE.set_function(lambda: 0 if _breaker.state == CLOSED else 1 if _breaker.state == HALF_OPEN else 2)
+
+_session: aiohttp.ClientSession | None = None
+
+
+async def init_session():
+    # Одна сессия с ограниченным пулом keep-alive соединений на всё время работы бота
+    global _session
+    if _session is not None and not _session.closed:
+        return
+    connector = aiohttp.TCPConnector(limit=API_POOL_SIZE, keepalive_timeout=API_KEEPALIVE_TIMEOUT)
+    _session = aiohttp.ClientSession(connector=connector)
+    logger.debug("Открыта HTTP-сессия API (пул: %s соединений)", API_POOL_SIZE)
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.debug("HTTP-сессия API закрыта")
+    _session = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    if _session is None or _session.closed:
+        raise RuntimeError("HTTP-сессия API не открыта, вызовите init_session()")
+    return _session
+
+
+def _is_backend_failure(e: Exception) -> bool:
+    # Сбоем сервиса считаются недоступность, таймаут и 5xx; ответы 4xx говорят, что сервис жив
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+@asynccontextmanager
+async def _call(name: str):
+    try:
+        _breaker.before_call()
+    except CircuitOpenError:
+        API_REQUESTS.labels(name, "rejected").inc()
+        raise
+    started = time.monotonic()
+    ok = False
+    try:
+        with span(f"api.{name}"):
+            yield
+        ok = True
+    except Exception as e:
+        if _is_backend_failure(e):
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+        raise
+    except BaseException:
+        # Отмена не говорит ни об успехе, ни о сбое сервиса, но пробный запрос нужно освободить
+        _breaker.release_trial()
+        raise
+    else:
+        _breaker.record_success()
+    finally:
+        elapsed = time.monotonic() - started
+        _stats[name].record(elapsed, ok)
+        API_SECONDS.labels(name).observe(elapsed)
+        API_REQUESTS.labels(name, "ok" if ok else "error").inc()
+
+
+def validation_retry_after() -> float:
+    # Через сколько секунд сервис снова готов принимать проверки (0 — уже готов)
+    return _breaker.retry_after()
+
+
+def health_snapshot() -> dict:
+    return {
+        "breaker": _breaker.snapshot(),
+        "calls": {name: stats.snapshot() for name, stats in sorted(_stats.items())},
+    }
+
+
+def validate_timeout(*files: BinaryIO) -> aiohttp.ClientTimeout:
+    # Таймаут проверки растёт с размером загружаемых файлов, но не больше API_VALIDATE_TIMEOUT
+    size = 0
+    for f in files:
+        position = f.tell()
+        size += f.seek(0, 2)
+        f.seek(position)
+    total = min(API_VALIDATE_TIMEOUT, API_VALIDATE_TIMEOUT_BASE + size / (1024 * 1024) * API_VALIDATE_TIMEOUT_PER_MB)
+    return aiohttp.ClientTimeout(total=total, connect=API_CONNECT_TIMEOUT)
+
+
+async def _get_json(name: str, url: str):
+    # Только идемпотентные GET повторяются с задержкой; при разомкнутой цепи повторов нет
+    async def attempt():
+        async with _call(name):
+            async with _get_session().get(url, timeout=LOOKUP_TIMEOUT) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    return await retry(attempt, API_GET_RETRIES, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY, _is_backend_failure)
+
+
+async def get_doc_options():
     try:
-        response = requests.get(f"{API_URL}/api/documents/options")
-        response.raise_for_status()
+        options = await _get_json("get_doc_options", f"{API_URL}/api/documents/options")
         logger.debug("Получены доступные типы документов.")
-        return response.json()
+        return options
     except Exception as e:
-        logger.error(f"Ошибка при получении типов документов: {e}")
+        logger.error("Ошибка при получении типов документов: %s", e)
         return None
 
 
-def get_rules(doc_type: str):
+async def get_rules(doc_type: str):
     try:
-        response = requests.get(f"{API_URL}/api/rules/{doc_type}")
-        response.raise_for_status()
-        logger.debug(f"Получены правила для документа {doc_type}.")
-        return response.json()
+        rules = await _get_json("get_rules", f"{API_URL}/api/rules/{doc_type}")
+        logger.debug("Получены правила для документа %s.", doc_type)
+        return rules
     except Exception as e:
-        logger.error(f"Ошибка при получении правил: {e}")
+        logger.error("Ошибка при получении правил: %s", e)
         return None
 
 
-def change_rule(doc_type: str, rule_key: str, new_value: str):
-    print(f"Изменение правила {rule_key} для {doc_type} на {new_value}")
+async def change_rule(doc_type: str, rule_key: str, new_value: str):
+    logger.debug("Изменение правила %s для %s на %s", rule_key, doc_type, new_value)
     try:
-        response = requests.post(
-            f"{API_URL}/api/rules/update",
-            params={"doc_type": doc_type, "rule_key": rule_key, "new_value": new_value}
-        )
-        print(response.status_code)
-        response.raise_for_status()
-        logger.info(f"Изменено правило {rule_key} для {doc_type} на {new_value}.")
-        return response.json()
+        async with _call("change_rule"), _get_session().post(
+                f"{API_URL}/api/rules/update",
+                params={"doc_type": doc_type, "rule_key": rule_key, "new_value": new_value},
+                timeout=UPDATE_TIMEOUT
+        ) as response:
+            logger.debug("Ответ API на изменение правила: %s", response.status)
+            response.raise_for_status()
+            logger.info("Изменено правило %s для %s на %s.", rule_key, doc_type, new_value)
+            return await response.json(content_type=None)
     except Exception as e:
-        logger.error(f"Ошибка при изменении правила: {e}")
+        logger.error("Ошибка при изменении правила: %s", e)
         return None
 
 
-def change_rule_for_all(rule_key: str, new_value: str) -> dict | None:
+async def change_rule_for_all(rule_key: str, new_value: str) -> dict | None:
     try:
-        response = requests.post(
-            f"{API_URL}/api/rules/update/all",
-            params={"rule_key": rule_key, "new_value": new_value}
-        )
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"message": f"Ошибка {response.status_code}", "details": response.text}
+        async with _call("change_rule_for_all"), _get_session().post(
+                f"{API_URL}/api/rules/update/all",
+                params={"rule_key": rule_key, "new_value": new_value},
+                timeout=UPDATE_TIMEOUT
+        ) as response:
+            if response.status == 200:
+                return await response.json(content_type=None)
+            details = await response.text()
+            if response.status >= 500:
+                # Исключение внутри _call засчитывается breaker'у как сбой сервиса
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=details)
+            return {"message": f"Ошибка {response.status}", "details": details}
+    except aiohttp.ClientResponseError as e:
+        return {"message": f"Ошибка {e.status}", "details": e.message}
     except Exception as e:
         return {"message": "Ошибка при подключении к API", "details": str(e)}
 
 
-def validate_docx_document(file: BinaryIO, filename: str, doc_type: str) -> dict | None:
+async def validate_docx_document(file: BinaryIO, filename: str, doc_type: str) -> dict | None:
+    form = aiohttp.FormData()
+    form.add_field("doc_type", doc_type)
+    form.add_field("file", file, filename=filename, content_type=DOCX_CONTENT_TYPE)
     try:
-        response = requests.post(
-            f"{API_URL}/api/documents/validate/single_file",
-            files={"file": (filename, file, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")},
-            data={"doc_type": doc_type}
-        )
-        response.raise_for_status()
-        return response.json()
+        async with _call("validate_docx"), _get_session().post(
+                f"{API_URL}/api/documents/validate/single_file",
+                data=form,
+                timeout=validate_timeout(file)
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+    except CircuitOpenError as e:
+        return {"error": OVERLOADED_ERROR, "details": str(e), "overloaded": True}
     except Exception as e:
-        logger.error(f"Ошибка при проверке .docx документа: {e}")
+        logger.error("Ошибка при проверке .docx документа: %s", e)
         return {"error": "Ошибка при отправке документа на сервер", "details": str(e)}
 
 
-def validate_latex_document(tex_file: BinaryIO, tex_name: str, sty_file: BinaryIO, sty_name: str,
-                            doc_type: str) -> dict | None:
+async def validate_latex_document(tex_file: BinaryIO, tex_name: str, sty_file: BinaryIO, sty_name: str,
+                                  doc_type: str) -> dict | None:
+    form = aiohttp.FormData()
+    form.add_field("doc_type", doc_type)
+    form.add_field("tex_file", tex_file, filename=tex_name, content_type="application/x-tex")
+    form.add_field("sty_file", sty_file, filename=sty_name, content_type="application/x-sty")
     try:
-        response = requests.post(
-            f"{API_URL}/api/documents/validate/latex",
-            files={
-                "tex_file": (tex_name, tex_file, "application/x-tex"),
-                "sty_file": (sty_name, sty_file, "application/x-sty")
-            },
-            data={"doc_type": doc_type}
-        )
-        response.raise_for_status()
-        return response.json()
+        async with _call("validate_latex"), _get_session().post(
+                f"{API_URL}/api/documents/validate/latex",
+                data=form,
+                timeout=validate_timeout(tex_file, sty_file)
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+    except CircuitOpenError as e:
+        return {"error": OVERLOADED_ERROR, "details": str(e), "overloaded": True}
     except Exception as e:
-        logger.error(f"Ошибка при проверке LaTeX документов: {e}")
+        logger.error("Ошибка при проверке LaTeX документов: %s", e)
         return {"error": "Ошибка при отправке LaTeX-документов на сервер", "details": str(e)}
@@ -0,0 +1,72 @@
+import re
+from collections import defaultdict
+
+LATEX_ASPECT_PATTERNS = {
+    "structure.chapters": ["Отсутствует обязательная глава", "Ошибка: после \\\\chapter",
+                           "Ошибка: титульный лист", "Ошибка: отсутствует \\tableofcontents"],
+    "structure.sections": ["В главе"],
+    "bold.relevance": ["Не удалось найти текст введения", "актуальн"],
+    "bold.goal": ["Не удалось найти текст введения", "цель"],
+    "bold.tasks": ["Не удалось найти текст введения", "задачи"],
+    "bold.object": ["Не удалось найти текст введения", "предмет"],
+    "bold.subject": ["Не удалось найти текст введения", "объект"],
+    "bold.novelty": ["Не удалось найти текст введения", "новизн"],
+    "bold.significance": ["Не удалось найти текст введения", "практическая значимость"],
+    "bold.excess": ["жирный"],
+    "italic": ["курсив"],
+    "underline": ["подчёркивание"],
+    "lists": ["Пункт списка", "Вводная часть перед списком", "во вложенном списке", "вложенного списка"],
+    "pictures.links": ["Нет ссылки на рисунок", "Нет рисунка"],
+    "tables.links": ["Нет ссылки на table", "Нет table", "Нет ссылки на longtable", "Нет longtable"],
+    "appendices.links": ["приложение"],
+    "bibliography.links": ["библиографии"],
+    "order.references_before_objects": ["находится после"],
+    "order.same_page": ["Слишком большое расстояние", "на той же или следующей странице"],
+    "quotes": ["Найдены недопустимые кавычки"],
+    "sty": ["Файл settings.sty", "Несовпадение в settings.sty"],
+}
+
+DOCX_ASPECT_PATTERNS = {
+    "structure.chapters": ["Не найдена обязательная глава"],
+    "structure.sections": ["В главе"],
+    "bold.relevance": ["Во введении не найдено ключевое слово или словосочетание: 'актуальн'"],
+    "bold.goal": ["Во введении не найдено ключевое слово или словосочетание: 'цель'"],
+    "bold.tasks": ["Во введении не найдено ключевое слово или словосочетание: 'задачи'"],
+    "bold.object": ["Во введении не найдено ключевое слово или словосочетание: 'предмет'"],
+    "bold.subject": ["Во введении не найдено ключевое слово или словосочетание: 'объект'"],
+    "bold.novelty": ["Во введении не найдено ключевое слово или словосочетание: 'новизн'"],
+    "bold.significance": ["Во введении не найдено ключевое слово или словосочетание: 'практическая значимость'"],
+    "pictures.links": ["Есть подпись к рисунку", "Есть ссылка на рисунок", "В подписи к рисунку "],
+    "tables.links": ["Есть ссылка на таблицу ", "Есть подпись к таблице ", "Нет ссылки на longtable", "Нет longtable"],
+    "appendices.links": ["Есть ссылка на приложение", "Приложение"],
+    "bibliography.links": ["В тексте есть ссылка на источник", "Источник"],
+    "font": ["Неверный размер шрифта"],
+}
+
+
+# Раскладывает ошибки по аспектам проверки: каждая ошибка проверяется один раз каждым уникальным шаблоном
+class ErrorClassifier:
+    def __init__(self, aspect_patterns: dict[str, list[str]]):
+        # Один и тот же шаблон может относиться к нескольким аспектам — компилируется и ищется он один раз.
+        # Шаблоны не объединяются в одну альтернацию: для отдельных литеральных шаблонов re использует
+        # быстрый поиск по префиксу, и так выходит в несколько раз быстрее
+        aspects_by_pattern: dict[str, list[str]] = defaultdict(list)
+        for aspect, patterns in aspect_patterns.items():
+            for pattern in patterns:
+                if aspect not in aspects_by_pattern[pattern]:
+                    aspects_by_pattern[pattern].append(aspect)
+        self._rules = [(re.compile(pattern, re.IGNORECASE), aspects) for pattern, aspects in aspects_by_pattern.items()]
+
+    def aspects_of(self, error: str) -> set[str]:
+        return {aspect for regex, aspects in self._rules if regex.search(error) for aspect in aspects}
+
+    def classify(self, errors: list[str]) -> dict[str, list[str]]:
+        buckets: dict[str, list[str]] = defaultdict(list)
+        for error in errors:
+            for aspect in self.aspects_of(error):
+                buckets[aspect].append(error)
+        return dict(buckets)
+
+
+latex_classifier = ErrorClassifier(LATEX_ASPECT_PATTERNS)
+docx_classifier = ErrorClassifier(DOCX_ASPECT_PATTERNS)
@@ -0,0 +1,65 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InputFile, Message
+
+from config import (TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_SEND_RETRIES,
+                    WORKER_PROCESSES)
+from logger import logger
+from services.ratelimit import TokenBucket, BucketRegistry
+
+
+# Отправка сообщений с учётом лимитов Telegram: общий на бота и отдельный на каждый чат
+class DeliveryScheduler:
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, retries: int):
+        self.retries = retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = BucketRegistry(chat_rate, chat_burst)
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_users: Counter[int] = Counter()
+
+    async def _call(self, chat_id: int, method: Callable[[], Awaitable[Any]]):
+        chat_bucket = self._chats.get(chat_id)
+        for attempt in range(self.retries + 1):
+            await chat_bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await method()
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Telegram ограничил отправку в чат %s, повтор через %s с", chat_id, e.retry_after)
+                chat_bucket.pause(e.retry_after)
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> Message:
+        return await self._call(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+
+    async def send_document(self, bot: Bot, chat_id: int, document: InputFile, **kwargs) -> Message:
+        return await self._call(chat_id, lambda: bot.send_document(chat_id, document, **kwargs))
+
+    async def send_chunks(self, bot: Bot, chat_id: int, chunks: list[str], **kwargs):
+        # Части одного текста уходят строго по порядку, и две длинные отправки в один чат не перемешиваются;
+        # разные чаты при этом отправляются параллельно
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_users[chat_id] += 1
+        try:
+            async with lock:
+                for chunk in chunks:
+                    await self.send(bot, chat_id, chunk, **kwargs)
+        finally:
+            self._chat_users[chat_id] -= 1
+            if not self._chat_users[chat_id]:
+                del self._chat_users[chat_id]
+                del self._chat_locks[chat_id]
+
+
+delivery = DeliveryScheduler(
+    # Лимит Telegram общий на бота, а счётчик у каждого процесса свой
+    global_rate=TELEGRAM_GLOBAL_RATE / WORKER_PROCESSES,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    chat_burst=TELEGRAM_CHAT_BURST,
+    retries=TELEGRAM_SEND_RETRIES
+)
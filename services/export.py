@@ -0,0 +1,37 @@
+import csv
+import gzip
+import os
+import tempfile
+from datetime import timedelta
+
+from config import DB_PATH
+from db import EXPORT_COLUMNS, iter_checks, local_now, open_connection
+
+
+def write_checks_csv(days: int, compress: bool = False) -> tuple[str, int]:
+    # Выполняется вне цикла событий на отдельном читающем соединении (WAL не блокирует запись),
+    # память не зависит от числа строк: они пишутся в файл по мере чтения курсора
+    since = (local_now() - timedelta(days=days)).isoformat()
+    fd, path = tempfile.mkstemp(prefix="checks_", suffix=".csv.gz" if compress else ".csv")
+    os.close(fd)
+
+    conn = open_connection(DB_PATH)
+    try:
+        # utf-8-sig, чтобы Excel правильно открыл кириллицу
+        if compress:
+            file = gzip.open(path, "wt", encoding="utf-8-sig", newline="")
+        else:
+            file = open(path, "w", encoding="utf-8-sig", newline="")
+        count = 0
+        with file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(EXPORT_COLUMNS)
+            for row in iter_checks(conn, since):
+                writer.writerow(row)
+                count += 1
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return path, count
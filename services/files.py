@@ -0,0 +1,77 @@
+import hashlib
+import io
+import tempfile
+import time
+from typing import BinaryIO, Callable
+
+from aiogram import Bot
+
+from config import UPLOAD_SPOOL_THRESHOLD, TELEGRAM_DOWNLOAD_TIMEOUT, DOWNLOAD_CHUNK_SIZE, PREVALIDATION_SNIFF_BYTES
+from services.metrics import DOWNLOAD_SECONDS, DOWNLOAD_BYTES
+from services.prevalidation import PrevalidationError
+from services.tracing import span
+
+
+class _HashingWriter:
+    # Считает SHA-256 по мере записи чанков, чтобы не перечитывать файл после скачивания.
+    # check(head) получает начало файла, как только оно скачано; ошибка прерывает скачивание
+    def __init__(self, target: BinaryIO, check: Callable[[bytes], str | None] | None = None):
+        self.target = target
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self._check = check
+        self._head = bytearray()
+
+    def write(self, chunk: bytes) -> int:
+        if self._check is not None:
+            self._head += chunk[:PREVALIDATION_SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= PREVALIDATION_SNIFF_BYTES:
+                self.check_head()
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return self.target.write(chunk)
+
+    def check_head(self):
+        check, self._check = self._check, None
+        error = check(bytes(self._head)) if check is not None else None
+        if error:
+            raise PrevalidationError(error)
+
+    def flush(self):
+        self.target.flush()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.target.seek(offset, whence)
+
+
+def _spool(file_size: int | None) -> BinaryIO:
+    # Небольшие файлы держим в памяти, крупные сразу пишем во временный файл на диске
+    if file_size is not None and file_size <= UPLOAD_SPOOL_THRESHOLD:
+        return io.BytesIO()
+    return tempfile.TemporaryFile(prefix="doccheck_")
+
+
+async def download_document(bot: Bot, file: dict,
+                            check: Callable[[bytes], str | None] | None = None) -> tuple[BinaryIO, str]:
+    # file — описание документа из задания: file_id, file_name, file_size
+    started = time.perf_counter()
+    with span("telegram.get_file"):
+        file_obj = await bot.get_file(file["file_id"])
+    spool = _spool(file.get("file_size") or file_obj.file_size)
+    writer = _HashingWriter(spool, check)
+    try:
+        with span("telegram.download_file", file_size=file_obj.file_size):
+            await bot.download_file(
+                file_obj.file_path,
+                destination=writer,
+                timeout=TELEGRAM_DOWNLOAD_TIMEOUT,
+                chunk_size=DOWNLOAD_CHUNK_SIZE
+            )
+        # Файл короче окна проверки: его начало — весь файл
+        writer.check_head()
+    except Exception:
+        spool.close()
+        raise
+    DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+    DOWNLOAD_BYTES.inc(writer.size)
+    return spool, writer.digest.hexdigest()
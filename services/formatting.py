@@ -1,47 +1,161 @@
+import html
+import re
+
+from aiogram import Bot
 from aiogram.types import Message
 
+from services.classifier import latex_classifier, docx_classifier
+from services.delivery import delivery
+from services.metrics import FORMAT_SECONDS, timed
 
-async def send_long_message(message: Message, text: str):
-    max_length = 4096
-    for i in range(0, len(text), max_length):
-        await message.answer(text[i:i + max_length], parse_mode="HTML")
+MESSAGE_LIMIT = 4096
+# Запас под закрывающие и повторно открытые теги при принудительной разбивке длинной строки
+TAG_RESERVE = 256
 
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>")
 
-def format_latex_validation_result(result: dict) -> str:
-    def yesno(errors: list, key: str) -> str:
-        patterns = {
-            "structure.chapters": ["Отсутствует обязательная глава", "Ошибка: после \\\\chapter",
-                                   "Ошибка: титульный лист", "Ошибка: отсутствует \\tableofcontents"],
-            "structure.sections": ["В главе"],
-            "bold.relevance": ["Не удалось найти текст введения", "актуальн"],
-            "bold.goal": ["Не удалось найти текст введения", "цель"],
-            "bold.tasks": ["Не удалось найти текст введения", "задачи"],
-            "bold.object": ["Не удалось найти текст введения", "предмет"],
-            "bold.subject": ["Не удалось найти текст введения", "объект"],
-            "bold.novelty": ["Не удалось найти текст введения", "новизн"],
-            "bold.significance": ["Не удалось найти текст введения", "практическая значимость"],
-            "bold.excess": ["жирный"],
-            "italic": ["курсив"],
-            "underline": ["подчёркивание"],
-            "lists": ["Пункт списка", "Вводная часть перед списком", "во вложенном списке", "вложенного списка"],
-            "pictures.links": ["Нет ссылки на рисунок", "Нет рисунка"],
-            "tables.links": ["Нет ссылки на table", "Нет table", "Нет ссылки на longtable", "Нет longtable"],
-            "appendices.links": ["приложение"],
-            "bibliography.links": ["библиографии"],
-            "order.references_before_objects": ["находится после"],
-            "order.same_page": ["Слишком большое расстояние", "на той же или следующей странице"],
-            "quotes": ["Найдены недопустимые кавычки"],
-            "sty": ["Файл settings.sty", "Несовпадение в settings.sty"],
-        }
-
-        import re
-        key_patterns = patterns.get(key, [])
-        for err in errors:
-            for p in key_patterns:
-                if re.search(p, err, re.IGNORECASE):
-                    return "Нет ❌"
-        return "Да ✅"
 
+async def send_long_message(message: Message, text: str):
+    await send_long_text(message.bot, message.chat.id, text)
+
+
+async def send_long_text(bot: Bot, chat_id: int, text: str):
+    await delivery.send_chunks(bot, chat_id, split_html(text), parse_mode="HTML")
+
+
+def _hard_split(line: str, limit: int) -> list[str]:
+    parts = []
+    while len(line) > limit:
+        space = max(line.rfind(" ", 0, limit), line.rfind("\n", 0, limit))
+        cut = space + 1 if space >= 0 else limit
+        # Не режем внутри тега или HTML-сущности
+        tag_start = line.rfind("<", 0, cut)
+        if tag_start > line.rfind(">", 0, cut):
+            cut = tag_start
+        entity_start = line.rfind("&", 0, cut)
+        if entity_start > line.rfind(";", 0, cut):
+            cut = entity_start
+        if cut == 0:
+            # Строка начинается с тега или сущности длиннее найденного места разреза: они уходят в часть целиком
+            cut = line.find(">" if line.startswith("<") else ";") + 1 or limit
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return parts
+
+
+def split_lines(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    # Куски по границам абзацев, затем строк; слишком длинная строка режется по пробелу
+    pieces = []
+    for paragraph in re.split(r"(?<=\n\n)", text):
+        if len(paragraph) <= limit:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.splitlines(keepends=True):
+            pieces.extend([line] if len(line) <= limit else _hard_split(line, limit))
+    return pieces
+
+
+def merge_lines(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    chunks = []
+    current = ""
+    for piece in split_lines(text, limit):
+        if current and len(current) + len(piece) > limit:
+            chunks.append(current)
+            current = ""
+        current += piece
+    chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _track_tags(stack: list[tuple[str, str]], piece: str) -> list[tuple[str, str]]:
+    stack = list(stack)
+    for match in TAG_RE.finditer(piece):
+        closing, name = match.group(1), match.group(2).lower()
+        if not closing:
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i]
+                break
+    return stack
+
+
+def _closers(stack: list[tuple[str, str]]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+@timed(FORMAT_SECONDS.labels("split"))
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    # Части собираются из целых абзацев (аспектов отчёта); незакрытые на границе теги
+    # закрываются в конце части и заново открываются в начале следующей
+    chunks = []
+    stack: list[tuple[str, str]] = []
+    prefix = ""
+    current: list[str] = []
+    current_len = 0
+
+    def flush():
+        body = "".join(current).strip()
+        if body:
+            chunks.append(prefix + body + _closers(stack))
+
+    for piece in split_lines(text, limit - TAG_RESERVE):
+        new_stack = _track_tags(stack, piece)
+        if current and len(prefix) + current_len + len(piece) + len(_closers(new_stack)) > limit:
+            flush()
+            prefix = "".join(tag for _, tag in stack)
+            current, current_len = [], 0
+        current.append(piece)
+        current_len += len(piece)
+        stack = new_stack
+    flush()
+    return chunks
+
+
+def listing(items) -> str:
+    # Названия, метки и заголовки взяты из документа пользователя: экранируются, чтобы не ломать
+    # разметку сообщения Telegram и не попасть живыми тегами в HTML-отчёт
+    return ", ".join(html.escape(str(item)) for item in items) or "нет"
+
+
+def yesno(buckets: dict[str, list[str]], key: str) -> str:
+    return verdict(not buckets.get(key))
+
+
+def verdict(valid: bool) -> str:
+    return "Да ✅" if valid else "Нет ❌"
+
+
+def render_aspects(aspects: list[tuple]) -> str:
+    lines = []
+    for aspect in aspects:
+        if len(aspect) == 2:
+            name, validity = aspect
+            lines.append(f"🔹{name}: {validity}\n")
+        else:
+            name, validity, detail = aspect
+            lines.append(f"🔹{name} — {validity} {detail}\n")
+
+    return "\n".join(lines)
+
+
+def format_errors(errors: list) -> str:
+    return "\n".join(f"📌 {html.escape(str(e))}\n" for e in errors) if errors else "Ошибок не найдено😊"
+
+
+def format_validation_result(title: str, result: dict, aspects: list[tuple]) -> str:
+    return (
+        f"📋 <b>Результат проверки {title}-документа</b>\n\n"
+        f"💬 <u><b>Правильное оформление:</b></u> {verdict(result.get('valid', True))}\n\n"
+        f"🔎 <u><b>Детали проверки:</b></u>\n{render_aspects(aspects)}\n"
+        f"⚠️ <u><b>Обнаруженные ошибки:</b></u>\n\n{format_errors(result.get('errors', []))}"
+    )
+
+
+def latex_validation_aspects(result: dict) -> list[tuple]:
+    # Аспекты отчёта: (название, вердикт) или (название, вердикт, подробности)
     def get_list_summary(found: dict) -> str:
         lists = found.get("lists", {})
         return (
@@ -53,20 +167,20 @@ def format_latex_validation_result(result: dict) -> str:
 
     def get_pic_summary(found: dict) -> str:
         pics = found.get("pictures", {})
-        labels = ", ".join(p.get("label") for p in pics.get("labels", [])) or "нет"
-        refs = ", ".join(p.get("label") for p in pics.get("refs", [])) or "нет"
+        labels = listing(p.get("label") for p in pics.get("labels", []))
+        refs = listing(p.get("label") for p in pics.get("refs", []))
         return f"<blockquote>Найденные рисунки:\n- Метка объектов: {labels}\n- Ссылки в тексте: {refs}</blockquote>"
 
     def get_table_summary(found: dict) -> str:
         tables = found.get("tables", {}).get("tables", {})
-        labels = ", ".join(t.get("label") for t in tables.get("labels", [])) or "нет"
-        refs = ", ".join(t.get("label") for t in tables.get("refs", [])) or "нет"
+        labels = listing(t.get("label") for t in tables.get("labels", []))
+        refs = listing(t.get("label") for t in tables.get("refs", []))
         return f"<blockquote>Найденные таблицы:\n- Метки объектов: {labels}\n- Ссылки в тексте: {refs}</blockquote>"
 
     def get_chapters(found: dict) -> str:
         structure = found.get("structure", {})
-        unnum = ", ".join(structure.get("unnumbered_chapters", [])) or "нет"
-        num = ", ".join(structure.get("numbered_chapters", [])) or "нет"
+        unnum = listing(structure.get("unnumbered_chapters", []))
+        num = listing(structure.get("numbered_chapters", []))
         return f"<blockquote> Главы:\n- Ненумерованные: {unnum}\n- Нумерованные: {num} </blockquote>"
 
     def get_sections(found: dict) -> str:
@@ -75,8 +189,7 @@ def format_latex_validation_result(result: dict) -> str:
         unsec = structure.get("unnumbered_sections", {})
 
         def format_sec(sec_dict, title):
-            entries = sec_dict.get(title, [])
-            return ", ".join(entries) if entries else "нет"
+            return listing(sec_dict.get(title, []))
 
         return (
             f"<blockquote>Разделы:\n"
@@ -88,170 +201,103 @@ def format_latex_validation_result(result: dict) -> str:
         biblio = found.get("bibliography", {})
         bib_titles = biblio.get("bibliography_items", [])
         bib_refs = biblio.get("cite_keys", [])
-        return f"<blockquote>Найденные источники:\n- Элементы списка: {', '.join(bib_titles) if bib_titles else 'нет'}\n- Ссылки в тексте: {', '.join(bib_refs) if bib_refs else 'нет'}</blockquote>"
+        return f"<blockquote>Найденные источники:\n- Элементы списка: {listing(bib_titles)}\n- Ссылки в тексте: {listing(bib_refs)}</blockquote>"
 
     def get_appendices(found: dict) -> str:
         appendices = found.get("appendices", {})
         appendix_titles = appendices.get("titles", [])
         appendix_refs = appendices.get("refs", [])
-        return f"<blockquote>Найденные приложения:\n- Заголовки: {', '.join(appendix_titles) if appendix_titles else 'нет'}\n- Ссылки в тексте: {', '.join(appendix_refs) if appendix_refs else 'нет'}</blockquote>"
-
-    def format_readable() -> str:
-        errors = result.get("errors", [])
-        found = result.get("found", {})
-
-        aspects = [
-            ("Необходимые главы", yesno(errors, "structure.chapters"), get_chapters(found)),
-            ("Необходимые разделы", yesno(errors, "structure.sections"), get_sections(found)),
-            ("Цель выделена жирным", yesno(errors, "bold.goal")),
-            ("Задачи выделены жирным", yesno(errors, "bold.tasks")),
-            ("Актуальность жирным", yesno(errors, "bold.relevance")),
-            ("Объект выделен жирным", yesno(errors, "bold.subject")),
-            ("Предмет выделен жирным", yesno(errors, "bold.object")),
-            ("Новизна выделена жирным", yesno(errors, "bold.novelty")),
-            ("Практич. значимость жирным", yesno(errors, "bold.significance")),
-            ("Нет лишнего жирного", yesno(errors, "bold.excess")),
-            ("Нет курсива", yesno(errors, "italic")),
-            ("Нет подчеркиваний", yesno(errors, "underline")),
-            ("Списки оформлены корректно", yesno(errors, "lists"), get_list_summary(found)),
-            ("Рисунки и ссылки на них", yesno(errors, "pictures.links"), get_pic_summary(found)),
-            ("Таблицы и ссылки на них", yesno(errors, "tables.links"), get_table_summary(found)),
-            ("Приложения и ссылки на них", yesno(errors, "appendices.links"), get_appendices(found)),
-            ("Источники и ссылки на них", yesno(errors, "bibliography.links"), get_biblio(found)),
-            ("Ссылки находятся до рисунка/таблицы", yesno(errors, "order.references_before_objects")),
-            ("Ссылки на той же/соседней странице от рис./табл.", yesno(errors, "order.same_page")),
-            ("Кавычки верные", yesno(errors, "quotes")),
-            ("Файл settings.sty соответствует требованиям", yesno(errors, "sty")),
-        ]
-
-        lines = []
-        for aspect in aspects:
-            if len(aspect) == 2:
-                name, validity = aspect
-                lines.append(f"🔹{name}: {validity}\n")
-            else:
-                name, validity, detail = aspect
-                lines.append(f"🔹{name} — {validity} {detail}\n")
-
-        return "\n".join(lines)
-
-    def format_errors(errors: list) -> str:
-        return "\n".join(f"📌 {e}\n" for e in errors) if errors else "Ошибок не найдено😊"
-
-    valid = "Да ✅" if result.get("valid", True) else "Нет ❌"
-    check_results = format_readable()
-    errors_text = format_errors(result.get("errors", []))
-
-    return (
-        f"📋 <b>Результат проверки LaTeX-документа</b>\n\n"
-        f"💬 <u><b>Правильное оформление:</b></u> {valid}\n\n"
-        f"🔎 <u><b>Детали проверки:</b></u>\n{check_results}\n"
-        f"⚠️ <u><b>Обнаруженные ошибки:</b></u>\n\n{errors_text}"
-    )
-
+        return f"<blockquote>Найденные приложения:\n- Заголовки: {listing(appendix_titles)}\n- Ссылки в тексте: {listing(appendix_refs)}</blockquote>"
+
+    buckets = latex_classifier.classify(result.get("errors", []))
+    found = result.get("found", {})
+
+    return [
+        ("Необходимые главы", yesno(buckets, "structure.chapters"), get_chapters(found)),
+        ("Необходимые разделы", yesno(buckets, "structure.sections"), get_sections(found)),
+        ("Цель выделена жирным", yesno(buckets, "bold.goal")),
+        ("Задачи выделены жирным", yesno(buckets, "bold.tasks")),
+        ("Актуальность жирным", yesno(buckets, "bold.relevance")),
+        ("Объект выделен жирным", yesno(buckets, "bold.subject")),
+        ("Предмет выделен жирным", yesno(buckets, "bold.object")),
+        ("Новизна выделена жирным", yesno(buckets, "bold.novelty")),
+        ("Практич. значимость жирным", yesno(buckets, "bold.significance")),
+        ("Нет лишнего жирного", yesno(buckets, "bold.excess")),
+        ("Нет курсива", yesno(buckets, "italic")),
+        ("Нет подчеркиваний", yesno(buckets, "underline")),
+        ("Списки оформлены корректно", yesno(buckets, "lists"), get_list_summary(found)),
+        ("Рисунки и ссылки на них", yesno(buckets, "pictures.links"), get_pic_summary(found)),
+        ("Таблицы и ссылки на них", yesno(buckets, "tables.links"), get_table_summary(found)),
+        ("Приложения и ссылки на них", yesno(buckets, "appendices.links"), get_appendices(found)),
+        ("Источники и ссылки на них", yesno(buckets, "bibliography.links"), get_biblio(found)),
+        ("Ссылки находятся до рисунка/таблицы", yesno(buckets, "order.references_before_objects")),
+        ("Ссылки на той же/соседней странице от рис./табл.", yesno(buckets, "order.same_page")),
+        ("Кавычки верные", yesno(buckets, "quotes")),
+        ("Файл settings.sty соответствует требованиям", yesno(buckets, "sty")),
+    ]
+
+
+@timed(FORMAT_SECONDS.labels("latex"))
+def format_latex_validation_result(result: dict) -> str:
+    return format_validation_result("LaTeX", result, latex_validation_aspects(result))
 
-def format_docx_validation_result(result: dict) -> str:
-    def yesno(errors: list, key: str) -> str:
-        patterns = {
-            "structure.chapters": ["Не найдена обязательная глава"],
-            "structure.sections": ["В главе"],
-            "bold.relevance": ["Во введении не найдено ключевое слово или словосочетание: 'актуальн'"],
-            "bold.goal": ["Во введении не найдено ключевое слово или словосочетание: 'цель'"],
-            "bold.tasks": ["Во введении не найдено ключевое слово или словосочетание: 'задачи'"],
-            "bold.object": ["Во введении не найдено ключевое слово или словосочетание: 'предмет'"],
-            "bold.subject": ["Во введении не найдено ключевое слово или словосочетание: 'объект'"],
-            "bold.novelty": ["Во введении не найдено ключевое слово или словосочетание: 'новизн'"],
-            "bold.significance": ["Во введении не найдено ключевое слово или словосочетание: 'практическая значимость'"],
-            "pictures.links": ["Есть подпись к рисунку", "Есть ссылка на рисунок", "В подписи к рисунку "],
-            "tables.links": ["Есть ссылка на таблицу ", "Есть подпись к таблице ", "Нет ссылки на longtable", "Нет longtable"],
-            "appendices.links": ["Есть ссылка на приложение", "Приложение"],
-            "bibliography.links": ["В тексте есть ссылка на источник", "Источник"],
-            "font": ["Неверный размер шрифта"],
-        }
-
-        import re
-        key_patterns = patterns.get(key, [])
-        for err in errors:
-            for p in key_patterns:
-                if re.search(p, err, re.IGNORECASE):
-                    return "Нет ❌"
-        return "Да ✅"
 
+def docx_validation_aspects(result: dict) -> list[tuple]:
+    # Аспекты отчёта: (название, вердикт) или (название, вердикт, подробности)
     def get_list_summary(found: dict) -> str:
         pass
 
     def get_pic_summary(found: dict) -> str:
         pics = found.get("pictures", {})
-        pic_refs = ", ".join(pics.get("ref", [])) or "нет"
-        pic_captions = ", ".join(pics.get("caption", [])) or "нет"
+        pic_refs = listing(pics.get("ref", []))
+        pic_captions = listing(pics.get("caption", []))
         return f"<blockquote>Найденные рисунки:\n- Подписи: {pic_captions}\n- Ссылки в тексте: {pic_refs}</blockquote>"
 
     def get_table_summary(found: dict) -> str:
         tables = found.get("tables", {})
-        table_refs = ", ".join(tables.get("ref", [])) or "нет"
-        table_captions = ", ".join(tables.get("caption", [])) or "нет"
+        table_refs = listing(tables.get("ref", []))
+        table_captions = listing(tables.get("caption", []))
         return f"<blockquote>Найденные таблицы:\n- Подписи: {table_captions}\n- Ссылки в тексте: {table_refs}</blockquote>"
 
     def get_chapters(found: dict) -> str:
         structure = found.get("structure", {})
-        unnum = ", ".join(structure.get("unnumbered_chapters", [])) or "нет"
-        num = ", ".join(structure.get("numbered_chapters", [])) or "нет"
+        unnum = listing(structure.get("unnumbered_chapters", []))
+        num = listing(structure.get("numbered_chapters", []))
         return f"<blockquote> Главы:\n- Ненумерованные: {unnum}\n- Нумерованные: {num} </blockquote>"
 
     def get_biblio(found:dict):
         biblio = found.get("bibliography", {})
-        bib_refs = ", ".join(biblio.get("cite_keys", [])) or "нет"
-        bib_items = ", ".join(biblio.get("items", [])) or "нет"
+        bib_refs = listing(biblio.get("cite_keys", []))
+        bib_items = listing(biblio.get("items", []))
         return f"<blockquote>Найденные источники:\n- Элементы списка: {bib_items}\n- Ссылки в тексте: {bib_refs}</blockquote>"
 
     def get_appendices(found: dict) -> str:
         appendices = found.get("appendices", {})
-        appendix_refs = ", ".join(appendices.get("ref", [])) or "нет"
-        appendix_titles = ", ".join(appendices.get("title", [])) or "нет"
+        appendix_refs = listing(appendices.get("ref", []))
+        appendix_titles = listing(appendices.get("title", []))
         return f"<blockquote>Найденные приложения:\n- Заголовки: {appendix_titles}\n- Ссылки в тексте: {appendix_refs}</blockquote>"
 
-    def format_readable() -> str:
-        errors = result.get("errors", [])
-        found = result.get("found", {})
-
-        aspects = [
-            ("Необходимые главы", yesno(errors, "structure.chapters"), get_chapters(found)),
-            ("Необходимые разделы", yesno(errors, "structure.sections")),
-            ("Цель выделена жирным", yesno(errors, "bold.goal")),
-            ("Задачи выделены жирным", yesno(errors, "bold.tasks")),
-            ("Актуальность жирным", yesno(errors, "bold.relevance")),
-            ("Объект выделен жирным", yesno(errors, "bold.subject")),
-            ("Предмет выделен жирным", yesno(errors, "bold.object")),
-            ("Новизна выделена жирным", yesno(errors, "bold.novelty")),
-            ("Практич. значимость жирным", yesno(errors, "bold.significance")),
-            ("Рисунки и ссылки на них", yesno(errors, "pictures.links"), get_pic_summary(found)),
-            ("Таблицы и ссылки на них", yesno(errors, "tables.links"), get_table_summary(found)),
-            ("Приложения и ссылки на них", yesno(errors, "appendices.links"), get_appendices(found)),
-            ("Источники и ссылки на них", yesno(errors, "bibliography.links"), get_biblio(found)),
-            ("Шрифт всего документа соответствует требованиям", yesno(errors, "font")),
-        ]
-
-        lines = []
-        for aspect in aspects:
-            if len(aspect) == 2:
-                name, validity = aspect
-                lines.append(f"🔹{name}: {validity}\n")
-            else:
-                name, validity, detail = aspect
-                lines.append(f"🔹{name} — {validity} {detail}\n")
-
-        return "\n".join(lines)
-
-    def format_errors(errors: list) -> str:
-        return "\n".join(f"📌 {e}\n" for e in errors) if errors else "Ошибок не найдено😊"
-
-    valid = "Да ✅" if result.get("valid", True) else "Нет ❌"
-    check_results = format_readable()
-    errors_text = format_errors(result.get("errors", []))
-
-    return (
-        f"📋 <b>Результат проверки DOCX-документа</b>\n\n"
-        f"💬 <u><b>Правильное оформление:</b></u> {valid}\n\n"
-        f"🔎 <u><b>Детали проверки:</b></u>\n{check_results}\n"
-        f"⚠️ <u><b>Обнаруженные ошибки:</b></u>\n\n{errors_text}"
-    )
+    buckets = docx_classifier.classify(result.get("errors", []))
+    found = result.get("found", {})
+
+    return [
+        ("Необходимые главы", yesno(buckets, "structure.chapters"), get_chapters(found)),
+        ("Необходимые разделы", yesno(buckets, "structure.sections")),
+        ("Цель выделена жирным", yesno(buckets, "bold.goal")),
+        ("Задачи выделены жирным", yesno(buckets, "bold.tasks")),
+        ("Актуальность жирным", yesno(buckets, "bold.relevance")),
+        ("Объект выделен жирным", yesno(buckets, "bold.subject")),
+        ("Предмет выделен жирным", yesno(buckets, "bold.object")),
+        ("Новизна выделена жирным", yesno(buckets, "bold.novelty")),
+        ("Практич. значимость жирным", yesno(buckets, "bold.significance")),
+        ("Рисунки и ссылки на них", yesno(buckets, "pictures.links"), get_pic_summary(found)),
+        ("Таблицы и ссылки на них", yesno(buckets, "tables.links"), get_table_summary(found)),
+        ("Приложения и ссылки на них", yesno(buckets, "appendices.links"), get_appendices(found)),
+        ("Источники и ссылки на них", yesno(buckets, "bibliography.links"), get_biblio(found)),
+        ("Шрифт всего документа соответствует требованиям", yesno(buckets, "font")),
+    ]
+
+
+@timed(FORMAT_SECONDS.labels("docx"))
+def format_docx_validation_result(result: dict) -> str:
+    return format_validation_result("DOCX", result, docx_validation_aspects(result))
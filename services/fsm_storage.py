@@ -0,0 +1,43 @@
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from db import get_fsm_state, get_fsm_data, set_fsm_state, set_fsm_data, update_fsm_data, count_fsm_states
+from services import metrics
+
+
+# Хранилище FSM в SQLite: незавершённые проверки переживают перезапуск и не занимают память процесса
+class SQLiteStorage(BaseStorage):
+    def __init__(self, key_builder: KeyBuilder | None = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    def _key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await set_fsm_state(self._key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return await get_fsm_state(self._key(key))
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        await set_fsm_data(self._key(key), data)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return await get_fsm_data(self._key(key))
+
+    async def update_data(self, key: StorageKey, data: dict[str, Any]) -> dict[str, Any]:
+        return await update_fsm_data(self._key(key), data)
+
+    async def close(self) -> None:
+        # Соединением владеет db.py, оно закрывается в close_db
+        pass
+
+
+async def collect_sessions():
+    # Сессии считаются по БД, поэтому при нескольких воркерах каждый отдаёт общее число
+    metrics.FSM_SESSIONS.set(await count_fsm_states())
+
+
+metrics.add_collector(collect_sessions)
@@ -0,0 +1,267 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from logger import logger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм в секундах: от быстрых запросов к SQLite до долгих проверок документов
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_metrics: list["_Metric"] = []
+# Асинхронные сборщики вызываются перед каждой выдачей /metrics, например для подсчёта строк в БД
+_collectors: list[Callable[[], Awaitable[None]]] = []
+_runner: web.AppRunner | None = None
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Метрика в формате Prometheus: набор дочерних серий, по одной на сочетание значений меток.
+# Серия создаётся один раз, дальше на горячем пути только поиск в словаре и сложение
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получено {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in list(self._children.items())]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def get(self) -> float:
+        return float(self.function()) if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float], *values):
+        # Значение вычисляется в момент выдачи /metrics, а не обновляется на каждое событие
+        self.labels(*values).function = function
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+                for values, child in list(self._children.items())]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # counts[i] — наблюдения в (buckets[i-1], buckets[i]], последняя ячейка — больше верхней границы
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        # Запросы к SQLite наблюдаются из потока БД, остальные — из цикла событий
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(float(b) for b in buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def timed(child: _HistogramChild):
+    # Декоратор для синхронных функций: время выполнения попадает в серию гистограммы
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def add_collector(collector: Callable[[], Awaitable[None]]):
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Метрики бота. Объявлены в одном месте, чтобы список того, что можно собрать, был виден сразу
+HANDLER_REQUESTS = Counter("bot_handler_requests_total", "Вызовы хендлеров по исходу", ("handler", "status"))
+HANDLER_SECONDS = Histogram("bot_handler_duration_seconds", "Время работы хендлеров", ("handler",))
+THROTTLED_REQUESTS = Counter("bot_throttled_requests_total", "Запросы, отклонённые ограничением частоты",
+                             ("command_class", "scope"))
+API_REQUESTS = Counter("bot_api_requests_total", "Запросы к сервису проверки по исходу", ("method", "status"))
+API_SECONDS = Histogram("bot_api_request_duration_seconds", "Время запросов к сервису проверки", ("method",))
+API_BREAKER_STATE = Gauge("bot_api_breaker_state", "Состояние circuit breaker: 0 — работает, 1 — пробный, 2 — отключён")
+DOWNLOAD_SECONDS = Histogram("bot_telegram_download_duration_seconds", "Время скачивания файла из Telegram")
+DOWNLOAD_BYTES = Counter("bot_telegram_download_bytes_total", "Скачано байт из Telegram")
+DB_QUERY_SECONDS = Histogram("bot_db_query_duration_seconds", "Время выполнения запросов к SQLite",
+                             ("database", "query"))
+FORMAT_SECONDS = Histogram("bot_format_duration_seconds", "Время форматирования результатов проверки", ("stage",))
+VALIDATION_QUEUE_DEPTH = Gauge("bot_validation_queue_depth", "Задания, ожидающие проверки")
+VALIDATION_ACTIVE = Gauge("bot_validation_active", "Проверки, выполняющиеся сейчас")
+VALIDATION_WAIT_SECONDS = Histogram("bot_validation_queue_wait_seconds", "Время ожидания задания в очереди")
+VALIDATION_JOB_SECONDS = Histogram("bot_validation_job_duration_seconds", "Время выполнения задания проверки")
+FSM_SESSIONS = Gauge("bot_fsm_sessions", "Активные сессии FSM (незавершённые диалоги)")
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    for collector in _collectors:
+        try:
+            await collector()
+        except Exception as e:
+            logger.warning("Сборщик метрик %s завершился с ошибкой: %s", collector.__name__, e)
+    return web.Response(body=render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_server(host: str, port: int):
+    global _runner
+    if not port or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
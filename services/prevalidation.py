@@ -0,0 +1,108 @@
+import codecs
+import os
+import re
+import zipfile
+from typing import BinaryIO
+
+from config import PREVALIDATION_SNIFF_BYTES, TELEGRAM_DOWNLOAD_LIMIT
+
+ZIP_MAGIC = b"PK\x03\x04"
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+DOCX_REQUIRED_PARTS = ("[Content_Types].xml", "word/document.xml")
+
+TEX_MARKER = re.compile(r"\\documentclass\b")
+STY_MARKER = re.compile(r"\\(ProvidesPackage|NeedsTeXFormat|RequirePackage|newcommand|renewcommand|def)\b")
+
+# Какие файлы ожидаются в задании каждого типа проверки
+EXPECTED_EXTENSIONS = {"docx": (".docx",), "latex": (".tex", ".sty")}
+
+
+class PrevalidationError(Exception):
+    # Текст исключения показывается пользователю как есть
+    pass
+
+
+# Быстрые локальные проверки до отправки в API: ошибка возвращается текстом для пользователя, None — всё в порядке.
+# Проверки идут в три этапа: метаданные — до постановки в очередь, начало файла — по первым скачанным
+# байтам, структура .docx — после скачивания, так как центральный каталог ZIP лежит в конце файла
+def check_metadata(check_type: str, files: list[dict]) -> str | None:
+    for f, extension in zip(files, EXPECTED_EXTENSIONS[check_type]):
+        if not (f.get("file_name") or "").lower().endswith(extension):
+            return f"Ожидался файл с расширением {extension}."
+        size = f.get("file_size")
+        if size == 0:
+            return f"Файл {f['file_name']} пустой."
+        if size is not None and size > TELEGRAM_DOWNLOAD_LIMIT:
+            return (f"Файл {f['file_name']} больше {TELEGRAM_DOWNLOAD_LIMIT // (1024 * 1024)} МБ: "
+                    f"Telegram не позволяет боту скачивать такие файлы.")
+    return None
+
+
+def check_docx_header(head: bytes) -> str | None:
+    if head.startswith(OLE_MAGIC):
+        return "Файл в старом формате .doc, переименованный в .docx. Сохраните документ в Word как .docx."
+    if not head.startswith(ZIP_MAGIC):
+        return "Файл не является документом .docx."
+    return None
+
+
+def sniff_text(head: bytes) -> tuple[str | None, str | None]:
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return None, "Файл сохранён в кодировке UTF-16. Сохраните его в UTF-8."
+    if b"\x00" in head:
+        return None, "Файл содержит двоичные данные и не похож на текстовый."
+
+    # Начало файла могло оборвать многобайтовый символ, поэтому декодер не финализируется
+    try:
+        return codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=False), None
+    except UnicodeDecodeError:
+        return head.decode("cp1251", errors="replace"), None
+
+
+def check_tex_header(head: bytes) -> str | None:
+    text, error = sniff_text(head)
+    if error:
+        return error
+    if not TEX_MARKER.search(text):
+        return "В начале .tex файла не найдена команда \\documentclass."
+    return None
+
+
+def check_sty_header(head: bytes) -> str | None:
+    text, error = sniff_text(head)
+    if error:
+        return error
+    if not STY_MARKER.search(text):
+        return "Файл .sty не похож на стилевой пакет LaTeX (нет \\ProvidesPackage и других команд пакета)."
+    return None
+
+
+HEADER_CHECKS = {".docx": check_docx_header, ".tex": check_tex_header, ".sty": check_sty_header}
+
+
+def check_header(file_name: str, head: bytes) -> str | None:
+    # head — первые PREVALIDATION_SNIFF_BYTES байт файла (или весь файл, если он короче)
+    check = HEADER_CHECKS.get(os.path.splitext(file_name)[1].lower())
+    return check(head[:PREVALIDATION_SNIFF_BYTES]) if check else None
+
+
+def check_docx(file: BinaryIO) -> str | None:
+    # ZipFile читает только центральный каталог в конце файла, содержимое не распаковывается
+    try:
+        with zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+    except (zipfile.BadZipFile, OSError):
+        return "Файл .docx повреждён и не открывается."
+    finally:
+        file.seek(0)
+
+    if not all(part in names for part in DOCX_REQUIRED_PARTS):
+        return "Архив не содержит текста документа Word (word/document.xml)."
+    return None
+
+
+def prevalidate(check_type: str, files: list[BinaryIO]) -> str | None:
+    # Начало файлов уже проверено при скачивании, здесь остаётся только структура .docx
+    if check_type == "docx":
+        return check_docx(files[0])
+    return None
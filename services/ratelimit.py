@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+# Token bucket: rate токенов в секунду, не больше capacity про запас. rate <= 0 отключает лимит
+# (например, *_PER_MIN=0 в настройках): ограничивает только пауза после 429
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Забирает токены, если они есть, и возвращает 0; иначе возвращает, сколько секунд ждать
+    def try_acquire(self, tokens: float = 1) -> float:
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def refund(self, tokens: float = 1):
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    async def acquire(self, tokens: float = 1):
+        # Ожидающие обслуживаются по очереди, чтобы поздний запрос не обгонял ранний
+        async with self._lock:
+            while (wait := self.try_acquire(tokens)) > 0:
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        # Например, после 429 от Telegram: до истечения паузы токены не выдаются
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+
+# Набор корзин по ключу (пользователь, чат) с вытеснением давно не использованных
+class BucketRegistry:
+    def __init__(self, rate: float, capacity: float, max_size: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets: OrderedDict[object, TokenBucket] = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_size:
+                # Корзина, которая успела наполниться, ничем не отличается от новой — её можно выбросить
+                for old_key in [k for k, b in self._buckets.items() if b.idle][:len(self._buckets) - self.max_size]:
+                    del self._buckets[old_key]
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
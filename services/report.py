@@ -0,0 +1,75 @@
+import gzip
+import html
+from datetime import datetime
+
+from aiogram.types import BufferedInputFile
+
+from config import REPORT_COMPRESS
+from services.formatting import docx_validation_aspects, latex_validation_aspects, verdict
+
+TITLES = {"docx": "DOCX", "latex": "LaTeX"}
+
+STYLE = """
+body { font-family: -apple-system, "Segoe UI", Roboto, Arial, sans-serif; max-width: 960px; margin: 2em auto;
+       padding: 0 1em; color: #222; line-height: 1.45; }
+h1 { font-size: 1.5em; }
+table { border-collapse: collapse; width: 100%; margin-bottom: 2em; }
+td { border-bottom: 1px solid #ddd; padding: .5em; vertical-align: top; }
+td.verdict { white-space: nowrap; }
+blockquote { margin: .3em 0 0; padding-left: .8em; border-left: 3px solid #ccc; color: #555; white-space: pre-line; }
+ol li { margin-bottom: .4em; }
+"""
+
+
+def _aspects(check_type: str, result: dict) -> list[tuple]:
+    return docx_validation_aspects(result) if check_type == "docx" else latex_validation_aspects(result)
+
+
+def render_html_report(check_type: str, doc_type: str, result: dict) -> str:
+    # Самодостаточная страница: те же аспекты и ошибки, что в сообщениях, без внешних ресурсов.
+    # Подробности аспектов уже в HTML-разметке Telegram, а значения из документа экранированы
+    # при сборке аспектов (formatting.listing), поэтому разметка вставляется как есть
+    rows = []
+    for aspect in _aspects(check_type, result):
+        name, validity, detail = aspect if len(aspect) == 3 else (*aspect, "")
+        rows.append(f"<tr><td>{html.escape(name)}{detail}</td><td class=\"verdict\">{validity}</td></tr>")
+
+    errors = result.get("errors", [])
+    errors_html = (
+        "<ol>" + "".join(f"<li>{html.escape(e)}</li>" for e in errors) + "</ol>"
+        if errors else "<p>Ошибок не найдено😊</p>"
+    )
+
+    title = f"Результат проверки {TITLES[check_type]}-документа"
+    return (
+        "<!DOCTYPE html>\n"
+        f"<html lang=\"ru\"><head><meta charset=\"utf-8\"><title>{title}</title><style>{STYLE}</style></head><body>"
+        f"<h1>📋 {title}</h1>"
+        f"<p>Тип документа: {html.escape(doc_type)}<br>Дата проверки: {datetime.now():%d.%m.%Y %H:%M}</p>"
+        f"<p><b>Правильное оформление:</b> {verdict(result.get('valid', True))}</p>"
+        f"<h2>🔎 Детали проверки</h2><table>{''.join(rows)}</table>"
+        f"<h2>⚠️ Обнаруженные ошибки ({len(errors)})</h2>{errors_html}"
+        "</body></html>"
+    )
+
+
+def build_report_file(check_type: str, doc_type: str, result: dict) -> BufferedInputFile:
+    data = render_html_report(check_type, doc_type, result).encode("utf-8")
+    filename = f"report_{check_type}_{doc_type}_{datetime.now():%Y%m%d_%H%M}.html"
+    if REPORT_COMPRESS:
+        return BufferedInputFile(gzip.compress(data), filename=filename + ".gz")
+    return BufferedInputFile(data, filename=filename)
+
+
+def report_summary(check_type: str, result: dict) -> str:
+    aspects = _aspects(check_type, result)
+    failed = [aspect[0] for aspect in aspects if aspect[1] != verdict(True)]
+    lines = [
+        f"📋 <b>Результат проверки {TITLES[check_type]}-документа</b>\n",
+        f"💬 <u><b>Правильное оформление:</b></u> {verdict(result.get('valid', True))}",
+        f"⚠️ Ошибок: {len(result.get('errors', []))}",
+    ]
+    if failed:
+        lines.append(f"❌ Не выполнено требований: {len(failed)} из {len(aspects)}")
+    lines.append("\nОтчёт большой, поэтому полный результат — в файле ниже.")
+    return "\n".join(lines)
@@ -0,0 +1,128 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+from logger import logger
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Сервис недоступен, повтор через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+# Circuit breaker: после failure_threshold сбоев подряд запросы сразу отклоняются на recovery_timeout секунд,
+# затем пропускается один пробный запрос, и по его исходу цепь замыкается или снова размыкается.
+# Пока пробный запрос выполняется, остальные опрашивают breaker раз в poll_interval секунд
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, poll_interval: float = 1.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.poll_interval = poll_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        # 0 — запрос можно отправлять сейчас
+        if self.state == CLOSED:
+            return 0.0
+        if self.state == OPEN:
+            return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+        return self.poll_interval if self._trial_in_flight else 0.0
+
+    def before_call(self):
+        wait = self.retry_after()
+        if wait > 0:
+            raise CircuitOpenError(wait)
+        if self.state == OPEN:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_in_flight = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.opened_total += 1
+            self._set_state(OPEN)
+
+    def release_trial(self):
+        # Пробный запрос прерван (например, отменой задачи) и ничего не сказал о сервисе:
+        # следующий запрос станет новым пробным, счётчик сбоев не меняется
+        self._trial_in_flight = False
+
+    def _set_state(self, state: str):
+        logger.warning("Circuit breaker %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened_total": self.opened_total,
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+# Статистика вызовов одного метода API
+@dataclass
+class CallStats:
+    calls: int = 0
+    failures: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    last_time: float = 0.0
+
+    def record(self, elapsed: float, ok: bool):
+        self.calls += 1
+        self.failures += not ok
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_time = elapsed
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "avg_time": round(self.total_time / self.calls, 3) if self.calls else 0.0,
+            "max_time": round(self.max_time, 3),
+            "last_time": round(self.last_time, 3),
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    # Экспоненциальная задержка с полным джиттером, чтобы повторы разных клиентов не совпадали
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def retry(call: Callable[[], Awaitable[T]], attempts: int, base: float, cap: float,
+                retryable: Callable[[Exception], bool]) -> T:
+    assert attempts >= 1, "retry: нужна хотя бы одна попытка"
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == attempts - 1 or not retryable(e):
+                raise
+            delay = backoff_delay(attempt, base, cap)
+            logger.debug("Повтор запроса через %.2f с после ошибки: %s", delay, e)
+            await asyncio.sleep(delay)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from config import RESULT_CACHE_DB, RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES
+from db import open_connection, run_in_db_thread
+from services.metrics import DB_QUERY_SECONDS
+from services.tracing import span
+
+# Соединение открывается и используется только в потоке БД
+_connection: sqlite3.Connection | None = None
+
+
+async def _run(func, *args):
+    def call():
+        global _connection
+        if _connection is None:
+            _connection = open_connection(RESULT_CACHE_DB)
+        with DB_QUERY_SECONDS.labels("cache", func.__name__.lstrip("_")).time(), _connection:
+            return func(_connection, *args)
+
+    with span(f"cache.{func.__name__.lstrip('_')}"):
+        return await run_in_db_thread(call)
+
+
+def _init_result_cache(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS validation_cache (
+            cache_key TEXT PRIMARY KEY,
+            check_type TEXT NOT NULL,
+            doc_type TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_validation_cache_last_access ON validation_cache (last_access)"
+    )
+
+
+async def init_result_cache():
+    await _run(_init_result_cache)
+
+
+async def close_result_cache():
+    def close():
+        global _connection
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+    await run_in_db_thread(close)
+
+
+def rules_fingerprint(rules: dict) -> str:
+    return hashlib.sha256(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def combine_digests(digests: list[str]) -> str:
+    # SHA-256 файлов считается при скачивании, здесь они только сводятся в один хэш
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256("|".join(digests).encode("utf-8")).hexdigest()
+
+
+def make_cache_key(check_type: str, doc_type: str, files_hash: str, rules: dict) -> str:
+    # Ключ: содержимое всех файлов + тип проверки и документа + версия правил
+    parts = [check_type, doc_type, rules_fingerprint(rules), files_hash]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _get_cached_result(conn: sqlite3.Connection, cache_key: str, now: float) -> str | None:
+    row = conn.execute(
+        "SELECT result FROM validation_cache WHERE cache_key = ? AND created_at >= ?",
+        (cache_key, now - RESULT_CACHE_TTL)
+    ).fetchone()
+    if not row:
+        return None
+    conn.execute("UPDATE validation_cache SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+    return row[0]
+
+
+async def get_cached_result(cache_key: str) -> dict | None:
+    result = await _run(_get_cached_result, cache_key, time.time())
+    return json.loads(result) if result is not None else None
+
+
+def _save_cached_result(conn: sqlite3.Connection, row: tuple, now: float):
+    conn.execute('''
+        INSERT OR REPLACE INTO validation_cache (cache_key, check_type, doc_type, result, created_at, last_access)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', row)
+
+    # Вытеснение: сначала устаревшие по TTL, затем самые давно использованные сверх лимита
+    conn.execute("DELETE FROM validation_cache WHERE created_at < ?", (now - RESULT_CACHE_TTL,))
+    conn.execute('''
+        DELETE FROM validation_cache WHERE cache_key IN (
+            SELECT cache_key FROM validation_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+        )
+    ''', (RESULT_CACHE_MAX_ENTRIES,))
+
+
+async def save_cached_result(cache_key: str, check_type: str, doc_type: str, result: dict):
+    now = time.time()
+    row = (cache_key, check_type, doc_type, json.dumps(result, ensure_ascii=False), now, now)
+    await _run(_save_cached_result, row, now)
+
+
+def _invalidate_cached_results(conn: sqlite3.Connection, doc_type: str | None):
+    if doc_type:
+        conn.execute("DELETE FROM validation_cache WHERE doc_type = ?", (doc_type,))
+    else:
+        conn.execute("DELETE FROM validation_cache")
+
+
+async def invalidate_cached_results(doc_type: str = None):
+    await _run(_invalidate_cached_results, doc_type)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from config import RULES_CACHE_TTL, RULES_CACHE_MAX_STALE
+from logger import logger
+from services.api import get_doc_options, get_rules
+
+OPTIONS_KEY = "options"
+
+
+# TTL-кэш со stale-while-revalidate: устаревшее значение отдаётся сразу, а обновление идёт в фоне
+class AsyncTTLCache:
+    def __init__(self, ttl: float, max_stale: float):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: dict[str, tuple[Any, float]] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        # Поколение ключа растёт при сбросе, чтобы запоздавший ответ не вернул старые правила
+        self._generations: dict[str, int] = {}
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        entry = self._entries.get(key)
+        if entry:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.max_stale:
+                self.refresh(key, loader)
+                return value
+        return await self.refresh(key, loader)
+
+    def refresh(self, key: str, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        # Одновременные промахи по одному ключу ждут один и тот же запрос к API
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, loader))
+            self._inflight[key] = task
+        return task
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        generation = self._generations.get(key, 0)
+        try:
+            value = await loader()
+            if value is not None and generation == self._generations.get(key, 0):
+                self._entries[key] = (value, time.monotonic())
+            elif key in self._entries:
+                logger.warning("Не удалось обновить кэш %s, используется сохранённое значение", key)
+                return self._entries[key][0]
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def invalidate(self, key: str = None, prefix: str = None) -> list[str]:
+        if key is not None:
+            keys = [key]
+        else:
+            keys = [k for k in {*self._entries, *self._inflight} if prefix is None or k.startswith(prefix)]
+        for k in keys:
+            self._entries.pop(k, None)
+            self._generations[k] = self._generations.get(k, 0) + 1
+            self._inflight.pop(k, None)
+        return keys
+
+
+_cache = AsyncTTLCache(ttl=RULES_CACHE_TTL, max_stale=RULES_CACHE_MAX_STALE)
+
+
+def _rules_key(doc_type: str) -> str:
+    return f"rules:{doc_type}"
+
+
+async def get_doc_options_cached():
+    return await _cache.get(OPTIONS_KEY, get_doc_options)
+
+
+async def get_rules_cached(doc_type: str):
+    return await _cache.get(_rules_key(doc_type), lambda: get_rules(doc_type))
+
+
+def invalidate_rules(doc_type: str = None):
+    # Правила удаляются сразу и тут же перечитываются в фоне
+    if doc_type:
+        evicted = _cache.invalidate(_rules_key(doc_type.lower()))
+    else:
+        evicted = _cache.invalidate(prefix="rules:")
+    for key in evicted:
+        evicted_type = key.split(":", 1)[1]
+        _cache.refresh(key, lambda t=evicted_type: get_rules(t))
+    logger.debug("Кэш правил сброшен: %s", ", ".join(evicted) or "нет записей")
+
+
+async def warm_up():
+    options = await _cache.refresh(OPTIONS_KEY, get_doc_options)
+    if not options:
+        logger.warning("Не удалось прогреть кэш правил: API не вернул типы документов")
+        return
+    doc_types = [opt["name"].lower() for opt in options]
+    await asyncio.gather(*(_cache.refresh(_rules_key(t), lambda t=t: get_rules(t)) for t in doc_types))
+    logger.info("Кэш правил прогрет: %s", ", ".join(doc_types))
@@ -0,0 +1,230 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from config import VALIDATION_WORKERS, VALIDATION_CONCURRENCY, QUEUE_POSITION_UPDATE_INTERVAL
+from logger import logger
+from services.metrics import (VALIDATION_QUEUE_DEPTH, VALIDATION_ACTIVE, VALIDATION_WAIT_SECONDS,
+                              VALIDATION_JOB_SECONDS)
+from services.tracing import start_trace
+
+QUEUED_TEXT = "⏳ Документ поставлен в очередь на проверку. Позиция в очереди: {position}"
+OVERLOADED_TEXT = ("⚠️ Сервис проверки сейчас перегружен. Документ в очереди, позиция: {position}. "
+                   "Проверка начнётся автоматически.")
+
+
+@dataclass
+class ValidationJob:
+    user_id: int
+    chat_id: int
+    username: str | None
+    check_type: str
+    doc_type: str
+    # [{"file_id": ..., "file_unique_id": ..., "file_name": ..., "file_size": ...}]
+    files: list[dict]
+    status_message_id: int | None = None
+    position: int | None = None
+    status_text: str | None = None
+    running: bool = False
+    # Результат начал отправляться: после сбоя задание не повторяется, чтобы отчёт не пришёл дважды
+    delivery_started: bool = False
+    # Трассировка апдейта, создавшего задание; у заданий, поднятых из журнала, её нет
+    trace_id: str | None = None
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def dedup_key(self) -> tuple:
+        # Одни и те же файлы того же пользователя с тем же типом проверки — одно и то же задание
+        files = tuple(f.get("file_unique_id") or f["file_id"] for f in self.files)
+        return self.user_id, self.check_type, self.doc_type, files
+
+
+# Очередь проверок: пул воркеров, общий лимит параллельности и round-robin между пользователями
+class ValidationScheduler:
+    def __init__(self, workers: int, concurrency: int, position_update_interval: float):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.position_update_interval = position_update_interval
+        # Порядок ключей — порядок обхода пользователей
+        self._queues: OrderedDict[int, deque[ValidationJob]] = OrderedDict()
+        self._condition = asyncio.Condition()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: list[asyncio.Task] = []
+        self._positions_dirty = False
+        self._bot: Bot | None = None
+        self._process: Callable[[Bot, ValidationJob], Awaitable[None]] | None = None
+        # gate() возвращает, сколько секунд подождать перед следующим заданием (0 — можно начинать)
+        self._gate: Callable[[], float] = lambda: 0.0
+        self.paused = False
+        self.active = 0
+        # dedup_key -> задание, которое стоит в очереди или выполняется
+        self._inflight: dict[tuple, ValidationJob] = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def start(self, bot: Bot, process: Callable[[Bot, ValidationJob], Awaitable[None]],
+                    gate: Callable[[], float] = None):
+        self._bot = bot
+        self._process = process
+        if gate is not None:
+            self._gate = gate
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._position_updater()))
+        logger.info("Очередь проверок запущена: воркеров %s, параллельно %s", self.workers, self.concurrency)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.depth:
+            logger.warning("Очередь проверок остановлена, не обработано заданий: %s", self.depth)
+
+    def queued_text(self, position: int) -> str:
+        return (OVERLOADED_TEXT if self.paused else QUEUED_TEXT).format(position=position)
+
+    # Позиция, которую получит новое задание пользователя
+    def estimate_position(self, user_id: int) -> int:
+        queue = self._queues.get(user_id)
+        return self._position(user_id, len(queue) if queue else 0)
+
+    def claim(self, job: ValidationJob) -> ValidationJob | None:
+        # Занимает ключ задания синхронно, до первого await; возвращает уже идущее задание-дубликат
+        existing = self._inflight.get(job.dedup_key)
+        if existing is not None and existing is not job:
+            return existing
+        self._inflight[job.dedup_key] = job
+        return None
+
+    def release(self, job: ValidationJob):
+        if self._inflight.get(job.dedup_key) is job:
+            del self._inflight[job.dedup_key]
+
+    async def submit(self, job: ValidationJob) -> int:
+        self.claim(job)
+        async with self._condition:
+            self._queues.setdefault(job.user_id, deque()).append(job)
+            self._condition.notify()
+        position = self._position(job.user_id, len(self._queues[job.user_id]) - 1)
+        if job.position != position:
+            self._positions_dirty = True
+        logger.debug("Задание %s пользователя %s в очереди, позиция %s", job.job_id, job.username, position)
+        return position
+
+    async def requeue(self, job: ValidationJob):
+        # Задание, которое не удалось начать, возвращается в начало очереди
+        async with self._condition:
+            job.running = False
+            # Статус сейчас говорит о начатой проверке: сброс текста заставит обновить его позицией в очереди
+            job.status_text = None
+            self._queues.setdefault(job.user_id, deque()).appendleft(job)
+            self._queues.move_to_end(job.user_id, last=False)
+            self._condition.notify()
+        self._positions_dirty = True
+
+    def _position(self, user_id: int, index: int) -> int:
+        # За index-м заданием пользователя идут: его же предыдущие задания и по одному заданию
+        # каждого другого пользователя за каждый круг обхода
+        ahead = index
+        before = True
+        for uid, queue in self._queues.items():
+            if uid == user_id:
+                before = False
+                continue
+            ahead += min(len(queue), index + 1 if before else index)
+        return ahead + 1
+
+    def _next_job(self) -> ValidationJob:
+        user_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(user_id)
+        else:
+            del self._queues[user_id]
+        job.running = True
+        self._positions_dirty = True
+        return job
+
+    async def _worker(self, number: int):
+        while True:
+            # Задание забирается из очереди только при свободном слоте, чтобы позиции оставались честными
+            async with self._semaphore:
+                await self._wait_gate()
+                async with self._condition:
+                    while not self._queues:
+                        await self._condition.wait()
+                    job = self._next_job()
+
+                self.active += 1
+                started = time.monotonic()
+                VALIDATION_WAIT_SECONDS.observe(started - job.enqueued_at)
+                try:
+                    with start_trace("validation_job", trace_id=job.trace_id, job_id=job.job_id,
+                                     check_type=job.check_type, queue_wait=round(started - job.enqueued_at, 3)):
+                        await self._process(self._bot, job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Воркер %s: задание %s завершилось с ошибкой: %s", number, job.job_id, e)
+                finally:
+                    self.active -= 1
+                    VALIDATION_JOB_SECONDS.observe(time.monotonic() - started)
+                    # Возвращённое в очередь задание остаётся занятым до своего настоящего завершения
+                    if job.running:
+                        self.release(job)
+                logger.debug("Воркер %s: задание %s выполнено за %.1f с (ожидание в очереди %.1f с)",
+                             number, job.job_id, time.monotonic() - started, started - job.enqueued_at)
+
+    async def _wait_gate(self):
+        # Пока сервис проверки недоступен, задания остаются в очереди, а пользователи видят, почему
+        while (delay := self._gate()) > 0:
+            if not self.paused:
+                self.paused = True
+                self._positions_dirty = True
+                logger.warning("Очередь проверок приостановлена на %.0f с: сервис проверки недоступен", delay)
+            await asyncio.sleep(delay)
+        if self.paused:
+            self.paused = False
+            self._positions_dirty = True
+            logger.info("Очередь проверок возобновлена")
+
+    async def _position_updater(self):
+        while True:
+            await asyncio.sleep(self.position_update_interval)
+            if not self._positions_dirty:
+                continue
+            self._positions_dirty = False
+            for user_id, queue in list(self._queues.items()):
+                for index, job in enumerate(list(queue)):
+                    position = self._position(user_id, index)
+                    text = self.queued_text(position)
+                    if job.running or text == job.status_text or job.status_message_id is None:
+                        continue
+                    job.position = position
+                    job.status_text = text
+                    try:
+                        await self._bot.edit_message_text(
+                            text,
+                            chat_id=job.chat_id,
+                            message_id=job.status_message_id
+                        )
+                    except TelegramAPIError as e:
+                        logger.debug("Не удалось обновить позицию задания %s: %s", job.job_id, e)
+
+
+scheduler = ValidationScheduler(
+    workers=VALIDATION_WORKERS,
+    concurrency=VALIDATION_CONCURRENCY,
+    position_update_interval=QUEUE_POSITION_UPDATE_INTERVAL
+)
+VALIDATION_QUEUE_DEPTH.set_function(lambda: scheduler.depth)
+VALIDATION_ACTIVE.set_function(lambda: scheduler.active)
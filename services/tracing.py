@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from config import TRACE_SLOW_THRESHOLD, TRACE_SLOW_FILE, TRACE_MAX_SPANS
+from logger import logger, trace_id_var
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: str | None
+    attrs: dict
+    started: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    error: str | None = None
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    root: Span
+    started_at: float = field(default_factory=time.time)
+    spans: list[Span] = field(default_factory=list)
+    dropped: int = 0
+
+
+# (трассировка, текущий спан) задачи; asyncio копирует контекст в дочерние задачи,
+# поэтому фоновые задачи продолжают трассировку, в которой были созданы
+_current: ContextVar[tuple[Trace, Span] | None] = ContextVar("current_span", default=None)
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+def current_trace_id() -> str | None:
+    current = _current.get()
+    return current[0].trace_id if current else None
+
+
+def set_attrs(**attrs):
+    current = _current.get()
+    if current:
+        current[1].attrs.update(attrs)
+
+
+@contextmanager
+def start_trace(name: str, trace_id: str = None, **attrs):
+    # Корневой спан апдейта или задания; trace_id передаётся, чтобы задание продолжило трассировку апдейта
+    trace = Trace(trace_id=trace_id or _new_id(), root=Span(name, _new_id(), None, attrs))
+    token = _current.set((trace, trace.root))
+    log_token = trace_id_var.set(trace.trace_id)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.error = type(e).__name__
+        raise
+    finally:
+        trace.root.duration = time.perf_counter() - trace.root.started
+        trace_id_var.reset(log_token)
+        _current.reset(token)
+        if trace.root.duration >= TRACE_SLOW_THRESHOLD:
+            _save_slow_trace(trace)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    # Вне трассировки спан ничего не стоит: одно чтение contextvar
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    trace, parent = current
+    child = Span(name, _new_id(), parent.span_id, attrs)
+    if len(trace.spans) < TRACE_MAX_SPANS:
+        trace.spans.append(child)
+    else:
+        trace.dropped += 1
+    token = _current.set((trace, child))
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.duration = time.perf_counter() - child.started
+        _current.reset(token)
+
+
+def _span_dict(span: Span, origin: float) -> dict:
+    return {
+        "name": span.name,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "offset": round(span.started - origin, 4),
+        "duration": round(span.duration, 4) if span.duration is not None else None,
+        "attrs": span.attrs,
+        "error": span.error,
+    }
+
+
+def trace_dict(trace: Trace) -> dict:
+    root = trace.root
+    return {
+        "trace_id": trace.trace_id,
+        "span_id": root.span_id,
+        "name": root.name,
+        "started_at": datetime.fromtimestamp(trace.started_at, timezone.utc).isoformat(timespec="milliseconds"),
+        "duration": round(root.duration, 4),
+        "attrs": root.attrs,
+        "error": root.error,
+        "spans": [_span_dict(s, root.started) for s in trace.spans],
+        "dropped_spans": trace.dropped,
+    }
+
+
+def _append_line(path: str, line: str):
+    # Одна запись с O_APPEND: строки разных процессов-воркеров не перемешиваются
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def _save_slow_trace(trace: Trace):
+    line = json.dumps(trace_dict(trace), ensure_ascii=False, default=str) + "\n"
+    logger.warning("Медленная обработка %s: %.1f с, трассировка %s записана в %s",
+                   trace.root.name, trace.root.duration, trace.trace_id, TRACE_SLOW_FILE)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        _append_line(TRACE_SLOW_FILE, line)
+        return
+    future = loop.run_in_executor(None, _append_line, TRACE_SLOW_FILE, line)
+    future.add_done_callback(_report_write_error)
+
+
+def _report_write_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Не удалось записать медленную трассировку: %s", future.exception())
@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WORKER_SHUTDOWN_TIMEOUT
+from logger import logger, listen, forward_to
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Режим нескольких процессов: фронт принимает вебхук и раскладывает обновления по воркерам по chat_id,
+# поэтому весь диалог пользователя (FSM, кэш роли) живёт в одном процессе
+
+
+def chat_id_of(update: dict) -> int:
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    # Апдейты без чата и пользователя (например, незнакомого aiogram типа) всегда обрабатывает воркер 0
+    return 0
+
+
+def shard_of(update: dict, workers: int) -> int:
+    return chat_id_of(update) % workers
+
+
+async def serve_worker(bot: Bot, dp: Dispatcher, index: int, queue: multiprocessing.Queue, workers: int):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    await dp.emit_startup(bot=bot, worker_index=index, workers=workers)
+    logger.info("Воркер %s запущен", index)
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.wait(tasks, timeout=WORKER_SHUTDOWN_TIMEOUT)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        logger.info("Воркер %s остановлен", index)
+
+
+def run_worker(bot: Bot, dp: Dispatcher, index: int, queue: multiprocessing.Queue, workers: int,
+               log_queue: multiprocessing.Queue):
+    # Ctrl+C получает вся группа процессов; воркер останавливается только по команде фронта
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    forward_to(log_queue)
+    asyncio.run(serve_worker(bot, dp, index, queue, workers))
+
+
+def run_supervisor(workers: int, target, on_startup, on_shutdown):
+    # target(index, queue, workers, log_queue) — точка входа воркера; должна быть функцией модуля, чтобы её
+    # можно было передать в процесс, запущенный через spawn. Логи воркеров пишет в файл только фронт
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+    log_queue = context.Queue()
+    log_listener = listen(log_queue)
+    processes = [
+        context.Process(target=target, args=(i, queues[i], workers, log_queue), name=f"bot-worker-{i}",
+                        daemon=False)
+        for i in range(workers)
+    ]
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+        queues[shard_of(update, workers)].put(update)
+        return web.Response()
+
+    async def stop_workers(started: list):
+        for queue in queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in started:
+            await loop.run_in_executor(None, process.join, WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("%s не остановился вовремя и будет завершён", process.name)
+                process.terminate()
+
+    async def serve():
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, handle_update)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        # Порт занимается до регистрации вебхука и запуска воркеров: если он занят, бот падает сразу,
+        # не создав ни одного процесса
+        try:
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        started = []
+        try:
+            await on_startup()
+            # Обновления, пришедшие до старта воркеров, ждут их в очередях
+            for process in processes:
+                process.start()
+                started.append(process)
+            logger.info("Запущено воркеров: %s", workers)
+            await stop_event.wait()
+        finally:
+            # Сначала перестаём принимать обновления, затем даём воркерам доработать очередь
+            await runner.cleanup()
+            await stop_workers(started)
+            await on_shutdown()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        log_listener.stop()
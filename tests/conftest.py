@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Модули бота читают настройки при импорте: лог тестов пишется во временный каталог, а не в bot.log
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "test.log"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db_conn(tmp_path, monkeypatch):
+    # Отдельная база на тест; асинхронные функции db работают с ней через подменённое соединение
+    import db
+
+    conn = db.open_connection(str(tmp_path / "roles.db"))
+    with conn:
+        db._init_db(conn)
+    monkeypatch.setattr(db, "_connection", conn)
+    yield conn
+    conn.close()
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import timedelta
+
+import db
+
+
+def insert_check(conn, check_time: str, doc_type: str = "diploma", check_type: str = "docx", result: str = "1",
+                 user_id: int = 1) -> int:
+    with conn:
+        return conn.execute('''
+            INSERT INTO checks_history (user_id, doc_type, check_type, result, check_time)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, doc_type, check_type, result, check_time)).lastrowid
+
+
+def test_compact_history_uses_check_time_offset(db_conn):
+    now = db.local_now()
+    expired = insert_check(db_conn, (now - timedelta(days=30, hours=4)).isoformat())
+    kept = insert_check(db_conn, (now - timedelta(days=30) + timedelta(hours=4)).isoformat())
+
+    assert asyncio.run(db.compact_history(retention_days=30)) == 1
+    ids = [row[0] for row in db_conn.execute("SELECT id FROM checks_history")]
+    assert ids == [kept]
+
+
+
+def fill_history(conn) -> list[int]:
+    # Проверки всех групп вперемешку, по три с одинаковым check_time; возвращает id в порядке вывода
+    # /recent_checks: группа типа документа, затем новые раньше старых
+    now = db.local_now()
+    doc_types = ["diploma", "essay", "course_work", None, "practice_report", "diploma", "course_work", "thesis"]
+    rows = []
+    for i in range(27):
+        check_time = (now - timedelta(minutes=10 * (i // 3))).isoformat()
+        doc_type = doc_types[i % len(doc_types)]
+        rows.append((db._group_of(doc_type), check_time, insert_check(conn, check_time, doc_type)))
+    rows.sort(key=lambda r: (r[1], r[2]), reverse=True)
+    rows.sort(key=lambda r: r[0])
+    return [row_id for _, _, row_id in rows]
+
+
+def ids(page: db.ChecksPage) -> list[int]:
+    return [row[0] for row in page.rows]
+
+
+def test_checks_pages_forward_match_full_scan(db_conn):
+    expected = fill_history(db_conn)
+
+    pages = [asyncio.run(db.get_checks_page(days=1, limit=4))]
+    while pages[-1].has_next:
+        pages.append(asyncio.run(db.get_checks_page(days=1, anchor_id=pages[-1].rows[-1][0], limit=4)))
+
+    assert [row_id for page in pages for row_id in ids(page)] == expected
+    assert not pages[0].has_prev
+    assert all(page.has_prev for page in pages[1:])
+    assert all(len(page.rows) == 4 for page in pages[:-1])
+
+
+def test_checks_pages_backward_match_forward(db_conn):
+    fill_history(db_conn)
+    forward = [asyncio.run(db.get_checks_page(days=1, limit=4))]
+    while forward[-1].has_next:
+        forward.append(asyncio.run(db.get_checks_page(days=1, anchor_id=forward[-1].rows[-1][0], limit=4)))
+
+    # С последней страницы назад: каждая предыдущая страница совпадает с той, что была при движении вперёд
+    page = forward[-1]
+    for previous in reversed(forward[:-1]):
+        page = asyncio.run(db.get_checks_page(days=1, anchor_id=page.rows[0][0], backwards=True, limit=4))
+        assert ids(page) == ids(previous)
+        assert page.has_next
+    assert not page.has_prev
+
+
+def test_checks_pages_skip_old_checks(db_conn):
+    recent = insert_check(db_conn, db.local_now().isoformat())
+    insert_check(db_conn, (db.local_now() - timedelta(days=15)).isoformat())
+
+    page = asyncio.run(db.get_checks_page(days=14, limit=4))
+    assert ids(page) == [recent]
+    assert not page.has_prev and not page.has_next
+
+
+def history_aggregate(conn) -> list[tuple]:
+    return conn.execute('''
+        SELECT substr(check_time, 1, 10), COALESCE(doc_type, ''), COALESCE(check_type, ''),
+               COALESCE(result, ''), COUNT(*)
+        FROM checks_history
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+    ''').fetchall()
+
+
+def daily_stats(conn) -> list[tuple]:
+    return conn.execute('''
+        SELECT day, doc_type, check_type, result, count FROM checks_daily_stats ORDER BY 1, 2, 3, 4
+    ''').fetchall()
+
+
+def test_daily_stats_match_history_after_backfill_and_inserts(db_conn):
+    # База из версии без агрегатов: история есть, таблицы checks_daily_stats ещё нет
+    with db_conn:
+        db_conn.execute("DROP TABLE checks_daily_stats")
+    now = db.local_now()
+    for days_ago, doc_type, result in [(0, "diploma", "1"), (0, "diploma", "1"), (0, "diploma", "0"),
+                                       (1, "course_work", "0"), (3, None, "1"), (3, "essay", "1")]:
+        insert_check(db_conn, (now - timedelta(days=days_ago)).isoformat(), doc_type, result=result)
+
+    with db_conn:
+        db._init_db(db_conn)
+    assert daily_stats(db_conn) == history_aggregate(db_conn)
+
+    for doc_type, check_type, result in [("diploma", "docx", True), ("diploma", "latex", False),
+                                         ("practice_report", "docx", True), ("diploma", "docx", True)]:
+        asyncio.run(db.save_check_result(user_id=2, doc_type=doc_type, check_type=check_type, result=result))
+    assert daily_stats(db_conn) == history_aggregate(db_conn)
+    # Повторный запуск не пересчитывает уже заполненные агрегаты
+    with db_conn:
+        db._init_db(db_conn)
+    assert daily_stats(db_conn) == history_aggregate(db_conn)
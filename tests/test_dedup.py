@@ -0,0 +1,66 @@
+import asyncio
+
+from aiogram.types import Update
+
+from middlewares import dedup
+from middlewares.dedup import DedupMiddleware, TTLSet
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_key_is_new_only_once_within_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    seen = TTLSet(ttl=60, max_size=100)
+
+    assert seen.add(1)
+    assert not seen.add(1)
+    clock.now += 59
+    assert not seen.add(1)
+
+
+def test_key_expires_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    seen = TTLSet(ttl=60, max_size=100)
+
+    seen.add(1)
+    clock.now += 30
+    seen.add(2)
+    clock.now += 31
+    assert seen.add(1)
+    assert not seen.add(2)
+
+
+def test_oldest_keys_are_evicted_at_max_size(monkeypatch):
+    monkeypatch.setattr(dedup.time, "monotonic", Clock())
+    seen = TTLSet(ttl=60, max_size=3)
+
+    for key in (1, 2, 3, 4):
+        assert seen.add(key)
+    assert len(seen._expires) == 3
+    assert not seen.add(4)
+    assert seen.add(1)
+
+
+def test_middleware_skips_repeated_update():
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event.update_id)
+        return "handled"
+
+    async def scenario():
+        middleware = DedupMiddleware(ttl=60, max_size=100)
+        first = await middleware(handler, Update(update_id=7), {})
+        repeated = await middleware(handler, Update(update_id=7), {})
+        return first, repeated
+
+    assert asyncio.run(scenario()) == ("handled", None)
+    assert calls == [7]
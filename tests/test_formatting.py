@@ -0,0 +1,48 @@
+import re
+
+from services.formatting import TAG_RE, _hard_split, listing, split_html
+
+
+def balanced(chunk: str) -> bool:
+    stack = []
+    for match in TAG_RE.finditer(chunk):
+        closing, name = match.group(1), match.group(2).lower()
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def test_short_text_is_one_chunk():
+    assert split_html("<b>Итог</b>\n\nОшибок нет") == ["<b>Итог</b>\n\nОшибок нет"]
+
+
+def test_chunks_fit_limit_and_keep_tags_balanced():
+    text = "<b>Отчёт</b>\n\n" + "<blockquote>" + "\n".join(f"📌 Ошибка номер {i}" for i in range(200)) + "</blockquote>"
+    chunks = split_html(text, limit=300)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert all(balanced(chunk) for chunk in chunks)
+    # Текст без разметки не теряется и не дублируется
+    numbers = [int(n) for chunk in chunks for n in re.findall(r"Ошибка номер (\d+)", chunk)]
+    assert numbers == list(range(200))
+
+
+def test_listing_escapes_document_values():
+    assert listing(["<script>", "A & B"]) == "&lt;script&gt;, A &amp; B"
+    assert listing([]) == "нет"
+
+
+def test_hard_split_keeps_tag_at_line_start_whole():
+    # Единственный пробел строки — внутри открывающего тега, и тег длиннее лимита
+    line = '<a href="https://example.com/' + "x" * 150 + '" title="ссылка">' + "слово" * 60 + "</a>"
+    parts = _hard_split(line, 100)
+    assert "".join(parts) == line
+    assert all(part.count("<") == part.count(">") for part in parts)
+    assert parts[0].startswith("<a ") and parts[0].endswith(">")
+
+
+def test_hard_split_keeps_entity_at_line_start_whole():
+    line = "&laquo;" + "a" * 20
+    assert _hard_split(line, 4)[0] == "&laquo;"
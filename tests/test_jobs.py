@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import db
+from handlers import documents
+from services.scheduler import ValidationJob, ValidationScheduler
+
+FILES = [{"file_id": "f", "file_unique_id": "u", "file_name": "work.docx", "file_size": 100}]
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.sent.append(("edit", chat_id, text))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(("send", chat_id, text))
+
+
+@pytest.fixture
+def fresh_scheduler(monkeypatch):
+    scheduler = ValidationScheduler(workers=1, concurrency=1, position_update_interval=1)
+    monkeypatch.setattr(documents, "scheduler", scheduler)
+    return scheduler
+
+
+def journal(job_id: str, chat_id: int = 1):
+    asyncio.run(db.journal_job(job_id, 1, chat_id, "student", "docx", "diploma", FILES, 10))
+
+
+def job_row(conn, job_id: str) -> tuple:
+    return conn.execute("SELECT status, attempts FROM validation_jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+
+def make_job(job_id: str) -> ValidationJob:
+    return ValidationJob(user_id=1, chat_id=1, username="student", check_type="docx", doc_type="diploma",
+                         files=FILES, status_message_id=10, job_id=job_id)
+
+
+def test_result_of_a_job_is_recorded_once(db_conn):
+    journal("job")
+
+    async def finish_twice():
+        kwargs = dict(user_id=1, doc_type="diploma", check_type="docx", result=True, job_id="job")
+        return await db.save_check_result(**kwargs), await db.save_check_result(**kwargs)
+
+    assert asyncio.run(finish_twice()) == (True, False)
+    assert db_conn.execute("SELECT COUNT(*) FROM checks_history").fetchone() == (1,)
+    assert db_conn.execute("SELECT SUM(count) FROM checks_daily_stats").fetchone() == (1,)
+    assert job_row(db_conn, "job")[0] == db.JOB_DONE
+
+
+def test_retry_counts_the_attempt_and_requeue_does_not(db_conn):
+    journal("job")
+
+    asyncio.run(db.mark_job_running("job"))
+    assert asyncio.run(db.retry_job("job")) == 1
+    assert job_row(db_conn, "job") == (db.JOB_QUEUED, 1)
+
+    asyncio.run(db.mark_job_running("job"))
+    asyncio.run(db.requeue_job("job"))
+    assert job_row(db_conn, "job") == (db.JOB_QUEUED, 1)
+
+    # Задание, которое не выполняется, не возвращается в очередь
+    assert asyncio.run(db.retry_job("job")) is None
+
+
+def test_unfinished_jobs_are_split_by_shard(db_conn):
+    # Отрицательные chat_id — группы; шард считается так же, как в supervisor.shard_of
+    chat_ids = [1, 2, 3, 4, -1001, -1002, -1003]
+    for chat_id in chat_ids:
+        journal(f"job{chat_id}", chat_id)
+    journal("done", 3)
+    asyncio.run(db.fail_job("done"))
+
+    for shard in range(3):
+        loaded = asyncio.run(db.load_unfinished_jobs(shard, 3))
+        assert sorted(job.chat_id for job in loaded) == sorted(c for c in chat_ids if c % 3 == shard)
+    assert len(asyncio.run(db.load_unfinished_jobs())) == len(chat_ids)
+
+
+def test_crashed_job_is_requeued_until_attempts_run_out(db_conn, fresh_scheduler, monkeypatch):
+    monkeypatch.setattr(documents, "JOB_MAX_ATTEMPTS", 2)
+    journal("job")
+    job = make_job("job")
+    bot = FakeBot()
+
+    async def crash(bot, job):
+        await db.mark_job_running(job.job_id)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(documents, "_run_validation_job", crash)
+    asyncio.run(documents.run_validation_job(bot, job))
+    assert fresh_scheduler.depth == 1
+    assert job_row(db_conn, "job") == (db.JOB_QUEUED, 1)
+    assert bot.sent == []
+
+    fresh_scheduler._next_job()
+    asyncio.run(documents.run_validation_job(bot, job))
+    assert fresh_scheduler.depth == 0
+    assert job_row(db_conn, "job") == (db.JOB_FAILED, 2)
+    assert bot.sent == [("edit", 1, documents.FAILED_TEXT)]
+
+
+def test_job_is_not_repeated_after_delivery_started(db_conn, fresh_scheduler, monkeypatch):
+    journal("job")
+    job = make_job("job")
+    bot = FakeBot()
+
+    async def crash_while_sending(bot, job):
+        await db.mark_job_running(job.job_id)
+        job.delivery_started = True
+        await db.mark_job_delivering(job.job_id)
+        raise RuntimeError("telegram is down")
+
+    monkeypatch.setattr(documents, "_run_validation_job", crash_while_sending)
+    asyncio.run(documents.run_validation_job(bot, job))
+    assert fresh_scheduler.depth == 0
+    assert job_row(db_conn, "job") == (db.JOB_FAILED, 1)
+    assert bot.sent == [("edit", 1, documents.PARTIAL_DELIVERY_TEXT)]
+
+
+def test_resume_skips_delivering_and_exhausted_jobs(db_conn, fresh_scheduler, monkeypatch):
+    monkeypatch.setattr(documents, "JOB_MAX_ATTEMPTS", 2)
+    for job_id in ("fresh", "delivering", "exhausted"):
+        journal(job_id)
+    asyncio.run(db.mark_job_running("delivering"))
+    asyncio.run(db.mark_job_delivering("delivering"))
+    for _ in range(2):
+        asyncio.run(db.mark_job_running("exhausted"))
+
+    bot = FakeBot()
+    asyncio.run(documents.resume_validation_jobs(bot))
+    assert [job.job_id for queue in fresh_scheduler._queues.values() for job in queue] == ["fresh"]
+    assert job_row(db_conn, "delivering")[0] == db.JOB_FAILED
+    assert job_row(db_conn, "exhausted")[0] == db.JOB_FAILED
+    assert sorted(text for _, _, text in bot.sent) == sorted([documents.PARTIAL_DELIVERY_TEXT,
+                                                             documents.FAILED_TEXT])
@@ -0,0 +1,81 @@
+import io
+import zipfile
+
+from services.prevalidation import (OLE_MAGIC, check_docx, check_header, check_metadata, check_sty_header,
+                                    check_tex_header)
+
+
+def make_docx(parts=("[Content_Types].xml", "word/document.xml")) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in parts:
+            archive.writestr(name, "<xml/>")
+    return buffer.getvalue()
+
+
+def test_valid_docx_passes():
+    data = make_docx()
+    assert check_header("work.docx", data) is None
+    file = io.BytesIO(data)
+    assert check_docx(file) is None
+    assert file.tell() == 0
+
+
+def test_renamed_doc_is_rejected_by_header():
+    assert "старом формате .doc" in check_header("work.docx", OLE_MAGIC + b"\x00" * 100)
+
+
+def test_non_zip_docx_is_rejected():
+    assert check_header("work.docx", b"%PDF-1.7") == "Файл не является документом .docx."
+
+
+def test_truncated_docx_is_rejected():
+    data = make_docx()
+    # Начало архива на месте, а центрального каталога в конце нет
+    truncated = io.BytesIO(data[:len(data) // 2])
+    assert check_header("work.docx", truncated.getvalue()) is None
+    assert check_docx(truncated) == "Файл .docx повреждён и не открывается."
+
+
+def test_docx_without_document_part_is_rejected():
+    assert "word/document.xml" in check_docx(io.BytesIO(make_docx(parts=("[Content_Types].xml",))))
+
+
+def test_utf16_tex_is_rejected():
+    data = "\\documentclass{article}".encode("utf-16")
+    assert "UTF-16" in check_tex_header(data)
+
+
+def test_binary_tex_is_rejected():
+    assert "двоичные данные" in check_tex_header(b"\\documentclass{article}\x00\x01")
+
+
+def test_tex_needs_documentclass():
+    assert check_tex_header("% Курсовая\n\\documentclass[12pt]{article}\n".encode("utf-8")) is None
+    assert check_tex_header("\\documentclass{article}".encode("cp1251")) is None
+    assert "\\documentclass" in check_tex_header(b"\\begin{document}")
+
+
+def test_tex_head_may_end_inside_a_character():
+    head = "\\documentclass{article}\n% Введение".encode("utf-8")[:-1]
+    assert check_tex_header(head) is None
+
+
+def test_sty_needs_package_commands():
+    assert check_sty_header(b"\\ProvidesPackage{gost}") is None
+    assert check_sty_header(b"\\newcommand{\\x}{1}") is None
+    assert "стилевой пакет" in check_sty_header(b"just some text")
+
+
+def test_unknown_extension_is_not_checked():
+    assert check_header("notes.txt", b"\x00\x00") is None
+
+
+def test_metadata_checks():
+    docx = {"file_name": "Work.DOCX", "file_size": 1000}
+    assert check_metadata("docx", [docx]) is None
+    assert "расширением .docx" in check_metadata("docx", [{"file_name": "work.pdf", "file_size": 10}])
+    assert "пустой" in check_metadata("docx", [{"file_name": "work.docx", "file_size": 0}])
+    assert "Telegram" in check_metadata("docx", [{"file_name": "work.docx", "file_size": 50 * 1024 * 1024}])
+    assert check_metadata("latex", [{"file_name": "main.tex"}, {"file_name": "gost.sty"}]) is None
+    assert ".sty" in check_metadata("latex", [{"file_name": "main.tex"}, {"file_name": "gost.tex"}])
@@ -0,0 +1,40 @@
+import time
+
+from services.ratelimit import TokenBucket
+
+
+def test_bucket_allows_burst_then_reports_wait():
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.5
+
+
+def test_bucket_refills_over_time():
+    bucket = TokenBucket(rate=100, capacity=1)
+    assert bucket.try_acquire() == 0
+    time.sleep(0.02)
+    assert bucket.try_acquire() == 0
+
+
+def test_pause_blocks_until_expired():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    bucket.pause(0.05)
+    assert bucket.try_acquire() > 0
+    time.sleep(0.06)
+    assert bucket.try_acquire() == 0
+
+
+def test_refund_does_not_exceed_capacity():
+    bucket = TokenBucket(rate=1, capacity=2)
+    bucket.refund(5)
+    assert [bucket.try_acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.try_acquire() > 0
+
+
+def test_zero_rate_disables_limit():
+    bucket = TokenBucket(rate=0, capacity=0)
+    assert all(bucket.try_acquire() == 0 for _ in range(100))
+    # Пауза после 429 действует и без лимита
+    bucket.pause(0.05)
+    assert bucket.try_acquire() > 0
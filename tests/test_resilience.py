@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, retry
+
+
+def open_breaker(recovery_timeout: float = 30) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=recovery_timeout, poll_interval=0.5)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def expire(breaker: CircuitBreaker):
+    breaker.opened_at -= breaker.recovery_timeout
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.before_call()
+    assert 0 < e.value.retry_after <= 30
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = open_breaker()
+    expire(breaker)
+
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Пока пробный запрос выполняется, остальные ждут недолго, а не весь recovery_timeout
+    assert breaker.retry_after() == breaker.poll_interval
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.retry_after() == 0
+
+
+def test_failed_trial_reopens():
+    breaker = open_breaker()
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened_total == 2
+    assert breaker.retry_after() > breaker.poll_interval
+
+
+def test_released_trial_frees_the_slot():
+    breaker = open_breaker()
+    expire(breaker)
+    breaker.before_call()
+    failures = breaker.failures
+
+    breaker.release_trial()
+    assert breaker.state == HALF_OPEN
+    assert breaker.failures == failures
+    assert breaker.retry_after() == 0
+    breaker.before_call()
+
+
+def test_retry_repeats_retryable_errors():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("down")
+        return "ok"
+
+    assert asyncio.run(retry(flaky, attempts=3, base=0, cap=0, retryable=lambda e: True)) == "ok"
+    assert len(calls) == 3
+
+
+def test_retry_gives_up():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(retry(failing, attempts=2, base=0, cap=0, retryable=lambda e: True))
+    assert len(calls) == 2
+
+    calls.clear()
+    with pytest.raises(ConnectionError):
+        asyncio.run(retry(failing, attempts=3, base=0, cap=0, retryable=lambda e: False))
+    assert len(calls) == 1
+
+
+def test_retry_needs_an_attempt():
+    async def call():
+        return "ok"
+
+    with pytest.raises(AssertionError):
+        asyncio.run(retry(call, attempts=0, base=0, cap=0, retryable=lambda e: True))
@@ -0,0 +1,105 @@
+import asyncio
+
+from services.scheduler import ValidationJob, ValidationScheduler
+
+
+def make_job(user_id: int, n: int) -> ValidationJob:
+    return ValidationJob(
+        user_id=user_id,
+        chat_id=user_id,
+        username=f"user{user_id}",
+        check_type="docx",
+        doc_type="coursework",
+        files=[{"file_id": f"{user_id}-{n}", "file_unique_id": f"{user_id}-{n}", "file_name": "work.docx"}],
+        job_id=f"{user_id}-{n}",
+    )
+
+
+def make_scheduler() -> ValidationScheduler:
+    return ValidationScheduler(workers=1, concurrency=1, position_update_interval=1)
+
+
+def drain(scheduler: ValidationScheduler) -> list[str]:
+    order = []
+    while scheduler._queues:
+        order.append(scheduler._next_job().job_id)
+    return order
+
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        scheduler = make_scheduler()
+        for job in (make_job(1, 1), make_job(1, 2), make_job(1, 3), make_job(2, 1), make_job(3, 1)):
+            await scheduler.submit(job)
+        return drain(scheduler)
+
+    # Пользователь с тремя файлами не задерживает остальных дольше, чем на одно задание
+    assert asyncio.run(scenario()) == ["1-1", "2-1", "3-1", "1-2", "1-3"]
+
+
+def test_positions_match_service_order():
+    async def scenario():
+        scheduler = make_scheduler()
+        jobs = [make_job(1, 1), make_job(2, 1), make_job(1, 2), make_job(3, 1), make_job(2, 2), make_job(1, 3)]
+        positions = {}
+        for job in jobs:
+            positions[job.job_id] = await scheduler.submit(job)
+        # Позиции, выданные при постановке, могли сдвинуться из-за пользователей, пришедших позже
+        current = {
+            job.job_id: scheduler._position(user_id, index)
+            for user_id, queue in scheduler._queues.items()
+            for index, job in enumerate(queue)
+        }
+        return positions, current, drain(scheduler)
+
+    positions, current, order = asyncio.run(scenario())
+    assert positions["1-1"] == 1
+    assert positions["2-1"] == 2
+    assert {job_id: order.index(job_id) + 1 for job_id in order} == current
+
+
+def test_estimate_position_for_new_user():
+    async def scenario():
+        scheduler = make_scheduler()
+        for job in (make_job(1, 1), make_job(1, 2), make_job(2, 1)):
+            await scheduler.submit(job)
+        estimate = scheduler.estimate_position(3)
+        await scheduler.submit(make_job(3, 1))
+        return estimate, drain(scheduler)
+
+    estimate, order = asyncio.run(scenario())
+    assert estimate == 3
+    assert order.index("3-1") + 1 == estimate
+
+
+def test_requeued_job_goes_first():
+    async def scenario():
+        scheduler = make_scheduler()
+        for job in (make_job(1, 1), make_job(2, 1), make_job(3, 1)):
+            await scheduler.submit(job)
+        job = scheduler._next_job()
+        job.status_text = "⏳ Проверка документа началась"
+        await scheduler.requeue(job)
+        assert not job.running
+        # Статус «проверка началась» будет заменён позицией в очереди
+        assert job.status_text is None
+        return drain(scheduler)
+
+    assert asyncio.run(scenario()) == ["1-1", "2-1", "3-1"]
+
+
+def test_claim_returns_duplicate_until_release():
+    scheduler = make_scheduler()
+    first = make_job(1, 1)
+    same_files = make_job(1, 1)
+    same_files.job_id = "other"
+
+    assert scheduler.claim(first) is None
+    assert scheduler.claim(same_files) is first
+    assert scheduler.claim(make_job(1, 2)) is None
+
+    scheduler.release(first)
+    assert scheduler.claim(same_files) is None
+    # Освобождать ключ может только задание, которое его заняло
+    scheduler.release(first)
+    assert scheduler.claim(make_job(1, 1)) is same_files
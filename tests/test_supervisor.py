@@ -0,0 +1,38 @@
+from supervisor import chat_id_of, shard_of
+
+CHAT = {"id": -1001234, "type": "supergroup"}
+USER = {"id": 42, "is_bot": False, "first_name": "Студент"}
+
+
+def test_message_types_use_chat_id():
+    message = {"message_id": 1, "date": 0, "chat": CHAT, "from": USER}
+    assert chat_id_of({"update_id": 1, "message": message}) == CHAT["id"]
+    assert chat_id_of({"update_id": 2, "edited_message": message}) == CHAT["id"]
+
+
+def test_callback_query_uses_chat_of_its_message():
+    callback = {"id": "1", "from": USER, "chat_instance": "x",
+                "message": {"message_id": 5, "date": 0, "chat": CHAT}}
+    assert chat_id_of({"update_id": 3, "callback_query": callback}) == CHAT["id"]
+
+
+def test_events_without_chat_use_user_id():
+    inline_query = {"id": "1", "from": USER, "query": "", "offset": ""}
+    assert chat_id_of({"update_id": 4, "inline_query": inline_query}) == USER["id"]
+
+
+def test_unknown_updates_go_to_shard_zero():
+    assert chat_id_of({"update_id": 5}) == 0
+    assert chat_id_of({"update_id": 6, "future_event": {"id": "1"}}) == 0
+    assert shard_of({"update_id": 7, "future_event": {"id": "1"}}, workers=4) == 0
+
+
+def test_dialog_stays_in_one_shard():
+    message = {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "from": USER}
+    callback = {"id": "1", "from": USER, "chat_instance": "x", "message": message}
+    shards = {shard_of(update, workers=3) for update in (
+        {"update_id": 1, "message": message},
+        {"update_id": 2, "callback_query": callback},
+        {"update_id": 3, "edited_message": message},
+    )}
+    assert shards == {42 % 3}